@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+class BeatScheduler:
+    """ Emits 'on_beat' and 'on_measure' as music time passes the beats of a song """
+
+    __slots__ = '_times', '_in_measure', '_cursor', '_action'
+
+    def __init__(self, timing_points: Iterable['TimingPoint'], end: float):
+        """ Precompute every beat until `end` (seconds) from the uninherited
+        `timing_points`. Beats before the first point are extended backwards. """
+        sections = [point for point in timing_points if point.uninherited]
+        times, in_measure = [], []
+        for i, point in enumerate(sections):
+            stop = sections[i+1].time if i + 1 < len(sections) else end
+            beat = point.beat_length / 1000
+            before = int(point.time // beat) if i == 0 else 0
+            count = max(0, int(np.ceil((stop - point.time) / beat)))
+            index = np.arange(-before, count)
+            times.append(point.time + index * beat)
+            in_measure.append(index % point.meter)
+        self._times = np.concatenate(times) if times else np.empty(0)
+        self._in_measure = np.concatenate(in_measure) if in_measure else np.empty(0, dtype=int)
+        self._cursor = 0  # index of the next beat to emit
+        self._action: Dict[str, List[Tuple[Callable[[BeatScheduler], Any], Any]]] = {
+            'on_beat': [],
+            'on_measure': [],
+        }
+
+    def add_action(self, key: str, action: Callable[[BeatScheduler], Any], id_: Optional[Any] = None):
+        """ Add an action to stack with `key` and optionally `id_` """
+        if id_ is None:
+            id_ = id(action)
+        self._action[key].append((action, id_))
+
+    def remove_action(self, key: str, id_: Any):
+        """ Remove an action to stack with `key` and `id_` """
+        for index, (_, elem) in enumerate(self._action[key]):
+            if elem == id_:
+                self._action[key].pop(index)
+                break
+        else:
+            raise IndexError("id doesn't exist")
+
+    def _call_action(self, key: str):
+        for action, _ in self._action[key]:
+            action(self)
+
+    def update(self, time: float):
+        """ Call every frame with current music time (seconds). Emits for the
+        latest beat passed; beats skipped over by a jump are not replayed. """
+        times = self._times
+        cursor = self._cursor
+        if cursor and time < times[cursor-1]:
+            # went backwards, e.g. preview restarted
+            self._cursor = int(np.searchsorted(times, time, 'right'))
+            return
+        if cursor >= len(times) or time < times[cursor]:
+            return
+        cursor += 1
+        if cursor < len(times) and time >= times[cursor]:
+            cursor = int(np.searchsorted(times, time, 'right'))
+        self._cursor = cursor
+        self._call_action('on_beat')
+        if self._in_measure[cursor-1] == 0:
+            self._call_action('on_measure')
+
+    def reset(self, time: float):
+        """ Move to `time` (seconds) without emitting """
+        self._cursor = int(np.searchsorted(self._times, time, 'right'))
+
+    @property
+    def beat(self) -> int:
+        """ Return index of the last beat passed, -1 if none """
+        return self._cursor - 1
+
+    @property
+    def beat_in_measure(self) -> int:
+        """ Return position of the last beat passed in its measure, 0 for downbeats """
+        return int(self._in_measure[self._cursor-1]) if self._cursor else 0
+
+    @property
+    def beat_times(self) -> np.ndarray:
+        """ Return time (seconds) of every beat """
+        return self._times
+
+    def progress(self, time: float) -> float:
+        """ Return how far `time` is between the last beat and the next, in [0, 1) """
+        cursor = self._cursor
+        if not cursor or cursor >= len(self._times):
+            return 0.
+        last, next_ = self._times[cursor-1], self._times[cursor]
+        return min(max((time - last) / (next_ - last), 0.), 1.)
@@ -0,0 +1,3 @@
+from .preview import PreviewCache, PreviewClip, PreviewPlayer
+from .ui import UISound, get_sound
+from .backend import Backend, PygletBackend, NullBackend, get_backend, set_backend
@@ -0,0 +1,189 @@
+""" Pluggable audio output so the game can run without a sound device """
+from __future__ import annotations
+
+from abc import ABCMeta, abstractmethod
+from collections import deque
+from typing import Any, List, NamedTuple, Optional, Deque
+import itertools
+import time
+
+import pyglet
+
+_backend: Optional[Backend] = None
+
+
+class Backend(metaclass=ABCMeta):
+    """ Creates players and plays sources """
+
+    @abstractmethod
+    def create_player(self) -> 'pyglet.media.Player':
+        """ Return a new player. Players of every backend have the subset of
+        pyglet.media.Player used by the game: queue, play, pause, seek,
+        next_source, time, playing, volume and source. """
+        raise NotImplementedError
+
+    @abstractmethod
+    def play_once(self, source: pyglet.media.Source):
+        """ Play `source` from the start on a throwaway player """
+        raise NotImplementedError
+
+
+class PygletBackend(Backend):
+    """ Plays through pyglet's audio driver """
+
+    def create_player(self) -> pyglet.media.Player:
+        return pyglet.media.Player()
+
+    def play_once(self, source: pyglet.media.Source):
+        source.play()
+
+
+class AudioEvent(NamedTuple):
+    """ Represents something a NullPlayer was told to do """
+    time: float  # seconds on the backend clock
+    player: int
+    action: str  # 'queue', 'play', 'pause', 'seek', 'next_source', 'play_once', or 'eos' when a source ends
+    detail: Any = None
+
+
+class NullBackend(Backend):
+    """ Plays nothing but keeps time and records every event.
+
+    With `realtime` the clock follows time.perf_counter, otherwise it only
+    moves when advance() is called so a run can go as fast as possible. """
+
+    __slots__ = 'events', '_realtime', '_start', '_time', '_ids'
+
+    def __init__(self, realtime: bool = True):
+        self.events: List[AudioEvent] = []
+        self._realtime = realtime
+        self._start = time.perf_counter()
+        self._time = 0.
+        self._ids = itertools.count()
+
+    @property
+    def time(self) -> float:
+        """ Return current time of the backend clock (seconds) """
+        if self._realtime:
+            return time.perf_counter() - self._start
+        return self._time
+
+    def advance(self, dt: float):
+        """ Move the virtual clock forward by `dt` seconds """
+        assert not self._realtime, 'cannot advance a realtime clock'
+        assert dt >= 0
+        self._time += dt
+
+    def record(self, player: int, action: str, detail: Any = None, at: Optional[float] = None):
+        """ Log `action` of `player` at backend time `at`, now if None """
+        self.events.append(AudioEvent(self.time if at is None else at, player, action, detail))
+
+    def create_player(self) -> NullPlayer:
+        return NullPlayer(self, next(self._ids))
+
+    def play_once(self, source: pyglet.media.Source):
+        self.record(-1, 'play_once', source)
+
+
+class NullPlayer:
+    """ Stand-in for pyglet.media.Player following the clock of a NullBackend """
+
+    __slots__ = '_backend', '_id', '_playlist', '_source', '_position', '_started', 'volume'
+
+    def __init__(self, backend: NullBackend, id_: int):
+        self._backend = backend
+        self._id = id_
+        self._playlist: Deque[pyglet.media.Source] = deque()
+        self._source: Optional[pyglet.media.Source] = None
+        self._position = 0.
+        self._started: Optional[float] = None
+        self.volume = 1.
+
+    def _roll(self):
+        """ Move on to the next queued source for each one that ended while
+        playing, continuing it from where the last ended, and stop at the end
+        of the last one, as a player does """
+        while self._started is not None:
+            duration = self._source.duration
+            if duration is None:
+                return
+            end = self._started + duration - self._position  # on the backend clock
+            if end > self._backend.time:
+                return
+            self._backend.record(self._id, 'eos', self._source, end)
+            if self._playlist:
+                self._source = self._playlist.popleft()
+                self._position = 0.
+                self._started = end
+            else:
+                self._position = duration
+                self._started = None
+
+    def queue(self, source: pyglet.media.Source):
+        self._roll()
+        self._backend.record(self._id, 'queue', source)
+        if self._source is None:
+            self._source = source
+            self._position = 0.
+        else:
+            self._playlist.append(source)
+
+    def play(self):
+        if self._started is None and self._source is not None:
+            self._backend.record(self._id, 'play', self._position)
+            self._started = self._backend.time
+
+    def pause(self):
+        self._roll()
+        if self._started is not None:
+            self._position = self.time
+            self._started = None
+            self._backend.record(self._id, 'pause', self._position)
+
+    def seek(self, timestamp: float):
+        self._roll()
+        self._backend.record(self._id, 'seek', timestamp)
+        self._position = timestamp
+        if self._started is not None:
+            self._started = self._backend.time
+
+    def next_source(self):
+        self._roll()
+        self._backend.record(self._id, 'next_source')
+        was_playing = self._started is not None
+        self._started = None
+        self._position = 0.
+        self._source = self._playlist.popleft() if self._playlist else None
+        if was_playing:
+            self.play()
+
+    @property
+    def source(self) -> Optional[pyglet.media.Source]:
+        self._roll()
+        return self._source
+
+    @property
+    def time(self) -> float:
+        self._roll()
+        if self._started is None:
+            return self._position
+        return self._position + self._backend.time - self._started
+
+    @property
+    def playing(self) -> bool:
+        self._roll()
+        return self._started is not None
+
+
+def get_backend() -> Backend:
+    """ Return the backend audio is played through """
+    global _backend
+    if _backend is None:
+        _backend = PygletBackend()
+    return _backend
+
+
+def set_backend(backend: Backend):
+    """ Play all audio created from now on through `backend` """
+    global _backend
+    _backend = backend
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from typing import Optional, Tuple
+from pathlib import Path
+
+import numpy as np
+import pyglet
+
+
+def read_pcm(source: pyglet.media.Source, start: float = 0., duration: Optional[float] = None,
+             buffer_size: int = 1 << 16) -> bytes:
+    """ Decode `duration` seconds-- or until the end if None --of `source`
+    starting at `start` (seconds) and return the raw PCM bytes.
+    Format of the bytes is `source.audio_format`. """
+    audio_format = source.audio_format
+    assert audio_format is not None, 'source has no audio'
+    if start:
+        source.seek(start)
+    if duration is None:
+        wanted = None
+    else:
+        wanted = int(duration * audio_format.bytes_per_second)
+        wanted -= wanted % audio_format.bytes_per_sample
+
+    chunks = []
+    size = 0
+    while wanted is None or size < wanted:
+        audio_data = source.get_audio_data(buffer_size)
+        if not audio_data:
+            break
+        data = audio_data.get_string_data()
+        chunks.append(data)
+        size += len(data)
+    data = b''.join(chunks)
+    if wanted is not None:
+        data = data[:wanted]
+    return data
+
+
+def to_array(data: bytes, audio_format: pyglet.media.codecs.AudioFormat) -> np.ndarray:
+    """ Return PCM `data` as float32 array of shape (frames, channels) in [-1, 1] """
+    if audio_format.sample_size == 16:
+        samples = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768
+    elif audio_format.sample_size == 8:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    else:
+        raise ValueError(f'unsupported sample size {audio_format.sample_size}')
+    return samples.reshape(-1, audio_format.channels)
+
+
+def from_array(samples: np.ndarray, audio_format: pyglet.media.codecs.AudioFormat) -> bytes:
+    """ Return float `samples` of shape (frames, channels) as PCM bytes in `audio_format` """
+    samples = np.clip(samples, -1, 1)
+    if audio_format.sample_size == 16:
+        return (samples * 32767).astype('<i2').tobytes()
+    if audio_format.sample_size == 8:
+        return (samples * 127 + 128).astype(np.uint8).tobytes()
+    raise ValueError(f'unsupported sample size {audio_format.sample_size}')
+
+
+def conform(samples: np.ndarray, from_rate: int, sample_rate: int, channels: int) -> np.ndarray:
+    """ Return `samples` of shape (frames, channels) recorded at `from_rate`
+    resampled to `sample_rate` with `channels` channels """
+    if from_rate != sample_rate:
+        length = round(len(samples) * sample_rate / from_rate)
+        x = np.linspace(0, len(samples) - 1, length)
+        samples = np.stack([np.interp(x, np.arange(len(samples)), samples[:, c])
+                            for c in range(samples.shape[1])], axis=1)
+    if samples.shape[1] != channels:
+        samples = np.repeat(samples.mean(axis=1, keepdims=True), channels, axis=1)
+    return samples.astype(np.float32)
+
+
+def load_mono(filepath: Path) -> Tuple[np.ndarray, int]:
+    """ Decode the whole file at `filepath` and return (samples, sample_rate)
+    with channels averaged to mono """
+    source = pyglet.media.load(str(filepath), streaming=True)
+    samples = to_array(read_pcm(source), source.audio_format)
+    return samples.mean(axis=1), source.audio_format.sample_rate
@@ -0,0 +1,153 @@
+""" Integrated loudness of songs, analysed in the background and used as playback gain """
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional, Iterable, List, Set
+import queue
+import threading
+import warnings
+
+import numpy as np
+import pyglet
+
+from game.audio.decode import to_array
+
+TARGET = -16.  # LUFS songs are brought down to
+MIN_GAIN = 0.1
+
+_executor: Optional[ProcessPoolExecutor] = None
+_submitted: Set[Path] = set()
+_lock = threading.Lock()
+_analysed: queue.SimpleQueue[Path] = queue.SimpleQueue()  # recorded, not taken yet
+
+
+def k_weighting(frequencies: np.ndarray) -> np.ndarray:
+    """ Return power response of the BS.1770 K-weighting filter at `frequencies` (Hz).
+
+    Both biquads are evaluated with their 48 kHz coefficients, which is
+    close enough at other sample rates for normalization. """
+    z = np.exp(-2j * np.pi * np.minimum(frequencies, 24000) / 48000)
+    shelf = (1.53512485958697 - 2.69169618940638 * z + 1.19839281085285 * z ** 2) / \
+            (1 - 1.69065929318241 * z + 0.73248077421585 * z ** 2)
+    high_pass = (1 - 2 * z + z ** 2) / (1 - 1.99004745483398 * z + 0.99007225036621 * z ** 2)
+    return np.abs(shelf * high_pass) ** 2
+
+
+def segment_powers(source: pyglet.media.Source, segment: float = 0.1) -> np.ndarray:
+    """ Return mean square of K-weighted `source` per channel for each
+    `segment` seconds, shape (segments, channels). Decodes as it goes. """
+    audio_format = source.audio_format
+    length = int(segment * audio_format.sample_rate)
+    weights = k_weighting(np.fft.rfftfreq(length, 1 / audio_format.sample_rate))
+    # Parseval over a real spectrum: inner bins count twice
+    weights[1:(length + 1) // 2] *= 2
+    weights /= length ** 2
+
+    powers = []
+    carry = np.empty((0, audio_format.channels), dtype=np.float32)
+    while True:
+        audio_data = source.get_audio_data(1 << 18)
+        if not audio_data:
+            break
+        samples = np.concatenate((carry, to_array(audio_data.get_string_data(), audio_format)))
+        n = len(samples) // length * length
+        if n:
+            segments = samples[:n].reshape(-1, length, audio_format.channels)
+            spectra = np.abs(np.fft.rfft(segments, axis=1)) ** 2
+            powers.append(np.einsum('sfc,f->sc', spectra, weights))
+        carry = samples[n:]
+    if not powers:
+        return np.empty((0, audio_format.channels))
+    return np.concatenate(powers)
+
+
+def integrated_loudness(powers: np.ndarray) -> float:
+    """ Return gated loudness (LUFS) from `powers` of 100 ms segments.
+
+    Blocks are 400 ms with 75% overlap, gated at -70 LUFS and then 10 LU
+    below the loudness of the blocks left. Surround channel weights are
+    ignored, every channel counts the same. """
+    if len(powers) < 4:
+        return -70.
+    blocks = np.lib.stride_tricks.sliding_window_view(powers, 4, axis=0).mean(axis=2).sum(axis=1)
+    with np.errstate(divide='ignore'):
+        loudness = -0.691 + 10 * np.log10(blocks)
+    blocks = blocks[loudness > -70]
+    if not len(blocks):
+        return -70.
+    relative = -0.691 + 10 * np.log10(blocks.mean()) - 10
+    with np.errstate(divide='ignore'):
+        blocks = blocks[-0.691 + 10 * np.log10(blocks) > relative]
+    return float(-0.691 + 10 * np.log10(blocks.mean()))
+
+
+def analyze(filepath: Path) -> Dict[str, Any]:
+    """ Return library fields of the audio at `filepath`: its integrated
+    loudness (LUFS) and, for mp3s, the frame index giving its duration.
+    Runs in a worker process. """
+    from game.audio import mp3
+    source = pyglet.media.load(str(filepath), streaming=True)
+    values = {'loudness': integrated_loudness(segment_powers(source))}
+    if filepath.suffix.lower() == '.mp3':
+        try:
+            values.update(mp3.scan(filepath).to_entry())
+        except ValueError:
+            pass
+    return values
+
+
+def to_gain(loudness: float) -> float:
+    """ Return player volume bringing `loudness` (LUFS) to TARGET. Never amplifies. """
+    return float(np.clip(10 ** ((TARGET - loudness) / 20), MIN_GAIN, 1.))
+
+
+def gain(beatmap: 'Beatmap') -> float:
+    """ Return the playback gain of the song of `beatmap`, 1 if not analysed yet """
+    from game import library
+    entry = library.get_entry(beatmap.get_folder_path() / beatmap.audio_filename)
+    if 'loudness' in entry:
+        return to_gain(entry['loudness'])
+    return 1.
+
+
+def analyze_library(beatmaps: Iterable['Beatmap']):
+    """ Analyse songs of `beatmaps` missing from the library index in a worker
+    pool and record each result as it completes. Paths recorded are handed
+    out by take_analysed. """
+    from game import library
+    global _executor
+    for beatmap in beatmaps:
+        filepath = beatmap.get_folder_path() / beatmap.audio_filename
+        with _lock:
+            if filepath in _submitted or not filepath.exists():
+                continue
+            entry = library.get_entry(filepath)
+            if 'loudness' in entry and ('frames' in entry or filepath.suffix.lower() != '.mp3'):
+                continue
+            _submitted.add(filepath)
+            if _executor is None:
+                _executor = ProcessPoolExecutor()
+        future = _executor.submit(analyze, filepath)
+        future.add_done_callback(lambda f, filepath=filepath: _record(filepath, f))
+
+
+def _record(filepath: Path, future):
+    from game import library
+    try:
+        values = future.result()
+    except Exception as e:
+        warnings.warn(f"analysing loudness... failed for '{filepath}': {e!r}", RuntimeWarning)
+        return
+    library.update(filepath, **values)
+    _analysed.put(filepath)
+
+
+def take_analysed() -> List[Path]:
+    """ Return paths of the songs recorded since the last call """
+    paths = []
+    while True:
+        try:
+            paths.append(_analysed.get_nowait())
+        except queue.Empty:
+            return paths
@@ -0,0 +1,289 @@
+""" MP3 frame index from a single pass over frame headers, for exact duration and direct seeks """
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional, Tuple, Dict, Any
+import base64
+import mmap
+import warnings
+import zlib
+
+import numpy as np
+import pyglet
+
+_BITRATES = {  # (version is MPEG1, layer) -> kbps by bitrate index
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+DECODER_DELAY = 529  # samples every mp3 decoder outputs before the first encoded one
+PREROLL = 2  # frames decoded before a seek target to refill the bit reservoir
+
+
+def parse_header(buffer, offset: int) -> Optional[Tuple[int, int, int, int, int]]:
+    """ Return (frame length, samples per frame, sample rate, kbps, side info size)
+    of the frame header at `offset`, None if there is no valid header """
+    b0, b1, b2, b3 = buffer[offset:offset+4]
+    if b0 != 0xFF or b1 & 0xE0 != 0xE0:
+        return None
+    version, layer = (b1 >> 3) & 3, 4 - ((b1 >> 1) & 3)
+    bitrate_index, sample_rate_index = b2 >> 4, (b2 >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    kbps = _BITRATES[mpeg1, layer][bitrate_index]
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 1
+    mono = b3 >> 6 == 3
+    if layer == 1:
+        return (12000 * kbps // sample_rate + padding) * 4, 384, sample_rate, kbps, 0
+    if layer == 2:
+        return 144000 * kbps // sample_rate + padding, 1152, sample_rate, kbps, 0
+    if mpeg1:
+        return 144000 * kbps // sample_rate + padding, 1152, sample_rate, kbps, 17 if mono else 32
+    return 72000 * kbps // sample_rate + padding, 576, sample_rate, kbps, 9 if mono else 17
+
+
+def _skip_id3(buffer) -> int:
+    offset = 0
+    while buffer[offset:offset+3] == b'ID3':
+        flags = buffer[offset+5]
+        size = 0
+        for byte in buffer[offset+6:offset+10]:
+            size = size << 7 | byte & 0x7F
+        offset += 10 + size + (10 if flags & 0x10 else 0)
+    return offset
+
+
+def _encoder_padding(buffer, offset: int, side_info: int) -> Optional[Tuple[int, int]]:
+    """ Return (encoder delay, padding) if the frame at `offset` is a Xing/Info
+    frame, (0, 0) if it has no LAME tag, None if it is an audio frame """
+    position = offset + 4 + side_info
+    tag = buffer[position:position+4]
+    if buffer[offset+36:offset+40] == b'VBRI':
+        return 0, 0
+    if tag not in (b'Xing', b'Info'):
+        return None
+    flags = int.from_bytes(buffer[position+4:position+8], 'big')
+    position += 8 + 4 * bool(flags & 1) + 4 * bool(flags & 2) + 100 * bool(flags & 4) + 4 * bool(flags & 8)
+    if buffer[position:position+4] not in (b'LAME', b'Lavc', b'Lavf'):
+        return 0, 0
+    b0, b1, b2 = buffer[position+21:position+24]
+    return b0 << 4 | b1 >> 4, (b1 & 0xF) << 8 | b2
+
+
+class FrameIndex:
+    """ Represents byte offsets of every audio frame of an mp3 file """
+
+    __slots__ = 'offsets', 'sample_rate', 'samples_per_frame', 'skip', 'duration', 'bitrate'
+
+    def __init__(self, offsets: np.ndarray, sample_rate: int, samples_per_frame: int,
+                 skip: int, duration: float, bitrate: float):
+        """
+        :param offsets: byte offset of each audio frame
+        :param skip: decoded samples dropped before time 0
+        :param duration: playable length (seconds)
+        :param bitrate: average bitrate (kbps)
+        """
+        self.offsets = offsets
+        self.sample_rate = sample_rate
+        self.samples_per_frame = samples_per_frame
+        self.skip = skip
+        self.duration = duration
+        self.bitrate = bitrate
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def frame_at(self, timestamp: float) -> int:
+        """ Return the frame decoding to `timestamp` (seconds) """
+        frame = int((timestamp * self.sample_rate + self.skip) // self.samples_per_frame)
+        return max(0, min(frame, len(self.offsets) - 1))
+
+    def time_of(self, frame: int) -> float:
+        """ Return timestamp (seconds) of the first sample of `frame` """
+        return (frame * self.samples_per_frame - self.skip) / self.sample_rate
+
+    def to_entry(self) -> Dict[str, Any]:
+        """ Return fields to store in the library index. Offsets are delta
+        encoded and compressed, which makes constant bitrate files tiny. """
+        deltas = np.diff(self.offsets, prepend=0).astype('<u4')
+        return {'duration': self.duration, 'sample_rate': self.sample_rate, 'bitrate': self.bitrate,
+                'samples_per_frame': self.samples_per_frame, 'skip': self.skip,
+                'frames': base64.b64encode(zlib.compress(deltas.tobytes())).decode('ascii')}
+
+    @classmethod
+    def from_entry(cls, entry: Dict[str, Any]) -> Optional[FrameIndex]:
+        """ Return the index stored by to_entry, None if `entry` has none """
+        if 'frames' not in entry:
+            return None
+        deltas = np.frombuffer(zlib.decompress(base64.b64decode(entry['frames'])), dtype='<u4')
+        return cls(np.cumsum(deltas, dtype=np.int64), entry['sample_rate'], entry['samples_per_frame'],
+                   entry['skip'], entry['duration'], entry['bitrate'])
+
+
+def scan(filepath: Path) -> FrameIndex:
+    """ Walk the frame headers of the mp3 at `filepath`. Nothing is decoded.
+    Raises ValueError if no frames are found. """
+    with open(filepath, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with buffer:
+        size = len(buffer)
+        offset = _skip_id3(buffer)
+        offsets = []
+        audio_bytes = 0
+        first = None  # (samples per frame, sample rate) every frame must share
+        padding = None
+        while offset + 4 <= size:
+            header = parse_header(buffer, offset)
+            if header and first and header[1:3] != first:
+                header = None
+            if header is None or offset + header[0] > size:
+                if buffer[offset:offset+3] == b'TAG' or buffer[offset:offset+8] == b'APETAGEX':
+                    break
+                # lost sync, take the next header followed by another one
+                offset = buffer.find(b'\xFF', offset + 1)
+                while offset != -1 and offset + 4 <= size:
+                    header = parse_header(buffer, offset)
+                    if header and (not first or header[1:3] == first):
+                        after = offset + header[0]
+                        if after + 4 > size or parse_header(buffer, after):
+                            break
+                    offset = buffer.find(b'\xFF', offset + 1)
+                else:
+                    break
+                continue
+
+            length, samples_per_frame, sample_rate, _, side_info = header
+            if first is None:
+                first = samples_per_frame, sample_rate
+                padding = _encoder_padding(buffer, offset, side_info)
+                if padding is not None:
+                    offset += length
+                    continue
+            offsets.append(offset)
+            audio_bytes += length
+            offset += length
+
+    if not offsets:
+        raise ValueError(f'{filepath} has no mp3 frames')
+    samples_per_frame, sample_rate = first
+    delay, end_padding = padding or (0, 0)
+    samples = len(offsets) * samples_per_frame
+    skip = 0
+    if delay or end_padding:
+        skip = delay + DECODER_DELAY
+        samples -= delay + end_padding
+    duration = samples / sample_rate
+    bitrate = audio_bytes * 8 / (len(offsets) * samples_per_frame / sample_rate) / 1000
+    return FrameIndex(np.array(offsets, dtype=np.int64), sample_rate, samples_per_frame, skip, duration, bitrate)
+
+
+def get_index(filepath: Path, scan_missing: bool = True) -> Optional[FrameIndex]:
+    """ Return the frame index of the mp3 at `filepath` from the library,
+    scanning and storing it on first use if `scan_missing`. None if it is
+    not an mp3 or not indexed. """
+    from game import library
+    if filepath.suffix.lower() != '.mp3':
+        return None
+    index = FrameIndex.from_entry(library.get_entry(filepath))
+    if index is None and scan_missing:
+        try:
+            index = scan(filepath)
+        except (ValueError, OSError) as e:
+            warnings.warn(f"indexing mp3... failed for '{filepath}': {e!r}", ResourceWarning)
+            return None
+        library.update(filepath, **index.to_entry())
+    return index
+
+
+def get_duration(beatmap: 'Beatmap', scan_missing: bool = True) -> Optional[float]:
+    """ Return length (seconds) of the song of `beatmap` without decoding it,
+    None if unknown. Only the library is read unless `scan_missing`. """
+    index = get_index(beatmap.get_folder_path() / beatmap.audio_filename, scan_missing)
+    return index.duration if index else None
+
+
+def open_song(beatmap: 'Beatmap') -> pyglet.media.Source:
+    """ Return a streaming source of the song of `beatmap`, seeking through
+    the frame index if it is an mp3 """
+    source = beatmap.resource_loader.media(beatmap.audio_filename, streaming=True)
+    index = get_index(beatmap.get_folder_path() / beatmap.audio_filename)
+    if index is None:
+        return source
+    return IndexedSource(source, index)
+
+
+class IndexedSource(pyglet.media.StreamingSource):
+    """ Wraps an FFmpeg mp3 source so seeks jump straight to the byte offset
+    of the target frame instead of letting the demuxer search for it """
+
+    def __init__(self, source: pyglet.media.Source, index: FrameIndex):
+        self._source = source.get_queue_source()
+        self._index = index
+        self.audio_format = self._source.audio_format
+        self.video_format = None
+        self._duration = index.duration
+        self._position = 0.  # timestamp of the next byte returned
+        self._discard = 0  # bytes to drop before reaching the seek target
+        self._leftover = b''
+
+    def seek(self, timestamp: float):
+        audio_format = self.audio_format
+        frame = self._index.frame_at(timestamp) - PREROLL
+        self._leftover = b''
+        self._position = timestamp
+        self._discard = 0
+        if frame <= 0 or not _seek_bytes(self._source, int(self._index.offsets[frame])):
+            self._source.seek(timestamp)
+            return
+        discard = int((timestamp - self._index.time_of(frame)) * audio_format.bytes_per_second)
+        self._discard = discard - discard % audio_format.bytes_per_sample
+
+    def get_audio_data(self, bytes, compensation_time=0.0):
+        from pyglet.media.codecs import AudioData
+        bytes_per_second = self.audio_format.bytes_per_second
+        data = self._leftover
+        while self._discard or not data:
+            audio_data = self._source.get_audio_data(max(bytes, self._discard))
+            if audio_data is None:
+                self._discard = 0
+                break
+            data = audio_data.get_string_data()
+            dropped = min(self._discard, len(data))
+            data = data[dropped:]
+            self._discard -= dropped
+        if not data:
+            return None
+        data, self._leftover = data[:bytes], data[bytes:]
+        timestamp = self._position
+        self._position += len(data) / bytes_per_second
+        return AudioData(data, len(data), timestamp, len(data) / bytes_per_second, [])
+
+    def delete(self):
+        self._source.delete()
+
+
+# _seek_bytes reaches into FFmpegSource internals, which are only known for pyglet 1.4
+_BYTE_SEEK = pyglet.version.startswith('1.4.')
+
+
+def _seek_bytes(source: pyglet.media.Source, offset: int) -> bool:
+    """ Move the FFmpeg demuxer of `source` to byte `offset`, the way
+    FFmpegSource.seek of pyglet 1.4 does for timestamps. Return False if not
+    possible, then the caller seeks by timestamp. """
+    if not _BYTE_SEEK or not all(hasattr(source, name) for name in
+                                 ('_file', '_events', '_clear_video_audio_queues', '_fillq')):
+        return False
+    from pyglet.media.codecs.ffmpeg_lib import avformat
+    AVSEEK_FLAG_BYTE = 2
+    if avformat.avformat_seek_file(source._file.context, -1, offset, offset, offset, AVSEEK_FLAG_BYTE) < 0:
+        return False
+    del source._events[:]
+    source._clear_video_audio_queues()
+    source._fillq()
+    return True
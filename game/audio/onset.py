@@ -0,0 +1,172 @@
+""" Offline onset detection used to generate charts from audio """
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor, Future
+from pathlib import Path
+from typing import Optional, List, Tuple
+import re
+
+import numpy as np
+
+from game.audio.decode import load_mono
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def onset_envelope(samples: np.ndarray, sample_rate: int,
+                   n_fft: int = 2048, hop: int = 512, block: int = 1024) -> (np.ndarray, float):
+    """ Return (spectral flux envelope, frames per second) of mono `samples`.
+    Frame `i` is centered at `i / frame_rate` seconds.
+
+    Frames are transformed `block` at a time to bound memory. """
+    samples = np.pad(samples, n_fft // 2, mode='reflect')
+    frames = np.lib.stride_tricks.sliding_window_view(samples, n_fft)[::hop]
+    window = np.hanning(n_fft).astype(np.float32)
+
+    spectra = np.empty((len(frames), n_fft // 2 + 1), dtype=np.float32)
+    for i in range(0, len(frames), block):
+        spectra[i:i+block] = np.abs(np.fft.rfft(frames[i:i+block] * window, axis=1))
+    np.log1p(spectra * 100, out=spectra)
+
+    flux = np.maximum(np.diff(spectra, axis=0), 0).sum(axis=1)
+    flux = np.concatenate((flux[:1], flux))
+    # frames overlapping the padding compare against reflected audio
+    flux[:n_fft // hop // 2 + 1] = np.median(flux)
+    peak = flux.max()
+    if peak > 0:
+        flux /= peak
+    return flux, sample_rate / hop
+
+
+def pick_peaks(envelope: np.ndarray, frame_rate: float, window: float = 0.05,
+               average: float = 0.1, delta: float = 0.1) -> np.ndarray:
+    """ Return times (seconds) of peaks in `envelope`.
+
+    A peak is the maximum within `window` seconds on either side and at
+    least `delta` above the mean of `average` seconds on either side. """
+    w = max(1, int(window * frame_rate))
+    a = max(1, int(average * frame_rate))
+    padded = np.pad(envelope, w, mode='edge')
+    local_max = np.lib.stride_tricks.sliding_window_view(padded, 2 * w + 1).max(axis=1)
+    padded = np.pad(envelope, a, mode='edge')
+    local_mean = np.lib.stride_tricks.sliding_window_view(padded, 2 * a + 1).mean(axis=1)
+    peaks = np.flatnonzero((envelope == local_max) & (envelope >= local_mean + delta))
+    return peaks / frame_rate
+
+
+def estimate_tempo(envelope: np.ndarray, frame_rate: float,
+                   min_bpm: float = 60, max_bpm: float = 200) -> (float, float):
+    """ Return (BPM, offset in seconds) of the strongest periodicity of `envelope` """
+    centered = envelope - envelope.mean()
+    n = 1 << int(np.ceil(np.log2(2 * len(centered))))
+    spectrum = np.fft.rfft(centered, n)
+    autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum), n)[:len(centered)]
+    lags = np.arange(int(frame_rate * 60 / max_bpm), int(frame_rate * 60 / min_bpm) + 1)
+    lag = lags[np.argmax(autocorrelation[lags])]
+    # phase with the most energy on the comb
+    comb = np.pad(envelope, (0, -len(envelope) % lag)).reshape(-1, lag).sum(axis=0)
+    phase = np.argmax(comb)
+    return 60 * frame_rate / lag, phase / frame_rate
+
+
+def beat_grid(timing_points: List['TimingPoint'], end: float, subdivisions: int = 2) -> np.ndarray:
+    """ Return times (seconds) of every `1/subdivisions` beat until `end` """
+    sections = [point for point in timing_points if point.uninherited]
+    grids = []
+    for i, point in enumerate(sections):
+        stop = sections[i+1].time if i + 1 < len(sections) else end
+        step = point.beat_length / 1000 / subdivisions
+        # extend backwards from the first timing point as well
+        start = point.time if i else point.time - (point.time // step) * step
+        grids.append(np.arange(start, stop, step))
+    return np.concatenate(grids) if grids else np.empty(0)
+
+
+def quantize(times: np.ndarray, grid: np.ndarray) -> np.ndarray:
+    """ Snap `times` to the nearest time in sorted `grid`, removing duplicates """
+    index = np.clip(np.searchsorted(grid, times), 1, len(grid) - 1)
+    left, right = grid[index - 1], grid[index]
+    snapped = np.where(times - left < right - times, left, right)
+    return np.unique(snapped)
+
+
+def detect(filepath: Path, timing_points: Optional[List['TimingPoint']] = None,
+           subdivisions: int = 2) -> Tuple[np.ndarray, List['TimingPoint']]:
+    """ Return quantized onset times (seconds) of the audio at `filepath` and
+    the timing points they are quantized to: `timing_points`, with an
+    uninherited point of the estimated tempo first if they have none """
+    samples, sample_rate = load_mono(filepath)
+    envelope, frame_rate = onset_envelope(samples, sample_rate)
+    onsets = pick_peaks(envelope, frame_rate)
+    timing_points = list(timing_points or ())
+    if not any(point.uninherited for point in timing_points):
+        from osu.beatmap import TimingPoint
+        bpm, offset = estimate_tempo(envelope, frame_rate)
+        timing_points = sorted([TimingPoint(offset, 60000 / bpm)] + timing_points,
+                               key=lambda point: (point.time, not point.uninherited))
+    grid = beat_grid(timing_points, len(samples) / sample_rate, subdivisions)
+    if len(grid) < 2:
+        return onsets, timing_points
+    return quantize(onsets, grid), timing_points
+
+
+def safe_filename(name: str) -> str:
+    """ Return `name` without path separators and characters reserved in file names """
+    name = re.sub(r'[\x00-\x1f<>:"/\\|?*]', '', name)
+    return name.strip().rstrip('.') or 'untitled'
+
+
+def write_chart(beatmap: 'Beatmap', hit_times: np.ndarray, timing_points: Optional[List['TimingPoint']] = None,
+                version: str = 'Auto') -> Path:
+    """ Write a .osu file next to `beatmap` with a circle at each of
+    `hit_times` (seconds) and `timing_points`, those of `beatmap` if None,
+    and return its path """
+    if timing_points is None:
+        timing_points = beatmap.timing_points
+    from osu.osu_ import General, Metadata, Difficulty
+
+    general = General(audio_filename=beatmap.audio_filename,
+                      preview_time=int(beatmap.preview_timestamp * 1000))
+    metadata = Metadata(title=beatmap.title, title_unicode=beatmap.unicode_title,
+                        artist=beatmap.artist, artist_unicode=beatmap.unicode_artist,
+                        creator='musicality', version=version, tags=['musicality', 'auto'])
+    difficulty = Difficulty(hp=beatmap.HP, od=beatmap.OD, ar=beatmap.AR)
+
+    events = '[Events]\n//Background and Video events\n'
+    if beatmap.background_filename:
+        events += f'0,0,"{beatmap.background_filename}",0,0\n'
+    events += '//Break Periods\n'
+
+    timing_points = '\n'.join(
+        f'{round(point.time * 1000)},{point.beat_length},{point.meter},{point.sample_set},'
+        f'{point.sample_index},{point.volume},{int(point.uninherited)},{point.effects}'
+        for point in timing_points)
+    hit_objects = '\n'.join(f'256,192,{round(time * 1000)},1,0,0:0:0:0:' for time in hit_times)
+
+    filename = safe_filename(f'{beatmap.artist} - {beatmap.title} ({metadata.creator}) [{version}]')
+    path = beatmap.get_folder_path() / f'{filename}.osu'
+    with open(path, 'w', encoding='utf8') as f:
+        f.write('osu file format v14\n\n')
+        for section in (general, metadata, difficulty):
+            f.write(f'{section}\n\n')
+        f.write(f'{events}\n')
+        f.write(f'[TimingPoints]\n{timing_points}\n\n')
+        f.write(f'[HitObjects]\n{hit_objects}\n')
+    return path
+
+
+def generate_chart(filepath: Path) -> Path:
+    """ Generate a chart for the beatmap at `filepath` from its audio and
+    return the path of the new .osu file. Runs in a worker process. """
+    from osu.beatmap import Beatmap
+    beatmap = Beatmap(filepath)
+    hit_times, timing_points = detect(beatmap.get_folder_path() / beatmap.audio_filename, beatmap.timing_points)
+    return write_chart(beatmap, hit_times, timing_points)
+
+
+def submit(beatmap: 'Beatmap') -> Future:
+    """ Generate a chart for `beatmap` in a worker process """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=1)
+    return _executor.submit(generate_chart, beatmap.filepath)
@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Dict, List, Tuple
+from pathlib import Path
+import math
+import threading
+import queue
+import warnings
+
+import pyglet
+
+from game.audio.decode import read_pcm
+from game.audio.mp3 import open_song
+
+
+class PreviewClip(pyglet.media.Source):
+    """ Represents a preview window of a song decoded in memory. Like a
+    StaticSource, it can be queued on any number of players at once. """
+
+    def __init__(self, data: bytes, audio_format: pyglet.media.codecs.AudioFormat):
+        """ Wrap already decoded `data`. Does not decode anything. """
+        self._data = data
+        self.audio_format = audio_format
+        self._duration = len(data) / audio_format.bytes_per_second
+
+    def get_queue_source(self) -> pyglet.media.codecs.base.StaticMemorySource:
+        """ Return a new source reading the clip from the start """
+        return pyglet.media.codecs.base.StaticMemorySource(self._data, self.audio_format)
+
+    @property
+    def nbytes(self) -> int:
+        """ Return size of the decoded data in bytes """
+        return len(self._data)
+
+
+class PreviewCache:
+    """ Decodes song previews in a worker thread and keeps the least
+    recently used ones in memory, within a byte budget. """
+
+    __slots__ = '_clips', '_size', '_budget', '_length', '_pending', '_lock', '_queue', '_worker'
+
+    def __init__(self, budget: int = 32 << 20, length: float = 10.):
+        """
+        :param budget: maximum total size of decoded clips (bytes)
+        :param length: length of each clip from the preview timestamp (seconds)
+        """
+        self._clips: Dict[Tuple[Path, float], PreviewClip] = OrderedDict()
+        self._size = 0
+        self._budget = budget
+        self._length = length
+        self._pending = set()
+        self._lock = threading.Lock()
+        # most recent request is decoded first when flicking through songs
+        self._queue = queue.LifoQueue()
+        self._worker = threading.Thread(target=self._run, name='preview decoder', daemon=True)
+        self._worker.start()
+
+    @staticmethod
+    def _key(beatmap: 'Beatmap') -> Tuple[Path, float]:
+        return beatmap.get_folder_path() / beatmap.audio_filename, beatmap.preview_timestamp
+
+    def get(self, beatmap: 'Beatmap') -> Optional[PreviewClip]:
+        """ Return the decoded clip of `beatmap` if cached, None otherwise """
+        key = self._key(beatmap)
+        with self._lock:
+            clip = self._clips.get(key)
+            if clip is not None:
+                self._clips.move_to_end(key)
+            return clip
+
+    def prefetch(self, beatmap: 'Beatmap'):
+        """ Request the clip of `beatmap` to be decoded in the background """
+        key = self._key(beatmap)
+        with self._lock:
+            if key in self._clips or key in self._pending:
+                return
+            self._pending.add(key)
+        self._queue.put(beatmap)
+
+    @property
+    def size(self) -> int:
+        """ Return total size of cached clips (bytes) """
+        return self._size
+
+    def _run(self):
+        while True:
+            beatmap = self._queue.get()
+            key = self._key(beatmap)
+            try:
+                clip = self._decode(beatmap)
+            except Exception as e:
+                warnings.warn(f'decoding preview... failed for {beatmap}: {e!r}', RuntimeWarning)
+                clip = None
+            with self._lock:
+                self._pending.discard(key)
+                if clip is not None:
+                    self._clips[key] = clip
+                    self._size += clip.nbytes
+                    self._evict()
+
+    def _decode(self, beatmap: 'Beatmap') -> PreviewClip:
+        source = open_song(beatmap)
+        data = read_pcm(source, beatmap.preview_timestamp, self._length)
+        return PreviewClip(data, source.audio_format)
+
+    def _evict(self):
+        """ Drop least recently used clips until within budget. Call with lock held. """
+        while self._size > self._budget and len(self._clips) > 1:
+            _, clip = self._clips.popitem(last=False)
+            self._size -= clip.nbytes
+
+
+class PreviewPlayer:
+    """ Plays song previews on two decks, crossfading from the playing one to
+    the other when the selection changes.
+
+    The incoming song is opened, seeked and decoded ahead on a worker thread;
+    the main thread only hands the ready source to the idle deck. """
+
+    __slots__ = '_cache', '_decks', '_gains', '_origins', '_crossfade', '_fade', \
+                '_generation', '_ready', '_lock', '_queue', '_worker', '_action'
+
+    def __init__(self, cache: PreviewCache, crossfade: Optional[float] = None):
+        """
+        :param cache: clips to play from memory when already decoded
+        :param crossfade: length of the crossfade (seconds), as set in the config if None
+        """
+        from game.audio.backend import get_backend
+        if crossfade is None:
+            from game import config
+            crossfade = config.get_value('preview_crossfade')
+        self._cache = cache
+        backend = get_backend()
+        self._decks = [backend.create_player(), backend.create_player()]  # playing one first
+        self._gains = [1., 1.]
+        self._origins = [0., 0.]  # song time when each deck's player time is 0
+        self._crossfade = crossfade
+        self._fade: Optional[float] = None  # seconds into the crossfade, None if not fading
+        self._generation = 0
+        self._ready: Optional[Tuple[int, 'Beatmap', pyglet.media.Source]] = None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='preview loader', daemon=True)
+        self._worker.start()
+        self._action: Dict[str, List[Tuple[Callable[[PreviewPlayer, 'Beatmap'], Any], Any]]] = {
+            'on_start': [],
+        }
+
+    def add_action(self, key: str, action: Callable[[PreviewPlayer, 'Beatmap'], Any], id_: Optional[Any] = None):
+        """ Add an action to stack with `key` and optionally `id_` """
+        if id_ is None:
+            id_ = id(action)
+        self._action[key].append((action, id_))
+
+    def remove_action(self, key: str, id_: Any):
+        """ Remove an action to stack with `key` and `id_` """
+        for index, (_, elem) in enumerate(self._action[key]):
+            if elem == id_:
+                self._action[key].pop(index)
+                break
+        else:
+            raise IndexError("id doesn't exist")
+
+    def _call_action(self, key: str, *args):
+        for action, _ in self._action[key]:
+            action(self, *args)
+
+    def play(self, beatmap: 'Beatmap'):
+        """ Request the preview of `beatmap`. It starts crossfading in from
+        `update` once loaded; earlier requests not loaded yet are dropped. """
+        with self._lock:
+            self._generation += 1
+            self._ready = None
+            self._queue.put((self._generation, beatmap))
+
+    def stop(self):
+        """ Stop both decks and drop pending requests """
+        with self._lock:
+            self._generation += 1
+            self._ready = None
+        self._fade = None
+        for deck in self._decks:
+            self._clear(deck)
+
+    def _run(self):
+        while True:
+            generation, beatmap = self._queue.get()
+            if generation != self._generation:
+                continue
+            try:
+                source = self._open(beatmap)
+            except Exception as e:
+                warnings.warn(f'loading preview... failed for {beatmap}: {e!r}', RuntimeWarning)
+                continue
+            with self._lock:
+                if generation == self._generation:
+                    self._ready = generation, beatmap, source
+                    continue
+            if hasattr(source, 'close'):
+                source.close()
+
+    def _open(self, beatmap: 'Beatmap') -> pyglet.media.Source:
+        """ Return a source starting at the preview of `beatmap`, decoded ahead.
+        Runs in the worker thread. """
+        clip = self._cache.get(beatmap)
+        if clip:
+            return clip
+        # not decoded yet, stream this time and have it ready for next time
+        from game.audio.stream import stream
+        self._cache.prefetch(beatmap)
+        source = stream(open_song(beatmap))
+        source.seek(beatmap.preview_timestamp)
+        source.start()
+        return source
+
+    @staticmethod
+    def _clear(deck):
+        source = deck.source
+        deck.pause()
+        while deck.source is not None:
+            deck.next_source()
+        if hasattr(source, 'close'):
+            source.close()
+
+    def update(self, delta_time: float):
+        """ Call every frame. Starts a loaded preview and advances the crossfade. """
+        with self._lock:
+            ready, self._ready = self._ready, None
+        if ready:
+            from game.audio.loudness import gain
+            _, beatmap, source = ready
+            # whatever was fading out is cut, the playing deck fades out next
+            idle = self._decks[1]
+            self._clear(idle)
+            self._decks.reverse()
+            self._gains.reverse()
+            self._origins.reverse()
+            self._gains[0] = gain(beatmap)
+            self._origins[0] = beatmap.preview_timestamp
+            idle.volume = 0.
+            idle.queue(source)
+            idle.play()
+            self._fade = 0.
+            self._call_action('on_start', beatmap)
+        if self._fade is None:
+            return
+
+        self._fade += delta_time
+        if self._fade >= self._crossfade:
+            self._fade = None
+            self._decks[0].volume = self._gains[0]
+            self._clear(self._decks[1])
+            return
+        # equal power, loudness stays even through the middle
+        angle = self._fade / self._crossfade * math.pi / 2
+        self._decks[0].volume = self._gains[0] * math.sin(angle)
+        self._decks[1].volume = self._gains[1] * math.cos(angle)
+
+    @property
+    def time(self) -> float:
+        """ Return song time (seconds) of the preview playing or fading in """
+        return self._origins[0] + self._decks[0].time
+
+    @property
+    def playing(self) -> bool:
+        """ Return whether a preview is playing """
+        return self._decks[0].playing
@@ -0,0 +1,102 @@
+""" Offline rendering of a play session to a WAV file, no audio device needed """
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional, Iterable, Tuple, Dict, List
+import wave
+
+import numpy as np
+import pyglet
+
+from game.audio.decode import read_pcm, to_array, conform
+
+DEFAULT_SAMPLE_FOLDER = Path('resources/Default/sample')
+
+
+def load_sample(name: str, folder: Path, sample_rate: int, channels: int) -> np.ndarray:
+    """ Return sample `name` (without extension) as array of shape (frames, channels)
+    matching `sample_rate` and `channels`. Custom samples in `folder` override
+    the default ones. """
+    filepath = folder / (name + '.wav')
+    if not filepath.exists():
+        filepath = DEFAULT_SAMPLE_FOLDER / (name + '.wav')
+    source = pyglet.media.load(str(filepath), streaming=True)
+    samples = to_array(read_pcm(source), source.audio_format)
+    return conform(samples, source.audio_format.sample_rate, sample_rate, channels)
+
+
+def mix_at(out: np.ndarray, sample: np.ndarray, offsets: np.ndarray, gains: Optional[np.ndarray] = None,
+           batch: int = 256):
+    """ Add `sample` into `out` starting at each frame in `offsets`. Mutates `out`.
+
+    Hits are mixed `batch` at a time with one bincount per channel. """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if gains is None:
+        gains = np.ones(len(offsets), dtype=np.float32)
+    keep = (offsets >= 0) & (offsets < len(out))
+    offsets, gains = offsets[keep], gains[keep]
+    span = np.arange(len(sample))
+    for i in range(0, len(offsets), batch):
+        index = offsets[i:i+batch, None] + span
+        inside = index < len(out)
+        weights = gains[i:i+batch, None, None] * sample[None, :, :]
+        for c in range(out.shape[1]):
+            out[:, c] += np.bincount(index[inside], weights=weights[..., c][inside], minlength=len(out))
+
+
+def autoplay_hits(beatmap: 'Beatmap', rate: float = 1.) -> List[Tuple[float, str]]:
+    """ Return (game time, sample name) of a perfect play of `beatmap` played
+    `rate` times as fast """
+    return [(time / rate, name) for time, names in zip(beatmap.hit_times, beatmap.hit_samples) for name in names]
+
+
+def replay_hits(beatmap: 'Beatmap', replay: 'Replay') -> List[Tuple[float, str]]:
+    """ Return (game time, sample name) of every object `replay` hits, at the
+    time it is judged to, the same as when it is played back """
+    from game.legacy.rescore import load_chart, rescore_replay
+    press_times = rescore_replay(load_chart(beatmap, replay.rate, replay.strategy), replay).press_times
+    return [(time, name) for time, names in zip(press_times.tolist(), beatmap.hit_samples)
+            if not np.isnan(time) for name in names]
+
+
+def render(beatmap: 'Beatmap', filepath: Path, hits: Optional[Iterable[Tuple[float, str]]] = None,
+           song_volume: float = 1., hit_volume: float = 1., rate: float = 1., offset: float = 0.) -> np.ndarray:
+    """ Mix the song of `beatmap` played `rate` times as fast and a hit sound
+    at each (game time, sample name) in `hits`, sounding `offset` seconds
+    later, into a 16 bit WAV at `filepath`. Autoplay if `hits` is None.
+    Return the mixed float samples of shape (frames, channels). """
+    from game.audio.stretch import stretch
+    if hits is None:
+        hits = autoplay_hits(beatmap, rate)
+    source = stretch(beatmap.resource_loader.media(beatmap.audio_filename, streaming=True), rate)
+    audio_format = source.audio_format
+    sample_rate, channels = audio_format.sample_rate, audio_format.channels
+    out = to_array(read_pcm(source), audio_format) * song_volume
+
+    by_name: Dict[str, List[float]] = {}
+    for time, name in hits:
+        by_name.setdefault(name, []).append(time + offset)
+    for name, times in by_name.items():
+        sample = load_sample(name, beatmap.get_folder_path(), sample_rate, channels) * hit_volume
+        mix_at(out, sample, np.round(np.asarray(times) * sample_rate))
+
+    write_wav(filepath, out, sample_rate)
+    return out
+
+
+def render_replay(beatmap: 'Beatmap', replay: 'Replay', filepath: Path, **kwargs) -> np.ndarray:
+    """ Render `replay` of `beatmap` as it sounds played back: at its rate,
+    with hit sounds where it hits, late by the configured audio offset """
+    from game import config
+    return render(beatmap, filepath, replay_hits(beatmap, replay), rate=replay.rate,
+                  offset=config.get_value('audio_offset'), **kwargs)
+
+
+def write_wav(filepath: Path, samples: np.ndarray, sample_rate: int):
+    """ Write float `samples` of shape (frames, channels) as a 16 bit WAV """
+    data = (np.clip(samples, -1, 1) * 32767).astype('<i2')
+    with wave.open(str(filepath), 'wb') as f:
+        f.setnchannels(samples.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(data.tobytes())
@@ -0,0 +1,307 @@
+""" Song decoding on a dedicated thread, ahead of playback """
+from __future__ import annotations
+
+from typing import NamedTuple, Optional, List, Tuple, Dict
+import bisect
+import threading
+import time
+
+import numpy as np
+import pyglet
+from pyglet.media.codecs import AudioData
+
+from game.audio.decode import read_pcm, to_array, from_array, conform
+
+
+class RingBuffer:
+    """ Fixed size byte queue for one writer and one reader.
+    Not thread safe on its own, callers hold a lock around each call. """
+
+    __slots__ = '_buffer', '_read', '_written'
+
+    def __init__(self, capacity: int):
+        self._buffer = bytearray(capacity)
+        self._read = 0
+        self._written = 0
+
+    def __len__(self) -> int:
+        return self._written - self._read
+
+    @property
+    def free(self) -> int:
+        """ Return number of bytes that can be written """
+        return len(self._buffer) - len(self)
+
+    def write(self, data: memoryview) -> int:
+        """ Write as much of `data` as fits and return number of bytes written """
+        n = min(len(data), self.free)
+        capacity = len(self._buffer)
+        start = self._written % capacity
+        first = min(n, capacity - start)
+        self._buffer[start:start+first] = data[:first]
+        self._buffer[:n-first] = data[first:n]
+        self._written += n
+        return n
+
+    def read(self, n: int) -> bytes:
+        """ Remove and return at most `n` bytes """
+        n = min(n, len(self))
+        capacity = len(self._buffer)
+        start = self._read % capacity
+        first = min(n, capacity - start)
+        data = bytes(self._buffer[start:start+first]) + bytes(self._buffer[:n-first])
+        self._read += n
+        return data
+
+    def skip(self, n: int) -> int:
+        """ Remove at most `n` bytes and return number of bytes removed """
+        n = min(n, len(self))
+        self._read += n
+        return n
+
+    def clear(self):
+        self._read = self._written
+
+
+class StreamStats(NamedTuple):
+    """ Represents health of a StreamSource """
+    fill: float  # seconds decoded but not played yet
+    lookahead: float  # seconds the decoder aims to keep decoded
+    underruns: int  # number of times the player found nothing decoded
+    throughput: float  # seconds of audio decoded per second spent decoding
+
+
+class StreamSource(pyglet.media.StreamingSource):
+    """ Wraps a streaming source, decoding it on its own thread into a ring
+    buffer `lookahead` seconds ahead of playback.
+
+    The player only copies from the buffer, so a slow frame cannot delay
+    decoding. If the buffer runs dry the player gets silence and the audio
+    missed is skipped, keeping the song in time.
+
+    Sounds scheduled at a song time are mixed in by the decoder at the exact
+    sample, as long as they are scheduled before that part is decoded.
+    Nothing is decoded until start() or the first read, so sounds scheduled
+    right after creation are mixed from the very start. """
+
+    def __init__(self, source: pyglet.media.Source, lookahead: float = 0.5, chunk: int = 1 << 14):
+        """
+        :param source: streaming source to decode
+        :param lookahead: seconds to keep decoded ahead of playback
+        :param chunk: bytes to request from `source` at a time
+        """
+        self._source = source.get_queue_source()
+        self.audio_format = self._source.audio_format
+        self.video_format = None
+        self._duration = self._source.duration
+        bytes_per_second = self.audio_format.bytes_per_second
+        self._lookahead = int(lookahead * bytes_per_second)
+        self._lookahead -= self._lookahead % self.audio_format.bytes_per_sample
+        self._chunk = chunk
+        self._ring = RingBuffer(self._lookahead + 4 * chunk)
+
+        self._lock = threading.Lock()  # held to touch the ring and playback position
+        self._source_lock = threading.Lock()  # held to decode or seek
+        self._wanted = threading.Event()  # set whenever the decoder may have work
+        self._generation = 0  # incremented by seek, stale data is dropped
+        self._origin = 0.  # timestamp of the last seek
+        self._consumed = 0  # bytes given to the player since the last seek
+        self._skip = 0  # bytes of silence given to the player not yet dropped from the ring
+        self._eos = False
+        self._started = False
+        self._closed = False
+
+        self._underruns = 0
+        self._decoded = 0
+        self._decode_time = 0.
+
+        self._frame = 0  # song frame of the next decoded sample
+        self._scheduled_frames: List[int] = []
+        self._scheduled_samples: List[np.ndarray] = []
+        self._next_scheduled = 0  # index of the first scheduled sound not started
+        self._late: List[Tuple[np.ndarray, int]] = []
+        self._sounding: List[Tuple[np.ndarray, int]] = []
+        self._prepared: Dict[int, Tuple[pyglet.media.Source, np.ndarray]] = {}
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """ Decode the first chunk and start decoding ahead, if not started.
+        Sounds scheduled from now on only sound where not decoded yet. """
+        with self._source_lock:
+            if self._started or self._closed:
+                return
+            self._started = True
+            self._prime()
+        self._thread.start()
+
+    @property
+    def stats(self) -> StreamStats:
+        """ Return current buffer fill level, underrun count and decode throughput """
+        bytes_per_second = self.audio_format.bytes_per_second
+        throughput = self._decoded / bytes_per_second / self._decode_time if self._decode_time else 0.
+        return StreamStats(len(self._ring) / bytes_per_second, self._lookahead / bytes_per_second,
+                           self._underruns, throughput)
+
+    def _run(self):
+        pending = memoryview(b'')
+        generation = self._generation
+        while not self._closed:
+            if pending:
+                with self._lock:
+                    if generation == self._generation:
+                        pending = pending[self._ring.write(pending):]
+                    else:
+                        pending = memoryview(b'')
+            if pending or self._eos or len(self._ring) >= self._lookahead:
+                self._wanted.wait(0.05)
+                self._wanted.clear()
+                continue
+
+            with self._source_lock:
+                if self._closed:
+                    break
+                generation = self._generation
+                start = time.perf_counter()
+                audio_data = self._source.get_audio_data(self._chunk)
+                self._decode_time += time.perf_counter() - start
+                if audio_data is not None:
+                    data = audio_data.get_string_data()
+                    self._decoded += len(data)
+                    pending = memoryview(self._mix(data))
+            if audio_data is None:
+                with self._lock:
+                    if generation == self._generation:
+                        self._eos = True
+
+    def get_audio_data(self, bytes, compensation_time=0.0):
+        if not self._started:
+            self.start()
+        audio_format = self.audio_format
+        bytes -= bytes % audio_format.bytes_per_sample
+        with self._lock:
+            if self._skip:
+                self._skip -= self._ring.skip(self._skip)
+            data = self._ring.read(bytes)
+            if not data:
+                if self._eos:
+                    return None
+                self._underruns += 1
+                self._skip += bytes
+                data = (b'\x80' if audio_format.sample_size == 8 else b'\0') * bytes
+            timestamp = self._origin + self._consumed / audio_format.bytes_per_second
+            self._consumed += len(data)
+        self._wanted.set()
+        return AudioData(data, len(data), timestamp, len(data) / audio_format.bytes_per_second, [])
+
+    def _prime(self):
+        """ Decode the first chunk on the calling thread so playback can start
+        right away. Call with the source lock held or before the decoder starts. """
+        audio_data = self._source.get_audio_data(self._chunk)
+        data = self._mix(audio_data.get_string_data()) if audio_data is not None else None
+        with self._lock:
+            if data is None:
+                self._eos = True
+            else:
+                self._ring.write(memoryview(data))
+
+    def _mix(self, data: bytes) -> bytes:
+        """ Return decoded `data` with the scheduled sounds it covers mixed in.
+        Call with the source lock held or before the decoder starts. """
+        audio_format = self.audio_format
+        frames = len(data) // audio_format.bytes_per_sample
+        start = self._frame
+        end = self._frame = start + frames
+        with self._lock:
+            sounding = self._sounding + self._late
+            self._late = []
+            while self._next_scheduled < len(self._scheduled_frames) \
+                    and self._scheduled_frames[self._next_scheduled] < end:
+                index = self._next_scheduled
+                sounding.append((self._scheduled_samples[index], self._scheduled_frames[index]))
+                self._next_scheduled += 1
+        if not sounding:
+            self._sounding = sounding
+            return data
+
+        out = to_array(data, audio_format)
+        self._sounding = []
+        for samples, frame in sounding:
+            begin = max(frame - start, 0)
+            offset = begin - (frame - start)
+            n = min(frames - begin, len(samples) - offset)
+            if n > 0:
+                out[begin:begin+n] += samples[offset:offset+n]
+            if frame + len(samples) > end:
+                self._sounding.append((samples, frame))
+        return from_array(out, audio_format)
+
+    def _prepare(self, sound: pyglet.media.Source) -> np.ndarray:
+        """ Return `sound` decoded to the format of the song """
+        try:
+            return self._prepared[id(sound)][1]
+        except KeyError:
+            pass
+        source = sound.get_queue_source()
+        samples = to_array(read_pcm(source), source.audio_format)
+        samples = conform(samples, source.audio_format.sample_rate,
+                          self.audio_format.sample_rate, self.audio_format.channels)
+        self._prepared[id(sound)] = sound, samples
+        return samples
+
+    def schedule(self, time: float, sound: pyglet.media.Source):
+        """ Mix `sound` into the song starting at song time `time` (seconds).
+        If that part is decoded already, the sound starts as soon as possible
+        with what it would have played so far cut off. """
+        samples = self._prepare(sound)
+        frame = round(time * self.audio_format.sample_rate)
+        with self._lock:
+            index = bisect.bisect_right(self._scheduled_frames, frame)
+            self._scheduled_frames.insert(index, frame)
+            self._scheduled_samples.insert(index, samples)
+            if index < self._next_scheduled or frame < self._frame:
+                self._next_scheduled += 1
+                if frame + len(samples) > self._frame:
+                    self._late.append((samples, frame))
+
+    def seek(self, timestamp: float):
+        with self._source_lock:
+            if self._closed:
+                return
+            self._source.seek(timestamp)
+            with self._lock:
+                self._generation += 1
+                self._ring.clear()
+                self._origin = timestamp
+                self._consumed = 0
+                self._skip = 0
+                self._eos = False
+                self._frame = round(timestamp * self.audio_format.sample_rate)
+                self._next_scheduled = bisect.bisect_left(self._scheduled_frames, self._frame)
+                self._late = []
+                self._sounding = []
+            if self._started:
+                self._prime()
+        self._wanted.set()
+
+    def close(self):
+        """ Stop the decoder thread and delete the source it decodes """
+        if self._closed:
+            return
+        self._closed = True
+        self._wanted.set()
+        # the decoder checks _closed before touching the source again
+        with self._source_lock:
+            self._source.delete()
+
+    def delete(self):
+        self.close()
+
+
+def stream(source: pyglet.media.Source, lookahead: Optional[float] = None) -> StreamSource:
+    """ Return `source` decoded ahead on its own thread, `lookahead` seconds
+    ahead of playback or as set in the config if None """
+    if lookahead is None:
+        from game import config
+        lookahead = config.get_value('audio_lookahead')
+    return StreamSource(source, lookahead)
@@ -0,0 +1,141 @@
+""" Time-stretching of a streaming source, changing speed but not pitch """
+from __future__ import annotations
+
+import numpy as np
+import pyglet
+from pyglet.media.codecs import AudioFormat, AudioData
+
+from game.audio.decode import to_array
+
+
+class StretchSource(pyglet.media.StreamingSource):
+    """ Plays a streaming source `rate` times as fast with WSOLA: windows of
+    the input are overlap-added at a fixed hop, each moved within `tolerance`
+    to line up with the natural continuation of the previous window.
+
+    Only a couple of windows of input are buffered, so it can run inside the
+    decoder thread of a StreamSource. Output is always 16 bit. """
+
+    def __init__(self, source: pyglet.media.Source, rate: float,
+                 window: float = 0.04, tolerance: float = 0.01):
+        """
+        :param rate: speed of playback, 2 plays twice as fast
+        :param window: length of each overlap-added window (seconds)
+        :param tolerance: how far a window may move to line up (seconds of output)
+        """
+        assert rate > 0
+        self._source = source.get_queue_source()
+        source_format = self._source.audio_format
+        self._channels, self._sample_rate = source_format.channels, source_format.sample_rate
+        self.audio_format = AudioFormat(self._channels, 16, self._sample_rate)
+        self.video_format = None
+        duration = self._source.duration
+        self._duration = duration / rate if duration is not None else None
+        self._rate = rate
+        self._length = int(window * self._sample_rate) // 2 * 2
+        self._hop = self._length // 2
+        self._tolerance = int(tolerance * rate * self._sample_rate)
+        # periodic Hann windows at half overlap sum to exactly 1
+        self._window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(self._length) / self._length))[:, None]
+        self._reset(0.)
+
+    def _reset(self, timestamp: float):
+        self._input = np.zeros((0, self._channels), dtype=np.float32)
+        self._input_start = 0  # input frame of self._input[0], counted from the last seek
+        self._windows = 0  # windows placed since the last seek
+        self._previous = None  # input frame of the last placed window
+        self._tail = np.zeros((self._hop, self._channels), dtype=np.float32)
+        self._output = b''
+        self._position = timestamp
+        self._eos = False
+
+    def seek(self, timestamp: float):
+        self._source.seek(timestamp * self._rate)
+        self._reset(timestamp)
+
+    def _fill(self, end: int) -> bool:
+        """ Decode until input frame `end` is buffered. Return False at end of source. """
+        chunks = [self._input]
+        available = self._input_start + len(self._input)
+        while available < end:
+            audio_data = self._source.get_audio_data(1 << 14)
+            if audio_data is None:
+                self._eos = True
+                break
+            samples = to_array(audio_data.get_string_data(), self._source.audio_format)
+            chunks.append(samples)
+            available += len(samples)
+        self._input = np.concatenate(chunks)
+        return available >= end
+
+    def _frame(self, start: int) -> np.ndarray:
+        """ Return `length` input frames from `start`, zero padded outside the input """
+        begin = start - self._input_start
+        before = max(0, -begin)
+        frame = self._input[begin+before:begin+self._length]
+        after = self._length - before - len(frame)
+        if before or after:
+            frame = np.pad(frame, ((before, after), (0, 0)))
+        return frame
+
+    def _nominal(self, window: int) -> int:
+        """ Return input frame where `window` starts if nothing moved, so that
+        its center plays at the time it has in the input """
+        return round((window * self._hop + self._hop) * self._rate) - self._hop
+
+    def _place(self) -> bool:
+        """ Overlap-add the next window into the output. Return False when done. """
+        nominal = self._nominal(self._windows)
+        lowest = max(0, nominal - self._tolerance)
+        end = max(nominal + self._tolerance, (self._previous or 0) + self._hop) + self._length
+        if not self._fill(end) and lowest >= self._input_start + len(self._input):
+            return False
+
+        if self._previous is None:
+            start = nominal
+        else:
+            # natural continuation of the previous window
+            template = self._frame(self._previous + self._hop).mean(axis=1)
+            begin = lowest - self._input_start
+            region = self._input[begin:nominal + self._tolerance + self._length - self._input_start].mean(axis=1)
+            if len(region) >= len(template):
+                start = lowest + int(np.argmax(np.correlate(region, template, 'valid')))
+            else:
+                start = nominal
+
+        frame = self._frame(start) * self._window
+        out = self._tail + frame[:self._hop]
+        self._tail = frame[self._hop:]
+        self._output += (np.clip(out, -1, 1) * 32767).astype('<i2').tobytes()
+        self._previous = start
+        self._windows += 1
+
+        # drop input no later window can reach
+        keep = min(self._previous, self._nominal(self._windows) - self._tolerance)
+        if keep > self._input_start:
+            self._input = self._input[keep - self._input_start:]
+            self._input_start = keep
+        return True
+
+    def get_audio_data(self, bytes, compensation_time=0.0):
+        bytes_per_sample = self.audio_format.bytes_per_sample
+        bytes -= bytes % bytes_per_sample
+        while len(self._output) < bytes and self._place():
+            pass
+        data, self._output = self._output[:bytes], self._output[bytes:]
+        if not data:
+            return None
+        timestamp = self._position
+        duration = len(data) / self.audio_format.bytes_per_second
+        self._position += duration
+        return AudioData(data, len(data), timestamp, duration, [])
+
+    def delete(self):
+        self._source.delete()
+
+
+def stretch(source: pyglet.media.Source, rate: float) -> pyglet.media.Source:
+    """ Return `source` played `rate` times as fast, unchanged if `rate` is 1 """
+    if rate == 1:
+        return source
+    return StretchSource(source, rate)
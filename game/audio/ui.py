@@ -0,0 +1,95 @@
+""" Process-wide registry of short UI sounds sharing a small pool of players """
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pyglet
+
+from game.audio.backend import get_backend
+from game.audio import wav
+
+_sounds: Dict[Path, UISound] = {}
+_pool: Optional[VoicePool] = None
+
+
+class VoicePool:
+    """ Fixed number of players reused by every sound played through it """
+
+    __slots__ = '_players', '_loaded', '_next'
+
+    def __init__(self, size: int = 4):
+        self._players: List[pyglet.media.Player] = [get_backend().create_player() for _ in range(size)]
+        self._loaded: List[Optional[pyglet.media.StaticSource]] = [None] * size
+        self._next = 0  # player stolen next when none is idle
+
+    def play(self, source: pyglet.media.StaticSource):
+        """ Play `source` on an idle player, preferring one that already has it
+        queued, then one with nothing queued. If none is idle, steal players
+        in turn, round robin. """
+        match = empty = idle = None
+        for i, player in enumerate(self._players):
+            if not player.playing:
+                loaded = self._loaded[i]
+                if loaded is source:
+                    match = i
+                    break
+                if loaded is None:
+                    empty = i if empty is None else empty
+                elif idle is None:
+                    idle = i
+        index = next((i for i in (match, empty, idle) if i is not None), None)
+        if index is None:
+            index = self._next
+            self._next = (self._next + 1) % len(self._players)
+
+        player = self._players[index]
+        if self._loaded[index] is source and player.source is not None:
+            player.seek(0)
+        else:
+            player.pause()
+            while player.source is not None:
+                player.next_source()
+            player.queue(source)
+            self._loaded[index] = source
+        player.play()
+
+
+class UISound:
+    """ Lightweight handle to a UI sound decoded once """
+
+    __slots__ = '_source', '_filepath'
+
+    def __init__(self, filepath: Path):
+        self._filepath = filepath
+        self._source = wav.load(filepath)
+
+    @property
+    def source(self) -> pyglet.media.StaticSource:
+        """ Return the decoded source """
+        return self._source
+
+    @property
+    def duration(self) -> float:
+        """ Return length of the sound (seconds) """
+        return self._source.duration
+
+    def play(self):
+        """ Play the sound on the shared voice pool. Never creates a player. """
+        _get_pool().play(self._source)
+
+
+def _get_pool() -> VoicePool:
+    global _pool
+    if _pool is None:
+        _pool = VoicePool()
+    return _pool
+
+
+def get_sound(filepath: Path) -> UISound:
+    """ Return the handle of the sound at `filepath`, loading it on first use """
+    try:
+        return _sounds[filepath]
+    except KeyError:
+        _sounds[filepath] = sound = UISound(filepath)
+        return sound
@@ -0,0 +1,112 @@
+""" Memory-mapped reader for plain PCM WAV files, bypassing pyglet's codecs """
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Tuple
+import mmap
+import struct
+
+import pyglet
+from pyglet.media.codecs import AudioFormat, AudioData
+
+_PCM = 1
+_EXTENSIBLE = 0xFFFE
+
+
+def read(filepath: Path) -> Tuple[memoryview, AudioFormat]:
+    """ Return (PCM data, format) of the WAV at `filepath`.
+
+    The data is a view of the memory-mapped file, nothing is copied.
+    Raises ValueError if the file is not 8 or 16 bit PCM WAV. """
+    with open(filepath, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return _parse(buffer, filepath)
+    except ValueError:
+        buffer.close()
+        raise
+
+
+def _parse(buffer: mmap.mmap, filepath: Path) -> Tuple[memoryview, AudioFormat]:
+    """ Return (PCM data, format) of the WAV mapped in `buffer` """
+    if len(buffer) < 12 or buffer[:4] != b'RIFF' or buffer[8:12] != b'WAVE':
+        raise ValueError(f'{filepath} is not a RIFF WAVE file')
+
+    audio_format = None
+    offset = 12
+    while offset + 8 <= len(buffer):
+        chunk_id, size = struct.unpack_from('<4sI', buffer, offset)
+        offset += 8
+        if chunk_id == b'fmt ':
+            tag, channels, sample_rate, _, block_align, sample_size = struct.unpack_from('<HHIIHH', buffer, offset)
+            if tag == _EXTENSIBLE and size >= 26:
+                tag, = struct.unpack_from('<H', buffer, offset + 24)  # first bytes of the sub format GUID
+            if tag != _PCM or sample_size not in (8, 16) or block_align != channels * sample_size // 8:
+                raise ValueError(f'{filepath} is not 8 or 16 bit PCM')
+            audio_format = AudioFormat(channels, sample_size, sample_rate)
+        elif chunk_id == b'data':
+            if audio_format is None:
+                raise ValueError(f'{filepath} has data before format')
+            # some writers leave the size of the last chunk unset
+            end = min(offset + size, len(buffer))
+            end -= (end - offset) % audio_format.bytes_per_sample
+            return memoryview(buffer)[offset:end], audio_format
+        offset += size + (size & 1)  # chunks are word aligned
+    raise ValueError(f'{filepath} has no data')
+
+
+def load(filepath: Path) -> pyglet.media.StaticSource:
+    """ Return a static source of the audio at `filepath`. WAV files are
+    mapped directly, anything else is decoded by pyglet. """
+    if filepath.suffix.lower() == '.wav':
+        try:
+            return WavSource(*read(filepath))
+        except ValueError:
+            pass
+    return pyglet.media.load(str(filepath), streaming=False)
+
+
+class WavSource(pyglet.media.StaticSource):
+    """ Represents PCM data held in a memory-mapped WAV file """
+
+    def __init__(self, data: memoryview, audio_format: AudioFormat):
+        """ Wrap `data` without copying it """
+        self._data = data
+        self.audio_format = audio_format
+        self._duration = len(data) / audio_format.bytes_per_second
+
+    @property
+    def data(self) -> memoryview:
+        """ Return the PCM data """
+        return self._data
+
+    def get_queue_source(self) -> _WavQueueSource:
+        return _WavQueueSource(self._data, self.audio_format)
+
+
+class _WavQueueSource(pyglet.media.StaticSource):
+    """ Reads a WavSource from a position, copying only what is requested """
+
+    def __init__(self, data: memoryview, audio_format: AudioFormat):
+        self._data = data
+        self._offset = 0
+        self.audio_format = audio_format
+        self._duration = len(data) / audio_format.bytes_per_second
+
+    def get_queue_source(self) -> _WavQueueSource:
+        return _WavQueueSource(self._data, self.audio_format)
+
+    def seek(self, timestamp: float):
+        offset = int(timestamp * self.audio_format.bytes_per_second)
+        offset -= offset % self.audio_format.bytes_per_sample
+        self._offset = max(0, min(offset, len(self._data)))
+
+    def get_audio_data(self, bytes, compensation_time=0.0):
+        bytes -= bytes % self.audio_format.bytes_per_sample
+        start = self._offset
+        data = self._data[start:start+bytes].tobytes()
+        if not data:
+            return None
+        self._offset += len(data)
+        bytes_per_second = self.audio_format.bytes_per_second
+        return AudioData(data, len(data), start / bytes_per_second, len(data) / bytes_per_second, [])
@@ -0,0 +1,55 @@
+""" User settings persisted between runs """
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Dict
+import json
+import warnings
+
+CONFIG_PATH = Path('config.json')
+
+DEFAULTS = {
+    'audio_offset': 0.,  # seconds, mean of (tap time - click time) during calibration
+    'audio_jitter': 0.,  # seconds, robust standard deviation of the same
+    'audio_lookahead': 0.5,  # seconds of the song decoded ahead of playback
+    'playback_rate': 1.,  # speed of the song in game, 0.5 to 1.5
+    'preview_crossfade': 0.4,  # seconds song select fades between previews
+    'simulation_rate': 1000,  # Hz, fixed ticks gameplay is judged at
+    'lane_strategy': 'random',  # how notes are given keys, one of game.lanes.STRATEGIES
+}
+
+_config: Dict[str, Any] = {}
+
+
+def load():
+    global _config
+    _config = dict(DEFAULTS)
+    try:
+        with open(CONFIG_PATH, encoding='utf8') as f:
+            _config.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except ValueError:
+        warnings.warn(f"reading config... '{CONFIG_PATH}' is corrupted, using defaults", ResourceWarning)
+
+
+def save():
+    with open(CONFIG_PATH, 'w', encoding='utf8') as f:
+        json.dump(_config, f, indent=2)
+
+
+def get_value(key: str) -> Any:
+    """ Return the value of setting `key` """
+    if not _config:
+        load()
+    return _config[key]
+
+
+def set_value(key: str, value: Any, persist: bool = True):
+    """ Set setting `key` to `value` and save to file if `persist` """
+    if not _config:
+        load()
+    assert key in DEFAULTS, f"unknown setting '{key}'"
+    _config[key] = value
+    if persist:
+        save()
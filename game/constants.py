@@ -14,6 +14,9 @@ HIT_OBJECT_TYPE = _temp(HitObjectType(1), HitObjectType(2))
 _temp = namedtuple('HitObjectConstant', ['INACTIVE', 'ACTIVE', 'PASSED'])
 HIT_OBJECT_STATE = _temp(*map(HitObjectState, range(3)))
 
+# judgements from best to worst
+GRADES = ('perfect', 'almost', 'good', 'ok', 'bad', 'miss')
+
 _temp = namedtuple('GameConstant', ['MAIN_MENU', 'OPTIONS', 'SONG_SELECT', 'GAME_PAUSED', 'GAME_PLAYING', 'GAME_FINISH'])
 GAME_STATE = _temp(*map(GameState, range(6)))
 
@@ -0,0 +1,83 @@
+""" Assignment of the notes of a chart to keys, the same every time for the same chart """
+from __future__ import annotations
+
+from typing import Callable, Dict, Sequence, Tuple
+
+import numpy as np
+from pyglet.window import key
+
+Strategy = Callable[[np.ndarray, int, np.random.Generator], np.ndarray]
+
+STREAM_GAP = 0.2  # seconds, notes closer than this are played as one run
+JACK_GAP = 0.3  # seconds, notes closer than this never share a key
+
+KEYS = [
+    key.Z, key.X, key.C, key.V,
+    key.A, key.S, key.D, key.F,
+    key.Q, key.W, key.E, key.R,
+]  # keys notes are assigned to
+
+_cache: Dict[Tuple[bytes, str, Tuple[int, ...]], np.ndarray] = {}
+
+
+def _random(times: np.ndarray, lanes: int, rng: np.random.Generator) -> np.ndarray:
+    """ Return lanes drawn without repeats in groups of 5 notes """
+    group = min(5, lanes)
+    groups = -(-len(times) // group)
+    return np.argsort(rng.random((groups, lanes)), axis=1)[:, :group].ravel()[:len(times)]
+
+
+def _pattern(times: np.ndarray, lanes: int, rng: np.random.Generator) -> np.ndarray:
+    """ Return lanes rolling over neighbouring keys through streams, in a
+    direction drawn per stream, and jumping anywhere else between notes """
+    if not len(times):
+        return np.empty(0, dtype=np.int64)
+    close = np.diff(times, prepend=-np.inf) < STREAM_GAP
+    run = np.cumsum(~close)
+    direction = rng.choice((-1, 1), run[-1] + 1)[run]
+    steps = np.where(close, direction, rng.integers(1, lanes, len(times)) if lanes > 1 else 0)
+    return np.cumsum(steps) % lanes
+
+
+def _jackless(times: np.ndarray, lanes: int, rng: np.random.Generator) -> np.ndarray:
+    """ Return random lanes, never a key used within JACK_GAP before. If
+    every key was, the one used longest ago. """
+    last_used = np.full(lanes, -np.inf)  # time each lane was last used
+    draws = rng.random(len(times)).tolist()
+    out = np.empty(len(times), dtype=np.int64)
+    for i, (time, draw) in enumerate(zip(times.tolist(), draws)):
+        choices = np.flatnonzero(time - last_used >= JACK_GAP)
+        lane = choices[int(draw * len(choices))] if len(choices) else int(last_used.argmin())
+        last_used[lane] = time
+        out[i] = lane
+    return out
+
+
+STRATEGIES: Dict[str, Strategy] = {
+    'random': _random,
+    'pattern': _pattern,
+    'jackless': _jackless,
+}
+
+
+def assign(chart_hash: bytes, times: Sequence[float], keys: Sequence[int], strategy: str = 'random') -> np.ndarray:
+    """ Return the key symbol of each note at `times` (seconds, in song order)
+    of the chart with MD5 digest `chart_hash`, by `strategy`.
+
+    The generator is seeded from `chart_hash`, so a chart always gets the same
+    keys, and results are cached by chart, strategy and keys. Do not modify
+    the returned array. """
+    assert strategy in STRATEGIES, f"unknown lane strategy '{strategy}'"
+    cache_key = chart_hash, strategy, tuple(keys)
+    symbols = _cache.get(cache_key)
+    if symbols is None or len(symbols) != len(times):
+        rng = np.random.default_rng(int.from_bytes(chart_hash[:8], 'little'))
+        lanes = STRATEGIES[strategy](np.asarray(times, dtype=float), len(keys), rng)
+        symbols = np.asarray(keys, dtype=np.int64)[lanes]
+        symbols.flags.writeable = False
+        _cache[cache_key] = symbols
+    return symbols
+
+
+def clear_cache():
+    _cache.clear()
@@ -5,96 +5,188 @@ from typing import Any, Union, Optional, Tuple, List, Dict, TextIO, Iterable, Ca
 import warnings
 from io import StringIO
 
+import numpy as np
 import pyglet
 
+from game.audio.backend import get_backend
 
-class HitObject:
-    """ Represents an Osu! HitObject """
 
-    from game.constants import HIT_OBJECT_TYPE as TYPE, HIT_OBJECT_STATE as STATE, \
-        HitObjectType as Type, HitObjectState as State
+def animation_delay(BPM: float, AR: float) -> float:
+    """ Return how long (seconds) before its reach time an object appears """
+    assert BPM > 0
+    assert 0 <= AR <= 10
+    AR = AR / 3
+    beat = 60 / BPM  # seconds
+    return beat * (1 + (10 - AR) / 3)  # seconds
+
 
-    TYPE_NAME_MAP = {
-        TYPE.TAP: 'soft-hitnormal.wav',
-        TYPE.HOLD: 'soft-hitwhistle.wav'
-    }
+class HitObjectStore:
+    """ Every hit object of a chart as parallel arrays, a row per object in
+    chart order. Times, press times and grades have a column for the start
+    and end of a HOLD; TAP objects only use the first, the rest is nan or -1.
+    Indexing returns a HitObjectView for code wanting one object at a time. """
 
-    TYPE_MAXLEN_MAP = {
-        TYPE.TAP: 1,
-        TYPE.HOLD: 2
-    }
+    from game.constants import HIT_OBJECT_TYPE as TYPE, HIT_OBJECT_STATE as STATE, GRADES, \
+        HitObjectType as Type, HitObjectState as State
 
     __slots__ = (
         '_reach_times',
         '_animation_times',
-        '_symbol',
-        '_type',
+        '_symbols',
+        '_types',
+        '_lengths',
+        '_states',
         '_press_times',
+        '_presses',
         '_grades',
-        '_beatmap',
-        '_state',
-        '_cache'
+        '_graded',
+        '_samples',
+        '_sounds',
     )
 
     def __init__(self,
                  beatmap: Beatmap,
-                 time: Union[Iterable[float], float],
-                 symbol: Union[Iterable[int], int],
-                 note_type: Type):
-        """  """
-        self._reach_times, self._symbol = self._filter_input(time, symbol, note_type)
-        self._press_times = []
-        self._type = note_type
-        self._calculate_animation_times(beatmap.BPM, beatmap.AR)
-        self._beatmap = beatmap
-        self._state = HitObject.STATE.INACTIVE
-        self._grades = []
-        self._cache = 0
-
-    def _filter_input(self,
-                      time: Union[Iterable[float], float],
-                      symbol: Union[Iterable[int], int],
-                      note_type: Type) -> (Iterable[float], Iterable[int]):
-        """ Check and return correct input (in list) or raise AssertionError """
-        error = 0
-        error_msg = "'time' and 'symbol' must be of len 2 in case of HOLD note_type"
-        if note_type == HitObject.TYPE.TAP:
-            try:
-                assert len(time) == 1, error_msg.format(1)
-            except TypeError:
-                time = [time]
-            try:
-                assert len(symbol) == 1, error_msg.format(1)
-            except TypeError:
-                symbol = symbol
-        elif note_type == HitObject.TYPE.HOLD:
-            try:
-                assert len(time) == 2 and len(symbol) == 2, error_msg.format(2)
-            except TypeError:
-                error = 2
+                 times: Iterable[float],
+                 symbols: Iterable[int],
+                 types: Optional[Iterable[HitObjectStore.Type]] = None,
+                 samples: Optional[Iterable[Tuple[str, ...]]] = None,
+                 rate: float = 1.):
+        """ `times` are reach times, or (start, end) rows for HOLD objects, already
+        scaled to the song played `rate` times as fast. `types` default to TAP.
+        `samples` are names of samples to play when each object is hit. """
+        times = np.asarray(times, dtype=float)
+        count = len(times)
+        self._reach_times = np.full((count, 2), np.nan)
+        if times.ndim == 1:
+            self._reach_times[:, 0] = times
         else:
-            raise AssertionError('wrong note_type, use constants.NOTE_TYPE')
-        if error in (1, 2):
-            raise AssertionError(error_msg.format(error))
-        return time, symbol
-
-    def _calculate_animation_times(self, BPM: float, AR: float):
-        """ Set the _animation_times """
-        assert BPM > 0
-        assert 0 <= AR <= 10
-        AR = AR / 3
-        beat = 60 / BPM  # seconds
-        delay = beat * (1 + (10 - AR) / 3)  # seconds
-        self._animation_times = [reach_time - delay for reach_time in self._reach_times]  # seconds
+            self._reach_times[:, :times.shape[1]] = times
+        self._animation_times = self._reach_times - animation_delay(beatmap.BPM * rate, beatmap.AR)
+        self._symbols = np.asarray(symbols, dtype=np.int64)
+        assert self._symbols.shape == (count,), 'one symbol per object'
+        self._types = np.full(count, HitObjectStore.TYPE.TAP, dtype=np.int8) if types is None \
+            else np.asarray(types, dtype=np.int8)
+        self._lengths = np.where(self._types == HitObjectStore.TYPE.HOLD, 2, 1).astype(np.int8)
+        assert not np.isnan(self._reach_times[np.arange(count), self._lengths - 1]).any(), \
+            'HOLD objects need a start and end time'
+        self._states = np.full(count, HitObjectStore.STATE.INACTIVE, dtype=np.int8)
+        self._press_times = np.full((count, 2), np.nan)
+        self._presses = np.zeros(count, dtype=np.int8)
+        self._grades = np.full((count, 2), -1, dtype=np.int8)  # index into GRADES
+        self._graded = np.zeros(count, dtype=np.int8)
+        self._samples = [('soft-hitnormal',)] * count if samples is None else list(samples)
+        self._sounds = [()] * count  # type: List[Tuple[pyglet.media.StaticSource, ...]]
+
+    def __len__(self) -> int:
+        return len(self._symbols)
+
+    def __getitem__(self, index: int) -> HitObjectView:
+        if not -len(self) <= index < len(self):
+            raise IndexError('hit object index out of range')
+        return HitObjectView(self, index % len(self))
+
+    def __iter__(self):
+        return (HitObjectView(self, index) for index in range(len(self)))
+
+    @property
+    def reach_times(self) -> np.ndarray:
+        """ Return (count, 2) game times (seconds) objects need to be interacted with """
+        return self._reach_times
+
+    @property
+    def first_reach_times(self) -> np.ndarray:
+        """ Return game time (seconds) each object is first reached """
+        return self._reach_times[:, 0]
+
+    @property
+    def last_reach_times(self) -> np.ndarray:
+        """ Return game time (seconds) each object is last reached, the end of a HOLD """
+        return self._reach_times[np.arange(len(self)), self._lengths - 1]
+
+    @property
+    def animation_times(self) -> np.ndarray:
+        """ Return (count, 2) game times (seconds) graphics engine need to start animations """
+        return self._animation_times
+
+    @property
+    def symbols(self) -> np.ndarray:
+        """ Return symbol of the key each object comes in """
+        return self._symbols
+
+    @property
+    def types(self) -> np.ndarray:
+        return self._types
+
+    @property
+    def states(self) -> np.ndarray:
+        """ Return current state of each object """
+        return self._states
+
+    @property
+    def press_times(self) -> np.ndarray:
+        """ Return (count, 2) times objects have been pressed, nan if not """
+        return self._press_times
+
+    @property
+    def grades(self) -> np.ndarray:
+        """ Return (count, 2) index into GRADES of each judgement, -1 if not judged """
+        return self._grades
+
+    @property
+    def samples(self) -> List[Tuple[str, ...]]:
+        return self._samples
+
+    @property
+    def sounds(self) -> List[Tuple[pyglet.media.StaticSource, ...]]:
+        """ Return sample bank entries of each object resolved by AudioEngine """
+        return self._sounds
+
+    def count(self, state: HitObjectStore.State) -> int:
+        """ Return how many objects are in `state` """
+        return int(np.count_nonzero(self._states == state))
+
+    def set_states(self, indices: np.ndarray, state: HitObjectStore.State):
+        """ Change the state of every object in `indices` at once """
+        self._states[indices] = state
+
+
+class HitObjectView:
+    """ One object of a HitObjectStore, read and written in place """
+
+    TYPE, STATE = HitObjectStore.TYPE, HitObjectStore.STATE
+
+    __slots__ = '_store', '_index'
+
+    def __init__(self, store: HitObjectStore, index: int):
+        self._store = store
+        self._index = index
+
+    def __eq__(self, other):
+        return isinstance(other, HitObjectView) and self._store is other._store and self._index == other._index
+
+    def __hash__(self):
+        return hash((id(self._store), self._index))
+
+    def __repr__(self):
+        return f'<HitObjectView {self._index} at {self.reach_times}>'
+
+    @property
+    def index(self) -> int:
+        """ Return row of the object in its store """
+        return self._index
 
     def press(self, time: float):
         """ Mark `time` as a press_time if pressable.
         Raise TimeoutError if not pressable """
-        if self._state == HitObject.STATE.ACTIVE:
-            self._press_times.append(time)
-            if len(self._press_times) == HitObject.TYPE_MAXLEN_MAP[self._type]:
-                self._state = HitObject.STATE.PASSED
-        elif self._state == HitObject.STATE.INACTIVE:
+        store, index = self._store, self._index
+        state = store._states[index]
+        if state == HitObjectStore.STATE.ACTIVE:
+            presses = store._presses[index]
+            store._press_times[index, presses] = time
+            store._presses[index] = presses = presses + 1
+            if presses == store._lengths[index]:
+                store._states[index] = HitObjectStore.STATE.PASSED
+        elif state == HitObjectStore.STATE.INACTIVE:
             pass
         else:
             raise TimeoutError('object is not pressable')
@@ -103,98 +195,87 @@ class HitObject:
     def reach_times(self) -> List[float]:
         """ Return list of times in relation to game_time (seconds)
         object needs to be interacted with by the player. """
-        return self._reach_times
+        store = self._store
+        return store._reach_times[self._index, :store._lengths[self._index]].tolist()
 
-    def get_reach_time(self) -> float:
-        """  """
-        try:
-            self._cache += 1
-            return self._reach_times[self._cache-1]
-        except IndexError:
-            pass
+    def get_reach_time(self) -> Optional[float]:
+        """ Return the reach time of the next judgement, None if all are judged """
+        store, index = self._store, self._index
+        graded = store._graded[index]
+        if graded < store._lengths[index]:
+            return float(store._reach_times[index, graded])
 
     @property
     def reach_times_ms(self) -> List[int]:
         """ Return reach_time in milliseconds """
-        return [int(time * 1000) for time in self._reach_times]
+        return [int(time * 1000) for time in self.reach_times]
 
     @property
     def animation_times(self) -> List[float]:
         """ Return list of times in relation to game_time (seconds)
         graphics engine need to start animations. """
-        return self._animation_times
+        store = self._store
+        return store._animation_times[self._index, :store._lengths[self._index]].tolist()
 
     @property
     def animation_times_ms(self) -> List[int]:
         """ Return animation_time in milliseconds """
-        return [int(time * 1000) for time in self._animation_times]
-
-    # @property
-    # def press_times(self) -> List[float]:
-    #     """ Return list of times object has been interacted with """
-    #     pass
-    #
-    # @property
-    # def press_times_ms(self) -> List[int]:
-    #     """ Return press_times in milliseconds """
-    #     pass
+        return [int(time * 1000) for time in self.animation_times]
 
     @property
     def symbol(self) -> int:
         """ Return symbol of the key the object is scheduled to come in """
-        return self._symbol
+        return int(self._store._symbols[self._index])
 
     @symbol.setter
     def symbol(self, new_symbol: int):
-        """ Set symbol to new_symbol """
-        # TODO add checking
-        self._symbol = new_symbol
+        self._store._symbols[self._index] = new_symbol
 
     @property
-    def hit_sound(self) -> (int, str):
-        """ Return hit_sounds of object """
-        # TODO only return normal for now
-        return 0, 'soft'
+    def samples(self) -> Tuple[str, ...]:
+        """ Return names of samples played when the object is hit """
+        return self._store._samples[self._index]
 
     @property
-    def type(self) -> HitObject.Type:
+    def sounds(self) -> Tuple[pyglet.media.StaticSource, ...]:
+        """ Return sample bank entries resolved from `samples` by AudioEngine """
+        return self._store._sounds[self._index]
+
+    @sounds.setter
+    def sounds(self, sounds: Tuple[pyglet.media.StaticSource, ...]):
+        self._store._sounds[self._index] = sounds
+
+    @property
+    def type(self) -> HitObjectStore.Type:
         """ Return type of object """
-        return self._type
+        return HitObjectStore.Type(int(self._store._types[self._index]))
 
     @property
-    def grades(self) -> Optional[Iterable[str]]:
-        """ Return grade of the object if graded. None otherwise. """
-        return self._grades
+    def grades(self) -> List[str]:
+        """ Return grades the object has been given """
+        store, index = self._store, self._index
+        return [HitObjectStore.GRADES[grade] for grade in store._grades[index, :store._graded[index]]]
 
     def add_grade(self, grade: str):
-        # TODO add checking
-        if len(self._grades) < HitObject.TYPE_MAXLEN_MAP[self._type]:
-            self._grades.append(grade)
-        else:
-            print(f'Over maxlen, did not process {grade}')
+        store, index = self._store, self._index
+        graded = store._graded[index]
+        assert graded < store._lengths[index], f'over maxlen, did not process {grade}'
+        store._grades[index, graded] = HitObjectStore.GRADES.index(grade)
+        store._graded[index] = graded + 1
 
     @property
-    def state(self) -> HitObject.State:
+    def state(self) -> HitObjectStore.State:
         """ Return current state of object """
-        return self._state
+        return HitObjectStore.State(int(self._store._states[self._index]))
 
-    def change_state(self, state: Union[str, HitObject.State]):
+    def change_state(self, state: Union[str, HitObjectStore.State]):
         if isinstance(state, str):
-            self._state = {
-                'active': HitObject.STATE.ACTIVE,
-                'inactive': HitObject.STATE.INACTIVE,
-                'passed': HitObject.STATE.PASSED
+            state = {
+                'active': HitObjectStore.STATE.ACTIVE,
+                'inactive': HitObjectStore.STATE.INACTIVE,
+                'passed': HitObjectStore.STATE.PASSED
             }[state]
-        else:
-            self._state = state
-
-    def _dt(self) -> List[float]:
-        """ Return the time difference (seconds) between reach_time and
-        press_time-- press_time - reach_time --of the instance.
-        Negative if pressed early; positive if late. """
-        assert self._state == HitObject.STATE.PASSED
-        # TODO
-        return [press - reach for press, reach in zip(self._press_times, self._reach_times)]
+        self._store._states[self._index] = state
 
 
 def get_relative_path(path: Path, relative_root: Path = Path().resolve()):
@@ -352,6 +433,11 @@ class Beatmap:
             return Path().resolve() / self._filepath.parent
         return self._filepath.parent
 
+    @property
+    def filepath(self) -> Path:
+        """ Return path of the .osu file """
+        return self._filepath
+
     @property
     def audio_filename(self) -> str:
         """ Return name of the song file """
@@ -399,24 +485,12 @@ class Beatmap:
         if self.video_filename:
             return self._loader.media(self.video_filename)
 
-    def generate_hit_objects(self) -> List[HitObject]:
-        """ Generate and return a list of processed hit_objects """
-        from random import seed, shuffle
-        from game.window import key
-
-        seed(round(sum(self._hit_times), 3))
+    def generate_hit_objects(self) -> HitObjectStore:
+        """ Generate and return the processed hit_objects """
+        from game import lanes
+        from game.replay import chart_hash
 
-        def get_random(L: list, cache=[]):
-            if not cache:
-                shuffle(L)
-                cache.extend(L[:5])
-            return cache.pop(-1)
-
-        hit_objects = [
-            HitObject(self, hit_time, get_random(key.normal_keys), HitObject.TYPE.TAP)
-            for hit_time in self._hit_times
-        ]
-        return hit_objects
+        return HitObjectStore(self, self._hit_times, lanes.assign(chart_hash(self), self._hit_times, lanes.KEYS))
 
     @property
     def version(self) -> str:
@@ -484,7 +558,7 @@ class Audio:
                     raise TypeError("Audio() missing 1 required keyword argument: 'filepath'")
             self._constructor = partial(loader.media, name=self._filename, streaming=self.streaming)
         self._source = self._constructor()
-        self._player = pyglet.media.Player()
+        self._player = get_backend().create_player()
         self._player.queue(self._source)
 
     @property
@@ -509,7 +583,7 @@ class Audio:
         This has no effect if the player is already playing.
         """
         if not self.streaming:
-            self._source.play()
+            get_backend().play_once(self._source)
         else:
             try:
                 assert not self.playing
@@ -572,55 +646,85 @@ class Audio:
 class AudioEngine:
     """ Manages audio requires loading beatmap """
 
-    __slots__ = '_beatmap', '_sample_sets', '_song', '_audios', '_players', '_default_loader'
+    __slots__ = '_beatmap', '_bank', '_song', '_default_folder', '_voices'
 
-    from game.constants import SAMPLE_NAMES, HIT_SOUND_MAP, SAMPLE_SET
+    HIT_SOUND_VOICES = 16  # players hit sounds share, enough for chords of every sample
 
     def __init__(self):
-        self._sample_sets = []  # type: List[Dict[str, Audio]]
-        self._default_loader = pyglet.resource.Loader(['resources/Default/sample', 'resources/Default'])
-
-    def load_beatmap(self, beatmap: Beatmap):
-        """ Call this each game """
+        self._bank = {}  # type: Dict[str, pyglet.media.StaticSource]
+        self._song = None  # type: Optional[Audio]
+        self._voices = None  # type: Optional[VoicePool]
+        self._default_folder = Path('resources/Default/sample')
+
+    def load_beatmap(self, beatmap: Beatmap, rate: float = 1.):
+        """ Call this each game. The song is played `rate` times as fast. """
+        from game.audio.stream import stream
+        from game.audio.loudness import gain
+        from game.audio.mp3 import open_song
+        from game.audio.stretch import stretch
+        if self._song:
+            self._song.source.close()
+        self.load_hit_sounds(beatmap)
+        constructor = lambda: stream(stretch(open_song(beatmap), rate))
+        self._song = Audio(filename=beatmap.audio_filename, constructor=constructor, streaming=True)
+        self._song.volume = gain(beatmap)
+
+    def load_hit_sounds(self, beatmap: Beatmap):
+        """ Ready the samples of `beatmap` and the voices they play on, but not
+        its song. load_beatmap calls this. """
         self._beatmap = beatmap
-        self._song = Audio(filename=beatmap.audio_filename, loader=beatmap.resource_loader, streaming=True)
-
-    def _generate_sample_set(self):
-        def generate_hit_sounds(self: Beatmap):
-            """ Generate and return a list of audio objects """
-            temp = [Audio(filename=name, loader=self._loader) for name in self._sample_filenames]
-            return temp
-        d = {audio.name[:-4]: audio for audio in generate_hit_sounds(self._beatmap)}
-        for name in AudioEngine.SAMPLE_NAMES:
-            if name not in d:
-                audio = Audio(filename=(name + '.wav'), loader=self._default_loader)
-                d[name] = audio
-        assert d != {}
-        self._sample_sets.append(d)
-
-    def _load_default(self, sample: str) -> Audio:
-        """ Load sample from default sample """
-        if sample not in AudioEngine.SAMPLE_NAMES:
+        self._bank = {}
+        if self._voices is None:
+            from game.audio.ui import VoicePool
+            self._voices = VoicePool(AudioEngine.HIT_SOUND_VOICES)
+
+    def _load_sample(self, name: str) -> pyglet.media.StaticSource:
+        """ Return bank entry of sample `name`, decoding it on first use.
+        Custom samples of the beatmap override the default ones. """
+        try:
+            return self._bank[name]
+        except KeyError:
             pass
-        audio = Audio(filepath=Path('resources/Default/sample/' + sample + '.wav'))
-        return audio
-
-    def play_sound(self, hit_sound: int, sample_set: str):
-        """ Play hit_sound according to code given """
-        assert hit_sound in AudioEngine.HIT_SOUND_MAP.keys()
-        assert sample_set in AudioEngine.SAMPLE_SET
-
-        for sample in AudioEngine.HIT_SOUND_MAP[hit_sound]:
-            name = sample_set + '-' + sample
-            for sample_dict in self._sample_sets:
-                if sample_dict[name].playing:
-                    continue
-                else:
-                    sample_dict[name].play()
-                    break
-            else:
-                self._generate_sample_set()
-                self._sample_sets[-1][name].play()
+        from game.audio import wav
+        filename = name + '.wav'
+        if filename in self._beatmap.sample_filenames:
+            source = wav.load(self._beatmap.get_folder_path() / filename)
+        else:
+            source = wav.load(self._default_folder / filename)
+        self._bank[name] = source
+        return source
+
+    def resolve_hit_sounds(self, hit_objects: HitObjectStore):
+        """ Point `sounds` of each of `hit_objects` at sample bank entries.
+        Call once after load_beatmap or load_hit_sounds so hitting needs no lookups. """
+        resolved = {}  # type: Dict[Tuple[str, ...], Tuple[pyglet.media.StaticSource, ...]]
+        for samples in set(hit_objects.samples):
+            resolved[samples] = tuple(self._load_sample(name) for name in samples)
+        hit_objects.sounds[:] = [resolved[samples] for samples in hit_objects.samples]
+
+    def schedule(self, time: float, sounds: Iterable[pyglet.media.StaticSource]):
+        """ Mix every sample bank entry in `sounds` into the song at song time
+        `time` (seconds), sample accurately. Schedule ahead of the decoder's lookahead. """
+        source = self._song.source
+        for sound in sounds:
+            source.schedule(time, sound)
+
+    def schedule_hit_sounds(self, hit_objects: HitObjectStore, times: Optional[np.ndarray] = None):
+        """ Schedule the sounds of every one of `hit_objects` at `times` (seconds,
+        nan for none), by default its first reach time, where autoplay presses
+        it. Call after resolve_hit_sounds and before the song starts. """
+        if times is None:
+            times = hit_objects.first_reach_times
+        for time, sounds in zip(times.tolist(), hit_objects.sounds):
+            if not np.isnan(time):
+                self.schedule(time, sounds)
+
+    def trigger(self, sounds: Iterable[pyglet.media.StaticSource]):
+        """ Play every sample bank entry in `sounds` on the preallocated voices.
+        Never creates a player. """
+        play = self._voices.play
+        for source in sounds:
+            play(source)
 
     @property
     def song(self) -> Audio:
@@ -13,7 +13,10 @@ import game.legacy.keyboard as keyboard_
 from game.type_ import *
 from game.constants import MouseState, MOUSE_STATE, UIElementState, UI_ELEMENT_STATE, GAME_STATE, GameState
 
-from game.legacy.audio import Beatmap, AudioEngine, HitObject
+from game.legacy.audio import Beatmap, AudioEngine, HitObjectView
+from game.replay import Replay, Playback, chart_hash
+import game.legacy.gameplay as gameplay_
+from game.legacy.gameplay import ScoreManager, HitObjectManager, Simulation, generate_hit_objects, scale_timing_points
 
 from game.window import Main, BaseForm
 
@@ -32,12 +35,19 @@ _hit_object_manager = None  # type: Optional[HitObjectManager]
 class TimeEngine:
     """ Manages time """
 
-    __slots__ = 'time', '_frame_times', '_t', '_start_time', '_dt', '_start', '_absolute_time'
+    __slots__ = 'time', 'time_ns', '_frame_times', '_t', '_start_time', '_dt', '_start', '_absolute_time', \
+                '_offset', '_anchor'
 
     def __init__(self, maxlen: int = 60):
         import time
         import collections
+        from game import config
         self.time = time.perf_counter
+        self.time_ns = time.perf_counter_ns
+        # (perf_counter_ns, game_time) read together, maps timestamps to game time
+        self._anchor = self.time_ns(), 0.
+        # measured audio + input latency, applied to everything timed by game_time
+        self._offset = config.get_value('audio_offset')
         self._frame_times = collections.deque(maxlen=maxlen)
         # Ensure that deque is not empty and sum() != 0
         self._t = self._start_time = self._absolute_time = self.time()
@@ -56,6 +66,18 @@ class TimeEngine:
         """ Start the clock """
         self._start = True
         self._start_time = self.time()
+        self.sync()
+
+    def sync(self):
+        """ Read the game clock against perf_counter_ns. Call once a frame. """
+        self._anchor = self.time_ns(), self.game_time
+
+    def to_game_time(self, timestamp_ns: int) -> float:
+        """ Return game time (seconds) at perf_counter_ns `timestamp_ns` """
+        if not self._start:
+            return 0
+        anchor_ns, anchor_time = self._anchor
+        return anchor_time + (timestamp_ns - anchor_ns) / 1e9
 
     def reset(self):
         """ Restart the clock """
@@ -74,7 +96,7 @@ class TimeEngine:
         """ Return current time at function call in seconds """
         try:
             assert self._start
-            return _audio_engine.song.time
+            return _audio_engine.song.time - self._offset
         except AssertionError:
             return 0
 
@@ -89,130 +111,6 @@ class TimeEngine:
         return self._dt
 
 
-class ScoreManager:
-    """ Manages calculation of score, combo, grade, etc. """
-
-    def __init__(self, beatmap: Beatmap):
-        from collections import deque
-        self._beatmap = beatmap
-        self._score = 0
-        self._combo = [0]
-        self._perfect = True
-        self._not_missed = True
-        self._accuracy_stack = deque(maxlen=20)
-        self._abs_accuracy_stack = []
-
-    def register_hit(self, hit_object: HitObject, time: float, type: HitObject.Type):
-        """ `time` = -1 for misses """
-        # TODO
-        ideal = hit_object.get_reach_time()
-        assert ideal is not None
-        accuracy = self._calculate_accuracy(ideal, time)
-        grade = self._calculate_grade(accuracy)
-        score = self._calculate_score(grade, type)
-
-        self._accuracy_stack.append(accuracy)
-        print(1 - abs(accuracy))
-        self._abs_accuracy_stack.append(1 - abs(accuracy))
-        if self._perfect:
-            if grade != 'perfect':
-                self._perfect = False
-        if grade == 'miss':
-            self._break_combo()
-            if self._not_missed:
-                self._not_missed = False
-        else:
-            self._combo[-1] += 1
-        hit_object.add_grade(grade)
-        self._score += score
-
-    def _calculate_accuracy(self, ideal: float, time: float) -> float:
-        dt = time - ideal
-        ac = dt / 0.5
-        if ac > 1:
-            ac = 1
-        elif ac < -1:
-            ac = -1
-        return ac
-
-    def _calculate_grade(self, accuracy: float) -> str:
-        abs_dt = abs(accuracy)
-        if abs_dt >= 1:
-            return 'miss'
-        if abs_dt >= 0.5:
-            return 'bad'
-        if abs_dt >= 0.3:
-            return 'ok'
-        if abs_dt >= 0.2:
-            return 'good'
-        if abs_dt >= 0.1:
-            return 'almost'
-        return 'perfect'
-
-    def _calculate_score(self, grade: str, type: HitObject.Type):
-        combo_bonus = (self.combo // 10) * 80
-        if grade == 'perfect':
-            return 300
-        if grade == 'almost':
-            return 300
-        if grade == 'good':
-            return 200
-        if grade == 'ok':
-            return 100
-        if grade == 'bad':
-            return 50
-        return 1
-
-    @property
-    def score(self) -> int:
-        """ Returns current score """
-        return self._score
-
-    @property
-    def combo(self) -> int:
-        """ Returns current combo """
-        return self._combo[-1]
-
-    def _break_combo(self):
-        self._combo.append(0)
-
-    @property
-    def overall_grade(self) -> str:
-        """ Returns current overall grade """
-        if self._perfect:
-            return 'SS'
-        if self._not_missed:
-            return 'S'
-        ac = self.overall_accuracy
-        if ac >= 0.8:
-            return 'A'
-        if ac >= 0.7:
-            return 'B'
-        if ac >= 0.6:
-            return 'C'
-        if ac >= 0.5:
-            return 'D'
-        return 'F'
-
-    @property
-    def overall_accuracy(self) -> float:
-        """ Returns current overall accuracy in percent """
-        try:
-            return sum(self._abs_accuracy_stack) / len(self._abs_accuracy_stack)
-        except ZeroDivisionError:
-            return 1
-
-    @property
-    def current_accuracies(self) -> Iterable[float]:
-        """ Returns current accuracies in accuracy """
-        return self._accuracy_stack
-
-    @property
-    def current_accuracy(self) -> Iterable[float]:
-        """ Returns instantaneous accuracy in accuracy """
-        raise NotImplementedError
-
-
 class FX:
     """ Represents a graphical fx """
 
@@ -274,9 +172,9 @@ class GraphicsEngine:
         self._keyboard = keyboard
         keyboard.set_graphics_engine(self)
 
-    def update(self):
-        """ Update graphics to match current data """
-        self._current_time = _time_engine.game_time
+    def update(self, time: float):
+        """ Update graphics to match current data at `time` """
+        self._current_time = time
         for fxs in self._fxs.values():
             if fxs[0].finish_time < self._current_time:
                 discard = fxs.pop(0)
@@ -315,6 +213,7 @@ class GraphicsEngine:
         self._draw_accuracy_bar()
 
         self._draw_game_time()
+        self._draw_stream()
 
         self._draw_fps()
 
@@ -428,12 +327,12 @@ class GraphicsEngine:
         """ Draw fx showing key releasing at `key` """
         pass
 
-    def add_hit_object_animation(self, key: Key, hit_object: HitObject):
+    def add_hit_object_animation(self, key: Key, hit_object: HitObjectView):
         """ Draw incoming hit_object """
         in_, out = self.create_incoming_fx(key, hit_object)
         self._register_fx([in_, out], hit_object)
 
-    def create_incoming_fx(self, key: Key, hit_object: HitObject) -> Iterable[FX]:
+    def create_incoming_fx(self, key: Key, hit_object: HitObjectView) -> Iterable[FX]:
         def f(*args, **kwargs):
             center_x, center_y, width, height, rgba, tilt_angle = args
 
@@ -530,113 +429,19 @@ class GraphicsEngine:
         output = f"audio time: {time:.3f}"
         arcade.draw_text(output, 20, window.height // 2 - 30, arcade.color.WHITE, 16)
 
-
-class HitObjectManager:
-    """ Manages sending hit_objects to keys and GraphicEngine"""
-
-    def __init__(self, hit_objects: List[HitObject], keyboard: Keyboard):
-        self._keys = keyboard.keys
-        self._incoming = self._hit_objects = hit_objects
-        self._sent = []  # type: List[HitObject]
-        self._passed = []  # type: List[HitObject]
-
-    def update(self):
-        time = _time_engine.game_time
-        send = []
-        for hit_object in self._incoming:
-            if time >= hit_object.animation_times[0]:
-                key = self._keys[hit_object.symbol]
-                key.hit_object = hit_object
-                _graphics_engine.add_hit_object_animation(key, hit_object)
-                hit_object.change_state('active')
-                send.append(hit_object)
-        for hit_object in self._sent:
-            if time > hit_object.reach_times[-1] + 0.2:
-                if hit_object.state != HitObject.STATE.PASSED:
-                    self._change_stack_and_remove_fx(hit_object)
-                    _score_manager.register_hit(hit_object, -1, hit_object.type)
-                    key = self._keys[hit_object.symbol]
-                    key.remove_hit_object()
-                    hit_object.change_state('passed')
-        if send:
-            for elem in send:
-                self._incoming.remove(elem)
-            self._sent.extend(send)
-
-    def _change_stack_and_remove_fx(self, hit_object: HitObject):
-        for elem in self._sent.copy():
-            if elem == hit_object:
-                self._sent.remove(hit_object)
-                self._passed.append(hit_object)
-                _graphics_engine.remove_fx(hash=hit_object)
-
-    def on_key_press(self, symbol: int, modifiers: int):
-        try:
-            key = self._keys[symbol]
-        except KeyError:
-            key = None
-        hit_object = None  # type: Optional[HitObject]
-        if key:
-            key.press()
-            try:
-                hit_object = key.hit_object
-            except AttributeError:
-                print('no object')
-        if hit_object:
-            _audio_engine.play_sound(*hit_object.hit_sound)
-            try:
-                time = _time_engine.game_time
-                hit_object.press(time)
-                _score_manager.register_hit(hit_object, time, hit_object.type)
-                assert hit_object.state == HitObject.STATE.PASSED
-                if hit_object.state == HitObject.STATE.PASSED:
-                    _graphics_engine.remove_fx(hash=hit_object)
-                    key.remove_hit_object()
-            except TimeoutError:
-                self._change_stack_and_remove_fx(hit_object)
-                key.remove_hit_object()
-                _graphics_engine.remove_fx(hash=hit_object)
-
-    def on_key_release(self, symbol: int, modifiers: int):
-        try:
-            key = self._keys[symbol]
-        except KeyError:
-            key = None
-        if key:
-            try:
-                key.hit_object.press(_time_engine.game_time)
-            except TimeoutError:
-                assert False, 'Dont reach this'
-                self._change_stack_and_remove_fx(key.hit_object)
-                key.remove_hit_object()
-            except AttributeError:
-                pass
-
-
-def generate_hit_objects(self: Beatmap) -> List[HitObject]:
-    """ Generate and return a list of processed hit_objects """
-    from random import seed, shuffle
-    from game.window import key
-
-    seed(round(sum(self._hit_times), 3))
-
-    def get_random(L: list, cache=[]):
-        if not cache:
-            shuffle(L)
-            cache.extend(L[:5])
-        return cache.pop(-1)
-
-    hit_objects = [
-        HitObject(self, hit_time, get_random(key.normal_keys), HitObject.TYPE.TAP)
-        for hit_time in self._hit_times
-    ]
-    print('called')
-    return hit_objects
+    def _draw_stream(self):
+        """ Show health of the song decoder """
+        stats = _audio_engine.song.source.stats
+        output = f"buffer: {stats.fill * 1000:.0f}/{stats.lookahead * 1000:.0f} ms  " \
+                 f"underruns: {stats.underruns}  decode: {stats.throughput:.0f}x"
+        arcade.draw_text(output, 20, window.height // 2 - 150, arcade.color.WHITE, 16)
 
 
 class Game(BaseForm):
 
-    def __init__(self, window_: Main, beatmap: Beatmap):
+    def __init__(self, window_: Main, beatmap: Beatmap, autoplay: bool = False, replay: Optional[Replay] = None):
+        """ Play `beatmap`, hitting every object on time if `autoplay`, or
+        with the key events of `replay` instead of the keyboard if given """
         super().__init__(window_)
         self.caption = 'musicality - Game'
 
@@ -653,25 +458,55 @@ class Game(BaseForm):
         global _score_manager, _hit_object_manager
 
         self._beatmap = beatmap
+        from game import config
+        digest = chart_hash(beatmap)
+        if replay is not None:
+            assert replay.chart_hash == digest, 'replay is of another chart'
+            self._rate = rate = replay.rate
+            simulation_rate = replay.simulation_rate
+            strategy = replay.strategy
+        else:
+            self._rate = rate = config.get_value('playback_rate')
+            simulation_rate = config.get_value('simulation_rate')
+            strategy = config.get_value('lane_strategy')
+        self._timing_points = scale_timing_points(beatmap.timing_points, rate)
 
         keyboard_.set_scaling(5)
         self._keyboard = Keyboard(self.width // 2, self.height // 2, model='small notebook', color=arcade.color.LIGHT_BLUE,
                                   alpha=150)
 
-        _score_manager = self._score_manager = ScoreManager(beatmap=self._beatmap)
-        self._hit_objects = generate_hit_objects(beatmap)
+        _score_manager = self._score_manager = ScoreManager(beatmap=self._beatmap, rate=rate)
+        self._hit_objects = generate_hit_objects(beatmap, rate, strategy)
         _hit_object_manager = self._hit_object_manager = HitObjectManager(hit_objects=self._hit_objects,
-                                                                          keyboard=self._keyboard)
+                                                                          keyboard=self._keyboard, rate=rate)
+        gameplay_._time_engine, gameplay_._audio_engine, gameplay_._graphics_engine = \
+            _time_engine, _audio_engine, _graphics_engine
+        gameplay_._score_manager, gameplay_._hit_object_manager = _score_manager, _hit_object_manager
 
         self._time_engine = _time_engine
         self._audio_engine = _audio_engine
         self._graphics_engine = _graphics_engine
 
-        for elem in (_audio_engine, _graphics_engine):
-            elem.load_beatmap(self._beatmap)
+        _audio_engine.load_beatmap(self._beatmap, rate)
+        _graphics_engine.load_beatmap(self._beatmap)
+        _audio_engine.resolve_hit_sounds(self._hit_objects)
+        self._autoplay = autoplay
+        # known inputs sound at exact samples of the song, scheduled before it is decoded
+        if autoplay:
+            _audio_engine.schedule_hit_sounds(self._hit_objects)
+        elif replay is not None:
+            from game.legacy.rescore import chart_arrays, rescore_replay
+            press_times = rescore_replay(chart_arrays(self._hit_objects, rate, strategy), replay).press_times
+            _audio_engine.schedule_hit_sounds(self._hit_objects, press_times)
+        _hit_object_manager.trigger_sounds = not autoplay and replay is None
+        self._playback = Playback(replay) if replay is not None else None
+        if not autoplay and replay is None:
+            _hit_object_manager.recording = Replay(digest, rate, config.get_value('audio_offset'), simulation_rate,
+                                                   strategy)
 
         _graphics_engine.set_keyboard(self._keyboard)
 
+        self._simulation = Simulation(_hit_object_manager, 1 / simulation_rate, self._playback, autoplay)
         self._update_rate = 1 / 60
         self._state = GAME_STATE.GAME_PAUSED
 
@@ -683,19 +518,34 @@ class Game(BaseForm):
         self._time_engine.start()
 
     def finish(self):
-        """ Stop the game """
+        """ Stop the game, saving the replay of a play """
         self.set_state(GAME_STATE.GAME_FINISH)
+        recording = self._hit_object_manager.recording
+        if recording is not None and len(recording):
+            recording.save()
 
     def pause(self):
         """ Pause the game """
         pass
 
-    def update(self, delta_time: float):
-        pass
+    def simulate(self, time: float):
+        """ Run every tick up to `time` (seconds), catching up after a slow frame """
+        self._simulation.run(time)
+
+    @property
+    def simulation_time(self) -> float:
+        """ Return game time (seconds) of the last tick run """
+        return self._simulation.time
+
+    @property
+    def render_time(self) -> float:
+        """ Return game time (seconds) to draw at, the clock clamped between
+        the last tick and the next """
+        return self._simulation.render_time(self._time_engine.game_time)
 
     def on_update(self, delta_time: float):
-        self._hit_object_manager.update()
-        self._graphics_engine.update()
+        self._time_engine.sync()
+        self.simulate(self._time_engine.game_time)
         if not self._audio_engine.song.playing:
             if self.state == GAME_STATE.GAME_PLAYING:
                 self.finish()
@@ -703,6 +553,7 @@ class Game(BaseForm):
     def on_draw(self):
         """ This is called during the idle time when it should be called """
         self._time_engine.tick()
+        self._graphics_engine.update(self.render_time)
         self._graphics_engine.on_draw()
 
     def on_resize(self, width: float, height: float):
@@ -718,19 +569,12 @@ class Game(BaseForm):
         if symbol == key_.NUM_SUBTRACT:
             self._audio_engine.song.volume *= 0.5
 
-        self._hit_object_manager.on_key_press(symbol, modifiers)
+        if not self._autoplay and not self._playback:
+            self._hit_object_manager.on_key_press(symbol, modifiers)
 
     def on_key_release(self, symbol: int, modifiers: int):
-        try:
-            key = self._keyboard.keys[symbol]
-        except KeyError:
-            key = None
-        if key:
-            key.release()
-            hit_object = key.hit_object
-            if hit_object:
-                if hit_object.type == HitObject.TYPE.HOLD:
-                    hit_object.press(self._time_engine.game_time)
+        if not self._autoplay and not self._playback:
+            self._hit_object_manager.on_key_release(symbol, modifiers)
 
     def on_mouse_motion(self, x: float, y: float, dx: float, dy: float):
         pass
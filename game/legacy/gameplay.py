@@ -0,0 +1,433 @@
+""" Gameplay of the legacy game: judging key presses against hit objects and scoring
+them, free of graphics so it also runs without a window """
+from __future__ import annotations
+
+from typing import Optional, Tuple, List, Dict, Deque, Iterable
+import bisect
+import collections
+
+from game.constants import GRADES
+from game.legacy.audio import Beatmap, HitObjectStore, HitObjectView
+from game.replay import Replay, Playback, chart_hash
+from osu.beatmap import TimingPoint
+
+# set by the game (or the headless runner) before gameplay starts
+_time_engine: Optional['TimeEngine'] = None
+_audio_engine: Optional['AudioEngine'] = None
+_graphics_engine: Optional['GraphicsEngine'] = None
+
+_score_manager: Optional[ScoreManager] = None
+_hit_object_manager: Optional[HitObjectManager] = None
+
+class ScoreManager:
+    """ Manages calculation of score, combo, grade, etc.
+
+    Every statistic is a running aggregate, updated in O(1) per judgement. """
+
+    GRADES = GRADES
+    GRADE_LIMITS = 0.1, 0.2, 0.3, 0.5, 1.  # |accuracy| from which each grade after perfect starts
+    GRADE_SCORES = 300, 300, 200, 100, 50, 1
+
+    def __init__(self, beatmap: Beatmap, rate: float = 1., bins: int = 41):
+        """ :param bins: number of bins of the hit error histogram over the judgement window """
+        from collections import deque
+        import numpy as np
+        self._beatmap = beatmap
+        # judgement window (seconds), fixed in song time so it shrinks when sped up
+        self._window = 0.5 / rate
+        self._score = 0
+        self._combo = 0
+        self._max_combo = 0
+        self._perfect = True
+        self._not_missed = True
+        self._accuracy_stack = deque(maxlen=20)
+        self._abs_accuracy_sum = 0.
+        self._judged = 0
+        self._grade_counts: Dict[str, int] = dict.fromkeys(ScoreManager.GRADES, 0)
+        # Welford's running mean and sum of squared deviations of hit error (seconds), misses excluded
+        self._error_count = 0
+        self._error_mean = 0.
+        self._error_m2 = 0.
+        self._histogram = np.zeros(bins, dtype=np.int64)
+
+    def register_hit(self, hit_object: HitObjectView, time: float, type: HitObjectStore.Type):
+        """ `time` = -1 for misses """
+        # TODO
+        ideal = hit_object.get_reach_time()
+        assert ideal is not None
+        accuracy = self._calculate_accuracy(ideal, time)
+        grade = self._calculate_grade(accuracy)
+        score = self._calculate_score(grade, type)
+
+        self._accuracy_stack.append(accuracy)
+        self._abs_accuracy_sum += 1 - abs(accuracy)
+        self._judged += 1
+        self._grade_counts[grade] += 1
+        if self._perfect:
+            if grade != 'perfect':
+                self._perfect = False
+        if grade == 'miss':
+            self._break_combo()
+            if self._not_missed:
+                self._not_missed = False
+        else:
+            self._combo += 1
+            if self._combo > self._max_combo:
+                self._max_combo = self._combo
+            self._add_error(time - ideal, accuracy)
+        hit_object.add_grade(grade)
+        self._score += score
+
+    def _add_error(self, error: float, accuracy: float):
+        self._error_count += 1
+        delta = error - self._error_mean
+        self._error_mean += delta / self._error_count
+        self._error_m2 += delta * (error - self._error_mean)
+        bins = len(self._histogram)
+        self._histogram[min(int((accuracy + 1) / 2 * bins), bins - 1)] += 1
+
+    def _calculate_accuracy(self, ideal: float, time: float) -> float:
+        dt = time - ideal
+        ac = dt / self._window
+        if ac > 1:
+            ac = 1
+        elif ac < -1:
+            ac = -1
+        return ac
+
+    def _calculate_grade(self, accuracy: float) -> str:
+        return ScoreManager.GRADES[bisect.bisect_right(ScoreManager.GRADE_LIMITS, abs(accuracy))]
+
+    def _calculate_score(self, grade: str, type: HitObjectStore.Type):
+        combo_bonus = (self.combo // 10) * 80
+        return ScoreManager.GRADE_SCORES[ScoreManager.GRADES.index(grade)]
+
+    @property
+    def score(self) -> int:
+        """ Returns current score """
+        return self._score
+
+    @property
+    def combo(self) -> int:
+        """ Returns current combo """
+        return self._combo
+
+    @property
+    def max_combo(self) -> int:
+        """ Returns highest combo so far """
+        return self._max_combo
+
+    def _break_combo(self):
+        self._combo = 0
+
+    @property
+    def overall_grade(self) -> str:
+        """ Returns current overall grade """
+        return ScoreManager.overall_grade_of(self._perfect, self._not_missed, self.overall_accuracy)
+
+    @staticmethod
+    def overall_grade_of(perfect: bool, not_missed: bool, ac: float) -> str:
+        """ Returns overall grade of a play with overall accuracy `ac` """
+        if perfect:
+            return 'SS'
+        if not_missed:
+            return 'S'
+        if ac >= 0.8:
+            return 'A'
+        if ac >= 0.7:
+            return 'B'
+        if ac >= 0.6:
+            return 'C'
+        if ac >= 0.5:
+            return 'D'
+        return 'F'
+
+    @property
+    def overall_accuracy(self) -> float:
+        """ Returns current overall accuracy in percent """
+        try:
+            return self._abs_accuracy_sum / self._judged
+        except ZeroDivisionError:
+            return 1
+
+    @property
+    def grade_counts(self) -> Dict[str, int]:
+        """ Returns number of judgements of each grade """
+        return self._grade_counts
+
+    @property
+    def hit_error_mean(self) -> float:
+        """ Returns mean hit error (seconds) of notes not missed, negative if early """
+        return self._error_mean
+
+    @property
+    def hit_error_variance(self) -> float:
+        """ Returns variance of hit error (seconds squared) of notes not missed """
+        if self._error_count < 2:
+            return 0.
+        return self._error_m2 / (self._error_count - 1)
+
+    @property
+    def unstable_rate(self) -> float:
+        """ Returns standard deviation of hit error in tenths of milliseconds """
+        return self.hit_error_variance ** 0.5 * 10000
+
+    @property
+    def histogram(self) -> 'np.ndarray':
+        """ Returns counts of hit errors in equal bins from -window to +window, early first """
+        return self._histogram
+
+    @property
+    def current_accuracies(self) -> Iterable[float]:
+        """ Returns current accuracies in accuracy """
+        return self._accuracy_stack
+
+    @property
+    def current_accuracy(self) -> Iterable[float]:
+        """ Returns instantaneous accuracy in accuracy """
+        raise NotImplementedError
+
+
+class HitObjectManager:
+    """ Manages sending hit_objects to keys and GraphicEngine.
+
+    Objects are rows of a HitObjectStore, kept sorted by when they spawn, when
+    they are reached and when they expire, with a cursor into each; a frame
+    only touches objects whose state changes. Each key has a lane, a FIFO of
+    its objects by reach time, whose head is the object a press of that key judges. """
+
+    def __init__(self, hit_objects: HitObjectStore, keyboard: 'Keyboard', rate: float = 1.):
+        import numpy as np
+        self._keys = keyboard.keys
+        self._late = late = 0.2 / rate  # seconds after the last reach time an object counts as missed
+        self._hit_objects = hit_objects
+        self._states = hit_objects.states
+
+        def by(times: np.ndarray) -> Tuple[np.ndarray, List[float]]:
+            order = np.argsort(times, kind='stable')
+            return order, times[order].tolist()
+
+        self._by_spawn, self._spawn_times = by(hit_objects.animation_times[:, 0])
+        self._by_reach, self._reach_times = by(hit_objects.first_reach_times)
+        self._by_expiry, self._expiry_times = by(hit_objects.last_reach_times + late)
+        self._spawn_cursor = self._reach_cursor = self._expiry_cursor = 0
+        self._sent: Dict[int, None] = {}  # ordered set of rows on screen
+        self._passed: List[int] = []
+
+        # lane of each key as rows in reach order, and the index of its head
+        symbols = hit_objects.symbols[self._by_reach]
+        self._lanes: Dict[int, List[int]] = {int(symbol): self._by_reach[symbols == symbol].tolist()
+                                             for symbol in np.unique(symbols)}
+        self._heads: Dict[int, int] = dict.fromkeys(self._lanes, 0)
+        # (time, symbol) of presses not judged yet, in time order
+        self._pressed: Deque[Tuple[float, int]] = collections.deque()
+        self.recording: Optional[Replay] = None  # logs every key event if set
+        self.trigger_sounds = True  # play hit sounds on press, off when they are scheduled in the song
+
+    def head(self, symbol: int) -> Optional[HitObjectView]:
+        """ Return the object a press of key `symbol` judges, None if no object is on its lane """
+        try:
+            lane = self._lanes[symbol]
+        except KeyError:
+            return None
+        head = self._heads[symbol]
+        if head < len(lane) and self._states[lane[head]] == HitObjectStore.STATE.ACTIVE:
+            return self._hit_objects[lane[head]]
+        return None
+
+    def _advance(self, symbol: int):
+        """ Move the head of lane `symbol` past judged objects """
+        lane, states = self._lanes[symbol], self._states
+        head = self._heads[symbol]
+        while head < len(lane) and states[lane[head]] == HitObjectStore.STATE.PASSED:
+            head += 1
+        self._heads[symbol] = head
+
+    def update(self, time: float):
+        """ Advance to `time`, one simulation tick """
+        self._judge_pressed(time)
+        hit_objects, states = self._hit_objects, self._states
+
+        cursor = self._spawn_cursor
+        stop = bisect.bisect_right(self._spawn_times, time, cursor)
+        if stop > cursor:
+            rows = self._by_spawn[cursor:stop]
+            hit_objects.set_states(rows, HitObjectStore.STATE.ACTIVE)
+            symbols = hit_objects.symbols
+            for row in rows.tolist():
+                _graphics_engine.add_hit_object_animation(self._keys[int(symbols[row])], hit_objects[row])
+                self._sent[row] = None
+            self._spawn_cursor = stop
+
+        by_expiry, expiry_times = self._by_expiry, self._expiry_times
+        cursor = self._expiry_cursor
+        while cursor < len(expiry_times) and time > expiry_times[cursor]:
+            row = int(by_expiry[cursor])
+            if states[row] != HitObjectStore.STATE.PASSED:
+                self._change_stack_and_remove_fx(row)
+                hit_object = hit_objects[row]
+                _score_manager.register_hit(hit_object, -1, hit_object.type)
+                states[row] = HitObjectStore.STATE.PASSED
+                self._advance(hit_object.symbol)
+            elif row in self._sent:
+                # hit in time, its fx are already gone
+                del self._sent[row]
+                self._passed.append(row)
+            cursor += 1
+        self._expiry_cursor = cursor
+
+    def _change_stack_and_remove_fx(self, row: int):
+        if row in self._sent:
+            del self._sent[row]
+            self._passed.append(row)
+            _graphics_engine.remove_fx(hash=self._hit_objects[row])
+
+    def autoplay(self, time: float):
+        """ Hit every object whose reach time has come by `time`, exactly on time.
+        Sounds are not triggered, they are expected to be scheduled. """
+        by_reach, reach_times, states = self._by_reach, self._reach_times, self._states
+        cursor = self._reach_cursor
+        while cursor < len(reach_times) and time >= reach_times[cursor]:
+            row = int(by_reach[cursor])
+            if states[row] == HitObjectStore.STATE.ACTIVE:
+                self._hit(self._hit_objects[row], reach_times[cursor])
+            cursor += 1
+        self._reach_cursor = cursor
+
+    def on_key_press(self, symbol: int, modifiers: int):
+        """ The press is timed when the event arrives, before anything else """
+        self.press(symbol, round(_time_engine.to_game_time(_time_engine.time_ns()) * 1e6))
+
+    def press(self, symbol: int, time_us: int):
+        """ Press key `symbol` at game time `time_us` (microseconds). The head
+        of the lane sounds at once; it is judged with the rest of the keys
+        pressed by then on the tick reaching the press time. """
+        try:
+            key = self._keys[symbol]
+        except KeyError:
+            return
+        if self.recording is not None:
+            self.recording.record(time_us, symbol, True)
+        key.press()
+        if self.trigger_sounds:
+            hit_object = self.head(symbol)
+            if hit_object:
+                _audio_engine.trigger(hit_object.sounds)
+        # judged at its recorded timestamp on the next tick reaching it, whatever the frame;
+        # insort as a new clock anchor can put a press a hair before the last one
+        bisect.insort(self._pressed, (time_us / 1e6, symbol))
+
+    def _judge_pressed(self, time: float):
+        """ Judge the heads of every lane pressed by `time`, a chord at once """
+        pressed = self._pressed
+        while pressed and pressed[0][0] <= time:
+            press_time, symbol = pressed.popleft()
+            hit_object = self.head(symbol)
+            if hit_object:
+                self._hit(hit_object, press_time)
+
+    def _hit(self, hit_object: HitObjectView, time: float):
+        """ Press `hit_object`, the head of its lane, at `time` """
+        try:
+            hit_object.press(time)
+            _score_manager.register_hit(hit_object, time, hit_object.type)
+            assert hit_object.state == HitObjectStore.STATE.PASSED
+            if hit_object.state == HitObjectStore.STATE.PASSED:
+                _graphics_engine.remove_fx(hash=hit_object)
+        except TimeoutError:
+            self._change_stack_and_remove_fx(hit_object.index)
+            _graphics_engine.remove_fx(hash=hit_object)
+        self._advance(hit_object.symbol)
+
+    def on_key_release(self, symbol: int, modifiers: int):
+        self.release(symbol, round(_time_engine.to_game_time(_time_engine.time_ns()) * 1e6))
+
+    def release(self, symbol: int, time_us: int):
+        """ Release key `symbol` at game time `time_us` (microseconds) """
+        try:
+            key = self._keys[symbol]
+        except KeyError:
+            return
+        if self.recording is not None:
+            self.recording.record(time_us, symbol, False)
+        key.release()
+        hit_object = self.head(symbol)
+        if hit_object and hit_object.type == HitObjectStore.TYPE.HOLD:
+            hit_object.press(time_us / 1e6)
+            self._advance(symbol)
+
+
+def generate_hit_objects(self: Beatmap, rate: float = 1., strategy: Optional[str] = None) -> HitObjectStore:
+    """ Generate and return a list of processed hit_objects for the song
+    played `rate` times as fast, with keys assigned by lane `strategy`
+    (default from config). Keys do not depend on `rate`. """
+    import numpy as np
+    from game import config, lanes
+
+    if strategy is None:
+        strategy = config.get_value('lane_strategy')
+    symbols = lanes.assign(chart_hash(self), self._hit_times, lanes.KEYS, strategy)
+    # animation times follow from BPM, which scales along with the hit times
+    hit_times = np.asarray(self._hit_times) / rate
+    return HitObjectStore(self, hit_times, symbols, samples=self.hit_samples, rate=rate)
+
+
+def scale_timing_points(timing_points: List[TimingPoint], rate: float) -> List[TimingPoint]:
+    """ Return `timing_points` for the song played `rate` times as fast.
+    Inherited points keep their negative slider velocity multiplier. """
+    import numpy as np
+    if rate == 1 or not timing_points:
+        return list(timing_points)
+    times = np.array([point.time for point in timing_points]) / rate
+    beat_lengths = np.array([point.beat_length for point in timing_points])
+    beat_lengths = np.where(beat_lengths > 0, beat_lengths / rate, beat_lengths)
+    return [point._replace(time=time, beat_length=beat_length)
+            for point, time, beat_length in zip(timing_points, times.tolist(), beat_lengths.tolist())]
+
+
+class Simulation:
+    """ Advances gameplay in fixed ticks of the game clock, whatever the frame rate """
+
+    __slots__ = '_hit_object_manager', 'step', '_ticks', '_playback', '_autoplay'
+
+    def __init__(self, hit_object_manager: HitObjectManager, step: float,
+                 playback: Optional[Playback] = None, autoplay: bool = False):
+        """
+        :param step: length of a tick (seconds)
+        :param playback: replay whose key events are fed in, if any
+        :param autoplay: hit every object exactly on time
+        """
+        self._hit_object_manager = hit_object_manager
+        self.step = step
+        self._ticks = 0
+        self._playback = playback
+        self._autoplay = autoplay
+
+    def tick(self):
+        """ Advance gameplay one tick """
+        self._ticks += 1
+        time = self.time
+        if self._playback:
+            self._playback.feed(self._hit_object_manager, time)
+        self._hit_object_manager.update(time)
+        if self._autoplay:
+            self._hit_object_manager.autoplay(time)
+
+    def run(self, time: float):
+        """ Run every tick up to `time` (seconds), catching up after a slow frame """
+        ticks = int(time // self.step)
+        while self._ticks < ticks:
+            self.tick()
+
+    @property
+    def time(self) -> float:
+        """ Return game time (seconds) of the last tick run """
+        return self._ticks * self.step
+
+    def render_time(self, time: float) -> float:
+        """ Return clock `time` (seconds) clamped between the last tick and the
+        next. Drawing is a function of time alone, so this is all there is to
+        interpolate: a frame moves smoothly with the clock between ticks, yet
+        never shows an object past a tick that has not judged it. """
+        last = self.time
+        return min(max(time, last), last + self.step)
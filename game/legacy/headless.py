@@ -0,0 +1,187 @@
+""" Runs the gameplay loop of a beatmap without a window, as fast as possible, for profiling """
+from __future__ import annotations
+
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List, NamedTuple, Optional
+import random
+import time
+
+import pyglet
+
+pyglet.options['shadow_window'] = False  # no window is opened, nor is there always a display to open one
+
+import numpy as np
+
+import game.legacy.gameplay as gameplay_
+from game.audio.backend import AudioEvent, NullBackend, get_backend, set_backend
+from game.legacy.audio import AudioEngine, HitObjectStore, HitObjectView
+from osu.beatmap import Beatmap
+from game.replay import Replay, Playback, chart_hash
+
+
+class Report(NamedTuple):
+    frames: int
+    ticks: int
+    wall_time: float  # seconds
+    frame_mean: float  # seconds of update per frame
+    frame_p99: float
+    score: int
+    accuracy: float
+    grade: str
+    grade_counts: Dict[str, int]
+    max_combo: int
+    unstable_rate: float
+    audio_events: List[AudioEvent]
+
+    @property
+    def fps(self) -> float:
+        """ Return frames simulated per wall clock second """
+        return self.frames / self.wall_time if self.wall_time else 0.
+
+    def __str__(self):
+        grades = ' '.join(f'{grade} {count}' for grade, count in self.grade_counts.items())
+        return (f'{self.frames} frames, {self.ticks} ticks in {self.wall_time:.3f} s ({self.fps:.0f} fps)\n'
+                f'update per frame: mean {self.frame_mean * 1e6:.1f} us, p99 {self.frame_p99 * 1e6:.1f} us\n'
+                f'score {self.score}, accuracy {self.accuracy:.2%}, grade {self.grade}, '
+                f'max combo {self.max_combo}, UR {self.unstable_rate:.1f}\n{grades}')
+
+
+class HeadlessClock:
+    """ Stands in for TimeEngine with a clock moved by hand """
+
+    __slots__ = 'game_time',
+
+    def __init__(self):
+        self.game_time = 0.
+
+    @staticmethod
+    def time_ns() -> int:
+        return time.perf_counter_ns()
+
+    def sync(self):
+        pass
+
+    def to_game_time(self, timestamp_ns: int) -> float:
+        return self.game_time
+
+
+class _NullGraphics:
+    """ Stands in for GraphicsEngine, drawing nothing """
+
+    def add_hit_object_animation(self, key, hit_object: HitObjectView):
+        pass
+
+    def remove_fx(self, *, fxs=None, hash=None):
+        pass
+
+    def update(self, time: float):
+        pass
+
+
+class _NullKey:
+    __slots__ = ()
+
+    def press(self):
+        pass
+
+    def release(self):
+        pass
+
+
+def autoplay_replay(beatmap: Beatmap, hit_objects: HitObjectStore, rate: float, simulation_rate: int, strategy: str,
+                    noise: float = 0., seed: int = 0, hold: float = 0.03) -> Replay:
+    """ Return a replay pressing every one of `hit_objects`, generated by lane
+    `strategy`, at its reach time, off by a normal error of `noise` (seconds)
+    standard deviation, and releasing `hold` seconds later """
+    rng = random.Random(seed)
+    events = []
+    for reach_time, symbol in zip(hit_objects.first_reach_times.tolist(), hit_objects.symbols.tolist()):
+        press = reach_time + (rng.gauss(0., noise) if noise else 0.)
+        events.append((round(press * 1e6), symbol, True))
+        events.append((round((press + hold) * 1e6), symbol, False))
+    events.sort(key=lambda event: (event[0], not event[2]))
+    replay = Replay(chart_hash(beatmap), rate, 0., simulation_rate, strategy)
+    for event in events:
+        replay.record(*event)
+    return replay
+
+
+def run(beatmap: Beatmap, noise: Optional[float] = 0., fps: float = 240., seed: int = 0,
+        rate: float = 1., simulation_rate: int = 1000, replay: Optional[Replay] = None,
+        strategy: Optional[str] = None) -> Report:
+    """ Play `beatmap` with no window, advancing the clock `1 / fps` seconds a
+    frame with no waiting, and return what it cost and scored.
+
+    Inputs come from `replay` if given; otherwise from autoplay, exact if
+    `noise` is 0 or None, else pressing with `noise` seconds of normal error,
+    on keys assigned by lane `strategy` (default from config).
+
+    Hit sounds play through a NullBackend moved along with the clock, whose
+    events are left in `Report.audio_events`. """
+    if replay is not None:
+        rate, simulation_rate, strategy = replay.rate, replay.simulation_rate, replay.strategy
+    elif strategy is None:
+        from game import config
+        strategy = config.get_value('lane_strategy')
+    clock = HeadlessClock()
+    backend = NullBackend(realtime=False)
+    previous_backend = get_backend()
+    set_backend(backend)
+    engines = (gameplay_._time_engine, gameplay_._audio_engine, gameplay_._graphics_engine,
+               gameplay_._score_manager, gameplay_._hit_object_manager)
+    gameplay_._time_engine = clock
+    gameplay_._graphics_engine = _NullGraphics()
+    try:
+        audio_engine = gameplay_._audio_engine = AudioEngine()
+        audio_engine.load_hit_sounds(beatmap)
+        hit_objects = gameplay_.generate_hit_objects(beatmap, rate, strategy)
+        audio_engine.resolve_hit_sounds(hit_objects)
+        keyboard = SimpleNamespace(keys={symbol: _NullKey() for symbol in np.unique(hit_objects.symbols).tolist()})
+        score_manager = gameplay_._score_manager = gameplay_.ScoreManager(beatmap, rate)
+        manager = gameplay_._hit_object_manager = gameplay_.HitObjectManager(hit_objects, keyboard, rate)
+        if replay is None:
+            replay = autoplay_replay(beatmap, hit_objects, rate, simulation_rate, strategy, noise or 0., seed)
+        simulation = gameplay_.Simulation(manager, 1 / simulation_rate, Playback(replay))
+
+        end = float(hit_objects.last_reach_times.max(initial=0.)) + 1.
+        step = 1 / fps
+        costs = []
+        started = time.perf_counter()
+        frame = 0
+        while clock.game_time < end:
+            frame += 1
+            clock.game_time = frame * step
+            backend.advance(step)
+            before = time.perf_counter_ns()
+            simulation.run(clock.game_time)
+            costs.append(time.perf_counter_ns() - before)
+        wall_time = time.perf_counter() - started
+    finally:
+        set_backend(previous_backend)
+        (gameplay_._time_engine, gameplay_._audio_engine, gameplay_._graphics_engine,
+         gameplay_._score_manager, gameplay_._hit_object_manager) = engines
+
+    costs = np.asarray(costs) / 1e9
+    return Report(frame, int(round(simulation.time * simulation_rate)), wall_time,
+                  float(costs.mean()) if frame else 0., float(np.percentile(costs, 99)) if frame else 0.,
+                  score_manager.score, score_manager.overall_accuracy, score_manager.overall_grade,
+                  dict(score_manager.grade_counts), score_manager.max_combo, score_manager.unstable_rate,
+                  backend.events)
+
+
+if __name__ == '__main__':
+    import argparse
+    from game.lanes import STRATEGIES
+    parser = argparse.ArgumentParser(description='Play a beatmap headless and report cost and score')
+    parser.add_argument('beatmap', type=Path, help='.osu file')
+    parser.add_argument('--noise', type=float, default=0., help='standard deviation of press error (seconds)')
+    parser.add_argument('--fps', type=float, default=240., help='frames simulated per song second')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rate', type=float, default=1., help='playback rate')
+    parser.add_argument('--tick', type=int, default=1000, help='simulation rate (Hz)')
+    parser.add_argument('--replay', type=Path, help='replay to play instead of autoplay')
+    parser.add_argument('--strategy', choices=sorted(STRATEGIES), help='lane strategy (default from config)')
+    args = parser.parse_args()
+    print(run(Beatmap(args.beatmap), args.noise, args.fps, args.seed, args.rate, args.tick,
+              Replay.load(args.replay) if args.replay else None, args.strategy))
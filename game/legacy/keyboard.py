@@ -168,7 +168,6 @@ class Key(DrawableRectangle):
         self._state = Key.STATE_INACTIVE
         self.pressable = kwargs.pop('pressable', True)
 
-        self._hit_object = None  # type: HitObject
         self._engine = None  # type: GraphicsEngine
 
         self.graphic = None
@@ -180,21 +179,6 @@ class Key(DrawableRectangle):
     def symbol(self):
         return self._symbol
 
-    @property
-    def hit_object(self) -> "HitObject":
-        """ """
-        if self._hit_object:
-            return self._hit_object
-
-    def remove_hit_object(self):
-        self._hit_object = None
-
-    @hit_object.setter
-    def hit_object(self, hit_object: "HitObject"):
-        if hit_object == None:
-            raise AssertionError('Use remove_hit_object() instead')
-        self._hit_object = hit_object
-
     def set_graphics_engine(self, engine: "GraphicsEngine"):
         self._engine = engine
 
@@ -0,0 +1,184 @@
+""" Batch scoring of replays with array operations, giving the judgements of playing them back """
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+
+from game.legacy.gameplay import ScoreManager
+from game.replay import Replay
+
+
+class Chart(NamedTuple):
+    """ Arrays of the tap objects of a chart, in the order they were generated """
+    reach: np.ndarray  # game time (seconds) each object is to be hit
+    spawn: np.ndarray  # game time (seconds) each object appears
+    lanes: np.ndarray  # key symbol of each object
+    rate: float
+    strategy: str  # lane strategy the keys were assigned by
+
+
+class Result(NamedTuple):
+    score: int
+    accuracy: float
+    grade: str
+    grade_counts: Dict[str, int]
+    combo: int
+    max_combo: int
+    hit_error_mean: float  # seconds
+    unstable_rate: float
+    histogram: np.ndarray  # counts of hit errors in bins over the judgement window
+    grades: np.ndarray  # index into ScoreManager.GRADES of each object, in chart order
+    press_times: np.ndarray  # game time (seconds) each object was hit, nan if missed
+
+
+def chart_arrays(hit_objects: 'HitObjectStore', rate: float, strategy: str) -> Chart:
+    """ Return the arrays of `hit_objects` generated for `rate` by lane `strategy` """
+    return Chart(hit_objects.first_reach_times.copy(), hit_objects.animation_times[:, 0].copy(),
+                 hit_objects.symbols.copy(), rate, strategy)
+
+
+def load_chart(beatmap: 'Beatmap', rate: float = 1., strategy: Optional[str] = None) -> Chart:
+    """ Return the arrays of the objects of `beatmap` played `rate` times as
+    fast, with keys assigned by lane `strategy` (default from config). To
+    rescore a replay, pass its `rate` and `strategy`. """
+    from game import config
+    from game.legacy.gameplay import generate_hit_objects
+    if strategy is None:
+        strategy = config.get_value('lane_strategy')
+    return chart_arrays(generate_hit_objects(beatmap, rate, strategy), rate, strategy)
+
+
+def _first_tick(times: np.ndarray, step: float, strict: bool = False) -> np.ndarray:
+    """ Return the first simulation tick, from 1, whose time is at or (if
+    `strict`) after each of `times`, computing tick times as Simulation does """
+    ticks = np.maximum(np.ceil(times / step), 1).astype(np.int64)
+    # correct the division's rounding against ticks * step
+    if strict:
+        ticks += ticks * step <= times
+        ticks -= ((ticks - 1) * step > times) & (ticks > 1)
+    else:
+        ticks += ticks * step < times
+        ticks -= ((ticks - 1) * step >= times) & (ticks > 1)
+    return ticks
+
+
+def _match(spawn: np.ndarray, expiry: np.ndarray, ticks: np.ndarray) -> np.ndarray:
+    """ Return the index of the object each press of a lane hits, -1 for none.
+
+    The head of the lane is the first object not hit nor expired by the
+    press's tick; it takes the press if it spawned on an earlier tick. While
+    every press takes its head, head_j = max(first_j, head_{j-1} + 1), which
+    is a running maximum. Presses that take nothing are dropped one at a time. """
+    count, n = len(ticks), len(spawn)
+    first = np.searchsorted(expiry, ticks, 'left')
+    heads = np.full(count, -1, dtype=np.int64)
+    start = floor = 0  # first press not settled, object after the last one hit
+    while start < count:
+        steps = np.arange(count - start)
+        head = np.maximum.accumulate(np.maximum(first[start:], floor) - steps) + steps
+        taken = head < n
+        taken[taken] = spawn[head[taken]] < ticks[start:][taken]
+        missed = np.flatnonzero(~taken)
+        stop = missed[0] if len(missed) else len(steps)
+        heads[start:start+stop] = head[:stop]
+        if stop:
+            floor = head[stop-1] + 1
+        if stop < len(steps) and head[stop] >= n:
+            break  # no object left for any later press
+        start += stop + 1
+    return heads
+
+
+def rescore(chart: Chart, times_us: np.ndarray, symbols: np.ndarray, downs: np.ndarray,
+            simulation_rate: int, bins: int = 41) -> Result:
+    """ Return the judgement of key events on `chart`, as playing them back at
+    `simulation_rate` ticks a second through HitObjectManager and
+    ScoreManager would. Hit error statistics agree to rounding. """
+    step = 1 / simulation_rate
+    rate = chart.rate
+    window = 0.5 / rate
+    late = 0.2 / rate
+    count = len(chart.reach)
+
+    expiry_times = chart.reach + late
+    spawn_ticks = _first_tick(chart.spawn, step)
+    expiry_ticks = _first_tick(expiry_times, step, strict=True)
+    # rank of each object in the order misses are registered within a tick
+    expiry_rank = np.empty(count, dtype=np.int64)
+    expiry_rank[np.argsort(expiry_times, kind='stable')] = np.arange(count)
+
+    presses = np.flatnonzero(downs)
+    press_times = times_us[presses] / 1e6
+    press_symbols = symbols[presses]
+    # presses are judged in (time, symbol) order
+    order = np.lexsort((press_symbols, press_times))
+    press_times, press_symbols = press_times[order], press_symbols[order]
+    press_ticks = _first_tick(press_times, step)
+
+    hit_by = np.full(count, -1, dtype=np.int64)  # press index hitting each object
+    by_reach = np.argsort(chart.reach, kind='stable')
+    lanes = chart.lanes[by_reach]
+    for symbol in np.unique(lanes):
+        objects = by_reach[lanes == symbol]
+        lane_presses = np.flatnonzero(press_symbols == symbol)
+        if not len(lane_presses):
+            continue
+        heads = _match(spawn_ticks[objects], expiry_ticks[objects], press_ticks[lane_presses])
+        taken = heads >= 0
+        hit_by[objects[heads[taken]]] = lane_presses[taken]
+
+    hit = hit_by >= 0
+    hit_times = np.where(hit, press_times[np.maximum(hit_by, 0)], -1.)
+    accuracy = np.clip((hit_times - chart.reach) / window, -1, 1)
+    grades = np.searchsorted(ScoreManager.GRADE_LIMITS, np.abs(accuracy), 'right')
+
+    # judgements in the order they happen: by tick, presses before misses
+    judged_ticks = np.where(hit, press_ticks[np.maximum(hit_by, 0)], expiry_ticks)
+    within = np.where(hit, hit_by, len(press_times) + expiry_rank)
+    sequence = np.lexsort((within, judged_ticks))
+
+    missed = grades[sequence] == len(ScoreManager.GRADES) - 1
+    runs = np.arange(1, count + 1) - np.maximum.accumulate(np.where(missed, np.arange(1, count + 1), 0))
+    accuracy_sum = np.cumsum(1 - np.abs(accuracy[sequence]))
+    scores = np.asarray(ScoreManager.GRADE_SCORES)[grades]
+    not_missed = grades != len(ScoreManager.GRADES) - 1
+    errors = (hit_times - chart.reach)[not_missed]
+    bin_index = np.minimum(((accuracy[not_missed] + 1) / 2 * bins).astype(np.int64), bins - 1)
+
+    grade_counts = np.bincount(grades, minlength=len(ScoreManager.GRADES))
+    overall = float(accuracy_sum[-1] / count) if count else 1
+    return Result(
+        score=int(scores.sum()),
+        accuracy=overall,
+        grade=ScoreManager.overall_grade_of(bool(grade_counts[0] == count), not bool(missed.any()), overall),
+        grade_counts=dict(zip(ScoreManager.GRADES, grade_counts.tolist())),
+        combo=int(runs[-1]) if count else 0,
+        max_combo=int(runs.max()) if count else 0,
+        hit_error_mean=float(errors.mean()) if len(errors) else 0.,
+        unstable_rate=float(errors.std(ddof=1) * 10000) if len(errors) > 1 else 0.,
+        histogram=np.bincount(bin_index, minlength=bins),
+        grades=grades,
+        press_times=np.where(hit, hit_times, np.nan),
+    )
+
+
+def rescore_replay(chart: Chart, replay: Replay) -> Result:
+    """ Return the judgement of `replay` on `chart` """
+    assert replay.rate == chart.rate, 'chart is generated for another rate'
+    assert replay.strategy == chart.strategy, 'chart has keys assigned by another lane strategy'
+    return rescore(chart, *replay.arrays(), replay.simulation_rate)
+
+
+def _rescore_bytes(chart: Chart, data: bytes) -> Result:
+    return rescore_replay(chart, Replay.from_bytes(data))
+
+
+def rescore_many(chart: Chart, replays: Iterable[bytes], max_workers: Optional[int] = None,
+                 chunksize: int = 64) -> List[Result]:
+    """ Return the judgement of every one of `replays` (as written by
+    Replay.to_bytes) on `chart`, spread over a process pool """
+    from functools import partial
+    with ProcessPoolExecutor(max_workers) as executor:
+        return list(executor.map(partial(_rescore_bytes, chart), replays, chunksize=chunksize))
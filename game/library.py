@@ -0,0 +1,124 @@
+""" Index of facts about song files, computed once and persisted between runs """
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Dict, Optional
+import atexit
+import json
+import os
+import threading
+import warnings
+
+INDEX_PATH = Path('library.json')
+SAVE_DELAY = 2.  # seconds updates are gathered before the index is written
+
+_index: Dict[str, Dict[str, Any]] = {}
+_loaded = False
+_dirty = False  # updated since last written
+_timer: Optional[threading.Timer] = None  # pending save
+_lock = threading.Lock()  # held to touch the index and the state above
+_save_lock = threading.Lock()  # held to write the file, so there is one writer at a time
+
+
+def _read():
+    """ Read the index from file. Call with the lock held. """
+    global _index, _loaded, _dirty
+    _index = {}
+    _loaded = True
+    _dirty = False
+    try:
+        with open(INDEX_PATH, encoding='utf8') as f:
+            _index = json.load(f)
+    except FileNotFoundError:
+        pass
+    except ValueError:
+        warnings.warn(f"reading library... '{INDEX_PATH}' is corrupted, rebuilding", ResourceWarning)
+
+
+def load():
+    with _lock:
+        _read()
+
+
+def _ensure_loaded():
+    if not _loaded:
+        with _lock:
+            if not _loaded:
+                _read()
+
+
+def save():
+    """ Write the index to file now. The file is replaced whole, so it is
+    never left half written. """
+    global _dirty
+    with _save_lock:
+        with _lock:
+            data = json.dumps(_index, indent=1)
+            _dirty = False
+        temp = INDEX_PATH.with_name(INDEX_PATH.name + '.tmp')
+        with open(temp, 'w', encoding='utf8') as f:
+            f.write(data)
+        os.replace(temp, INDEX_PATH)
+
+
+def _save_later():
+    global _timer
+    with _lock:
+        _timer = None
+        if not _dirty:
+            return
+    save()
+
+
+def flush():
+    """ Write pending updates now instead of after SAVE_DELAY """
+    global _timer
+    with _lock:
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+        dirty = _dirty
+    if dirty:
+        save()
+
+
+atexit.register(flush)
+
+
+def _stamp(filepath: Path) -> list:
+    stat = filepath.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def get_entry(filepath: Path) -> Dict[str, Any]:
+    """ Return what is known about the file at `filepath`. Empty if nothing
+    is, or if the file changed since it was indexed. """
+    _ensure_loaded()
+    entry = _index.get(filepath.as_posix())
+    if entry is None:
+        return {}
+    try:
+        if entry['stamp'] != _stamp(filepath):
+            return {}
+    except OSError:
+        return {}
+    return entry
+
+
+def update(filepath: Path, persist: bool = True, **values):
+    """ Record `values` about the file at `filepath`. If `persist`, it is
+    saved to file within SAVE_DELAY seconds, together with other updates. """
+    global _dirty, _timer
+    _ensure_loaded()
+    stamp = _stamp(filepath)
+    key = filepath.as_posix()
+    with _lock:
+        entry = _index.get(key)
+        if entry is None or entry['stamp'] != stamp:
+            entry = _index[key] = {'stamp': stamp}
+        entry.update(values)
+        _dirty = True
+        if persist and _timer is None:
+            _timer = threading.Timer(SAVE_DELAY, _save_later)
+            _timer.daemon = True
+            _timer.start()
@@ -0,0 +1,162 @@
+""" Recording of key events during a play, stored compactly and fed back through judgement """
+from __future__ import annotations
+
+from pathlib import Path
+from typing import List, Optional, Tuple
+import hashlib
+import struct
+import time
+import zlib
+
+import numpy as np
+
+REPLAY_FOLDER = Path('replays')
+MAGIC = b'MREP'
+VERSION = 2
+# magic, version, chart hash, rate, audio offset, simulation rate, lane strategy
+_HEADER = struct.Struct('<4sB16sddI16s')
+
+
+def chart_hash(beatmap: 'Beatmap') -> bytes:
+    """ Return MD5 digest of the chart file of `beatmap` """
+    with open(beatmap.filepath, 'rb') as f:
+        return hashlib.md5(f.read()).digest()
+
+
+def _write_varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    """ Return (value, offset after it) of the varint at `offset` """
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+class Replay:
+    """ Represents every key press and release of a play, in song time """
+
+    __slots__ = 'chart_hash', 'rate', 'offset', 'simulation_rate', 'strategy', '_times', '_symbols', '_downs'
+
+    def __init__(self, chart_hash: bytes, rate: float, offset: float, simulation_rate: int, strategy: str):
+        """
+        :param chart_hash: MD5 digest of the chart played
+        :param rate: playback rate of the play
+        :param offset: audio offset (seconds) the play was calibrated with
+        :param simulation_rate: simulation ticks per second the play was judged at
+        :param strategy: lane strategy keys were assigned to the chart by (see game.lanes)
+        """
+        self.chart_hash = chart_hash
+        self.rate = rate
+        self.offset = offset
+        self.simulation_rate = simulation_rate
+        self.strategy = strategy
+        self._times: List[int] = []  # microseconds of game time
+        self._symbols: List[int] = []
+        self._downs: List[bool] = []
+
+    def __len__(self) -> int:
+        return len(self._times)
+
+    def record(self, time_us: int, symbol: int, down: bool):
+        """ Log key `symbol` going down or up at game time `time_us` (microseconds) """
+        self._times.append(time_us)
+        self._symbols.append(symbol)
+        self._downs.append(down)
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Return time (microseconds), symbol and down of every event as arrays """
+        return (np.asarray(self._times, dtype=np.int64), np.asarray(self._symbols, dtype=np.int64),
+                np.asarray(self._downs, dtype=bool))
+
+    @property
+    def events(self) -> List[Tuple[int, int, bool]]:
+        """ Return (time in microseconds, symbol, down) of every event in order """
+        return list(zip(self._times, self._symbols, self._downs))
+
+    def to_bytes(self) -> bytes:
+        """ Return the replay as a header then zlib compressed varints: the
+        zigzag time delta from the previous event and the symbol with the
+        down flag in its lowest bit """
+        header = _HEADER.pack(MAGIC, VERSION, self.chart_hash, self.rate, self.offset, self.simulation_rate,
+                              self.strategy.encode('ascii'))
+        deltas = np.diff(np.asarray(self._times, dtype=np.int64), prepend=0)
+        zigzag = (deltas << 1) ^ (deltas >> 63)
+        out = bytearray()
+        _write_varint(out, len(self._times))
+        for delta, symbol, down in zip(zigzag.tolist(), self._symbols, self._downs):
+            _write_varint(out, delta)
+            _write_varint(out, symbol << 1 | down)
+        return header + zlib.compress(bytes(out), 9)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Replay:
+        """ Return the replay written by to_bytes. Raises ValueError if `data` is not one. """
+        try:
+            magic, version, digest, rate, offset, simulation_rate, strategy = _HEADER.unpack_from(data)
+        except struct.error:
+            raise ValueError('not a replay') from None
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'not a version {VERSION} replay')
+        replay = cls(digest, rate, offset, simulation_rate, strategy.rstrip(b'\0').decode('ascii'))
+        stream = zlib.decompress(data[_HEADER.size:])
+        count, offset = _read_varint(stream, 0)
+        time_us = 0
+        for _ in range(count):
+            zigzag, offset = _read_varint(stream, offset)
+            packed, offset = _read_varint(stream, offset)
+            time_us += (zigzag >> 1) ^ -(zigzag & 1)
+            replay.record(time_us, packed >> 1, bool(packed & 1))
+        return replay
+
+    def save(self, filepath: Optional[Path] = None) -> Path:
+        """ Write to `filepath`, or a new file in REPLAY_FOLDER. Return the path written. """
+        if filepath is None:
+            REPLAY_FOLDER.mkdir(exist_ok=True)
+            filepath = REPLAY_FOLDER / f'{self.chart_hash.hex()[:12]}-{time.strftime("%Y%m%d-%H%M%S")}.mrp'
+        with open(filepath, 'wb') as f:
+            f.write(self.to_bytes())
+        return filepath
+
+    @classmethod
+    def load(cls, filepath: Path) -> Replay:
+        with open(filepath, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+
+class Playback:
+    """ Feeds the events of a replay to a HitObjectManager as time passes """
+
+    __slots__ = '_replay', '_cursor'
+
+    def __init__(self, replay: Replay):
+        self._replay = replay
+        self._cursor = 0
+
+    def feed(self, manager: 'HitObjectManager', time: float):
+        """ Press and release keys of `manager` for every event up to game time `time` (seconds) """
+        replay = self._replay
+        times, symbols, downs = replay._times, replay._symbols, replay._downs
+        cursor = self._cursor
+        until = round(time * 1e6)
+        while cursor < len(times) and times[cursor] <= until:
+            if downs[cursor]:
+                manager.press(symbols[cursor], times[cursor])
+            else:
+                manager.release(symbols[cursor], times[cursor])
+            cursor += 1
+        self._cursor = cursor
+
+    @property
+    def done(self) -> bool:
+        """ Return whether every event has been fed """
+        return self._cursor >= len(self._replay)
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import List, Sequence, Tuple
+import statistics
+import time
+
+import arcade
+
+from game.window.window import BaseForm, Main
+from game.window import key
+from game.graphics import Text
+from game.audio.ui import get_sound
+from game import config
+
+
+def robust_offset(samples: Sequence[float], cutoff: float = 3) -> Tuple[float, float]:
+    """ Return (offset, jitter) in seconds of tap `samples`.
+
+    Taps further than `cutoff` robust deviations from the median are
+    discarded before taking the mean. Jitter is the median absolute
+    deviation scaled to be comparable to a standard deviation. """
+    assert samples, 'need at least one sample'
+    median = statistics.median(samples)
+    jitter = 1.4826 * statistics.median(abs(x - median) for x in samples)
+    if jitter == 0:
+        return median, 0.
+    kept = [x for x in samples if abs(x - median) <= cutoff * jitter]
+    return statistics.mean(kept), jitter
+
+
+class Calibration(BaseForm):
+    """ Screen measuring audio and input latency by tapping to a metronome """
+
+    BPM = 100
+    BEATS_PER_MEASURE = 4
+    WARM_UP = 4  # beats ignored before taps are recorded
+    TAPS = 32
+
+    def __init__(self, window: Main):
+        super().__init__(window)
+        self.caption = 'musicality - Calibration'
+
+        self._clock = time.perf_counter
+        self._start_time = self._clock()
+        self._interval = 60 / Calibration.BPM
+        self._tick = get_sound(Path('resources/Default/sample/normal-hitnormal.wav'))
+        self._accent = get_sound(Path('resources/Default/sample/normal-hitclap.wav'))
+
+        self._clicks: List[float] = []
+        self._taps: List[float] = []
+        self._result = None
+
+        self._title = Text('Tap SPACE on every click', self.width // 2 - 300, self.height // 2 + 120,
+                           arcade.color.WHITE, 36)
+        self._status = Text('', self.width // 2 - 300, self.height // 2, arcade.color.WHITE, 24)
+        self._hint = Text('R to restart, ESC to go back', self.width // 2 - 300, self.height // 2 - 80,
+                          arcade.color.WHITE, 16)
+        self.restart()
+
+    def restart(self):
+        """ Throw away recorded taps and start the metronome again """
+        self._clicks.clear()
+        self._taps.clear()
+        self._result = None
+        self._start_time = self._clock()
+
+    @property
+    def _time(self) -> float:
+        return self._clock() - self._start_time
+
+    def on_update(self, delta_time: float):
+        if self._result:
+            return
+        beat = int(self._time / self._interval)
+        while len(self._clicks) <= beat:
+            # record when the click was actually triggered, not when it was due
+            self._clicks.append(self._time)
+            if (len(self._clicks) - 1) % Calibration.BEATS_PER_MEASURE == 0:
+                self._accent.play()
+            else:
+                self._tick.play()
+
+    def on_draw(self):
+        self.clear()
+        if self._result:
+            offset, jitter = self._result
+            self._status.text = f'offset: {offset * 1000:+.1f} ms  jitter: {jitter * 1000:.1f} ms  (saved)'
+        else:
+            self._status.text = f'taps: {len(self._taps)} / {Calibration.TAPS}'
+        for text in (self._title, self._status, self._hint):
+            text.draw()
+
+    def on_key_press(self, symbol: int, modifiers: int):
+        if symbol == key.ESCAPE:
+            self.change_state('main menu')
+        elif symbol == key.R:
+            self.restart()
+        elif symbol == key.SPACE and not self._result:
+            self._register_tap(self._time)
+
+    def _register_tap(self, tap_time: float):
+        if len(self._clicks) <= Calibration.WARM_UP:
+            return
+        # the tap may be early for the click that is due next
+        candidates = self._clicks[-1], len(self._clicks) * self._interval
+        nearest = min(candidates, key=lambda click: abs(tap_time - click))
+        dt = tap_time - nearest
+        if abs(dt) > self._interval / 2:
+            return
+        self._taps.append(dt)
+        if len(self._taps) >= Calibration.TAPS:
+            self._result = offset, jitter = robust_offset(self._taps)
+            config.set_value('audio_offset', offset, persist=False)
+            config.set_value('audio_jitter', jitter)
+
+    def on_key_release(self, symbol: int, modifiers: int):
+        pass
+
+    def on_mouse_motion(self, x: int, y: int, dx: int, dy: int):
+        pass
+
+    def on_mouse_drag(self, x: int, y: int, dx: int, dy: int, buttons: int, modifiers: int):
+        pass
+
+    def on_mouse_press(self, x: int, y: int, button: int, modifiers: int):
+        pass
+
+    def on_mouse_release(self, x: int, y: int, button: int, modifiers: int):
+        pass
+
+    def on_mouse_scroll(self, x: int, y: int, scroll_x: int, scroll_y: int):
+        pass
+
+    def change_state(self, state: str):
+        if state == 'main menu':
+            self._window.change_handler(state)
@@ -475,12 +475,6 @@ key_specs = {
 #     Q, W, E, R, T, Y, U, I, O, P, BRACKETLEFT, BRACKETRIGHT, BACKSLASH
 # ]
 
-normal_keys = [
-    Z, X, C, V,
-    A, S, D, F,
-    Q, W, E, R,
-]
-
 MAP_SYMBOL_TEXT = {
     65289: 'TAB',
     65293: 'RETURN',
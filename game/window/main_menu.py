@@ -1,12 +1,16 @@
-from typing import List
+from __future__ import annotations
+
+from concurrent.futures import Future
+from typing import List, Optional
 from pathlib import Path
+import warnings
 
 import arcade
 
 from game.window.window import BaseForm, Main
 from game.graphics.element import Button, UIElement, Text
 from game.animation.ease import EaseColor
-from game.legacy.audio import Audio
+from game.audio.ui import get_sound
 
 
 def create_menu_button(text1: str, text2: str = '', color=arcade.color.PURPLE_HEART, secondary_color=arcade.color.RED_VIOLET):
@@ -29,7 +33,7 @@ def create_menu_button(text1: str, text2: str = '', color=arcade.color.PURPLE_HE
         except TimeoutError:
             raise
 
-    hover_sound = Audio(filepath=Path('resources/sound/menu hover.wav'), absolute=False)
+    hover_sound = get_sound(Path('resources/sound/menu hover.wav'))
 
     def change_to_secondary_color(self):
         change(self, self.primary_color, self.secondary_color)
@@ -44,7 +48,7 @@ def create_menu_button(text1: str, text2: str = '', color=arcade.color.PURPLE_HE
             pass
         try:
             assert not self.in_, 'called while already in'
-            hover_sound.play(force=True)
+            hover_sound.play()
             color_change.begin()
             self.add_action('on_draw', change_to_secondary_color, 1)
             self.text2.visible = True
@@ -81,28 +85,31 @@ class MainMenu(BaseForm):
 
         delayed_close = Timer(0.5, self.on_close)  # 1.5
 
-        backward_sound = Audio(filepath=Path('resources/sound/menu press backward.wav'), absolute=False)
+        backward_sound = get_sound(Path('resources/sound/menu press backward.wav'))
         exit_button = create_menu_button('Exit', 'See you later')
         exit_button.add_action('on_press', lambda *args: (backward_sound.play(), delayed_close.start()))
         exit_button.position = self.width//2, self.height-762
 
-        sound = Audio(filepath=Path('resources/sound/menu press options.wav'), absolute=False)
+        sound = get_sound(Path('resources/sound/menu press options.wav'))
         options_button = create_menu_button('Options', 'Change settings')
-        options_button.add_action('on_press', lambda *args: (sound.play(), ))
+        options_button.add_action('on_press', lambda *args: (sound.play(), self.change_state('calibration')))
         options_button.position = self.width//2, self.height-616
 
-        sound1 = sound.clone()
         edit_button = create_menu_button('Edit', 'Make your own level!')
-        edit_button.add_action('on_press', lambda *args: (sound1.play(), ))
+        edit_button.add_action('on_press', lambda *args: (sound.play(), self.generate_chart()))
         edit_button.position = self.width//2, self.height-470
 
-        sound2 = Audio(filepath=Path('resources/sound/menu press start.wav'), absolute=False)
+        sound2 = get_sound(Path('resources/sound/menu press start.wav'))
         start_button = create_menu_button('Start', 'Select songs to play!')
         start_button.add_action('on_press', lambda *args: (sound2.play(), self.change_state('song select')))
         start_button.position = self.width//2, self.height-324
 
         self.elements.extend((exit_button, options_button, edit_button, start_button))
 
+        self.selected = None  # type: Optional['Beatmap']  # last chosen in song select
+        self._chart_future = None  # type: Optional[Future]
+        self._status = Text('', 40, 60, arcade.color.WHITE, 24)
+
     def on_draw(self):
         self.clear()
         # DRAW BG
@@ -111,9 +118,17 @@ class MainMenu(BaseForm):
         # DRAW UI
         for element in self.elements:
             element.draw()
+        self._status.draw()
 
     def on_update(self, delta_time: float):
-        pass
+        future = self._chart_future
+        if future and future.done():
+            self._chart_future = None
+            if future.exception():
+                self._status.text = 'Failed to generate chart'
+                warnings.warn(f'generating chart... {future.exception()!r}', RuntimeWarning)
+            else:
+                self._status.text = f'Generated {future.result().name}'
 
     def on_key_press(self, symbol: int, modifiers: int):
         super().on_key_press(symbol, modifiers)
@@ -150,7 +165,18 @@ class MainMenu(BaseForm):
     def on_mouse_scroll(self, x: int, y: int, scroll_x: int, scroll_y: int):
         pass
 
+    def generate_chart(self):
+        """ Generate a chart from the audio of the song last selected in song select """
+        from game.audio import onset
+        if self.selected is None:
+            self._status.text = 'Select a song first'
+            return
+        if self._chart_future:
+            return
+        self._status.text = f'Generating chart for {self.selected.title}...'
+        self._chart_future = onset.submit(self.selected)
+
     def change_state(self, state: str):
-        if state == 'song select':
+        if state in ('song select', 'calibration'):
             self._window.change_handler(state)
 
@@ -2,15 +2,17 @@ from __future__ import annotations
 
 from pathlib import Path
 from functools import partial
+from typing import List
 
 import arcade
-import pyglet
 
 from game.window.window import BaseForm, Main
 from game.window import key
 from game.graphics import UIElement, Sprite, DrawableRectangle, Group, Text, Rectangle
 from game.animation.ease import EaseColor, EasePosition
-from game.legacy.audio import Audio
+from game.animation.beat import BeatScheduler
+from game.audio.ui import get_sound
+from game.audio import PreviewCache, PreviewPlayer, loudness, mp3
 from osu.beatmap import Beatmap, get_beatmaps
 
 _beatmaps = get_beatmaps()
@@ -57,13 +59,16 @@ class SongBar(UIElement):
         rec_ref = Rectangle(rec.center_x, rec.center_y+6, rec.width, rec.height-12)
         super().__init__(drawable, ref_shape=rec_ref)
         self.rec, self.white_wash, self.pic, self.title, self.artist_creator, self.version = rec, white_wash, pic, title, artist_creator, version
+        self.song_path = beatmap.get_folder_path() / beatmap.audio_filename
+        self.show_duration()
 
         change_bg = partial(window.change_bg, Sprite(beatmap.background_filepath, pic.bg_scale, center_x=window.width // 2, center_y=window.height // 2))
 
         print((beatmap.title, beatmap.artist, beatmap.version))
-        play = partial(window.play, beatmap.resource_loader.media(beatmap.audio_filename), beatmap.preview_timestamp)
+        play = partial(window.play, beatmap)
 
         def on_in():
+            window.preview_cache.prefetch(beatmap)
             if self.selected:
                 window.show_info()
 
@@ -79,6 +84,12 @@ class SongBar(UIElement):
         self.add_action('on_select', lambda *args: (setattr(args[0].white_wash, 'visible', True), args[0].move(-100, 0)))
         self.add_action('on_unselect', lambda *args: (setattr(args[0].white_wash, 'visible', False), args[0].move(100, 0)))
 
+    def show_duration(self):
+        """ Add the length of the song to the version text, if the library knows it """
+        duration = mp3.get_duration(self.beatmap, scan_missing=False)
+        if duration is not None:
+            minutes, seconds = divmod(round(duration), 60)
+            self.version.text = f'{self.beatmap.version}  {minutes}:{seconds:02}'
 
 
 class SlidingSongBar:
@@ -92,7 +103,7 @@ class SlidingSongBar:
         self.on_screen = []
         self.selected = []
 
-        hover_sound = Audio(filepath=Path('resources/sound/menu hover.wav'), absolute=False)
+        hover_sound = get_sound(Path('resources/sound/menu hover.wav'))
 
         overlap = 12
         pop = 100
@@ -121,6 +132,13 @@ class SlidingSongBar:
         from random import random
         self.on_mouse_scroll(0, 0, 0, int(random()*-80))
 
+    def show_durations(self, song_paths: List[Path]):
+        """ Show the durations of bars of `song_paths`, just analysed """
+        for group in self.song_bars:
+            for bar in group:
+                if bar.song_path in song_paths:
+                    bar.show_duration()
+
     def get_selected(self) -> Beatmap:
         if self.selected:
             return self.selected[0].beatmap
@@ -236,11 +254,11 @@ def create_back_button(text: str, color=arcade.color.ROSE_BONBON, secondary_colo
             except TimeoutError:
                 raise
 
-    hover_sound = Audio(filepath=Path('resources/sound/menu hover.wav'), absolute=False)
+    hover_sound = get_sound(Path('resources/sound/menu hover.wav'))
 
     def on_in(self: UIElement):
         assert not self.in_
-        hover_sound.play(force=True)
+        hover_sound.play()
         color_change.begin()
         eased_move.begin()
         try:
@@ -276,16 +294,22 @@ class SongSelect(BaseForm):
 
         self.elements = []  # type: List[UIElement]
 
-        backward_sound = Audio(filepath=Path('resources/sound/menu press backward.wav'), absolute=False)
+        backward_sound = get_sound(Path('resources/sound/menu press backward.wav'))
         back_button = create_back_button('back')
         back_button.add_action('on_press', lambda *args: (backward_sound.play(), self.change_state('main menu')))
 
         self.elements.append(back_button)
 
+        self.preview_cache = PreviewCache()
+        loudness.analyze_library(beatmap for mapset in _beatmaps.values() for beatmap in mapset.values())
         self.bar_manager = SlidingSongBar(self)
 
         self.bg = None
-        self.player = None
+        self.player = PreviewPlayer(self.preview_cache)
+        self.player.add_action('on_start', lambda player, beatmap: self.set_beats(beatmap))
+        # beats of the song previewed, pulsing the screen
+        self.beats = None  # type: Optional[BeatScheduler]
+        self._pulse = 0.
 
         self.bar_manager.on_mouse_press(1800, self.width//2, 1, 0)
         self.bar_manager.on_mouse_press(0, 1080, 2, 0)
@@ -293,22 +317,31 @@ class SongSelect(BaseForm):
         self.info = Info()
         self.elements.append(self.info)
 
+        self.rate_text = Text('', 40, self.height - 60, arcade.color.WHITE, 24)
+        self.change_rate(0)
+
     def change_bg(self, new_bg: Sprite):
         self.bg = new_bg
 
-    def play(self, audio_source: 'pyglet.media.Source', timestamp: float = 0):
-        if not self.player:
-            import pyglet
-            self.player = pyglet.media.Player()
-        if self.player.playing:
-            self.player.queue(audio_source)
-            self.player.next_source()
-            self.player.seek(timestamp)
-            self.player.play()
-        else:
-            self.player.queue(audio_source)
-            self.player.seek(timestamp)
-            self.player.play()
+    def play(self, beatmap: Beatmap):
+        """ Crossfade to the preview of `beatmap` once it is loaded in the background """
+        self.player.play(beatmap)
+
+    def set_beats(self, beatmap: Beatmap):
+        """ Pulse the screen on the beats of `beatmap` """
+        end = mp3.get_duration(beatmap, scan_missing=False) or max(beatmap.hit_times, default=beatmap.preview_timestamp) + 10
+        self.beats = BeatScheduler(beatmap.timing_points, end)
+        self.beats.reset(beatmap.preview_timestamp)
+        self.beats.add_action('on_beat', lambda beats: setattr(self, '_pulse', max(self._pulse, 0.5)))
+        self.beats.add_action('on_measure', lambda beats: setattr(self, '_pulse', 1.))
+
+    def change_rate(self, step: float):
+        """ Change playback rate of the game by `step`, within 0.5x to 1.5x """
+        from game import config
+        rate = round(min(max(config.get_value('playback_rate') + step, 0.5), 1.5), 2)
+        if step:
+            config.set_value('playback_rate', rate)
+        self.rate_text.text = f'Speed {rate:.2f}x  (- / =)'
 
     def get_selected(self) -> Beatmap:
         return self.bar_manager.get_selected()
@@ -319,20 +352,34 @@ class SongSelect(BaseForm):
         if self.bg:
             self.bg.draw()
         # DRAW UI
+        if self._pulse:
+            arcade.draw_lrtb_rectangle_filled(0, self.width, self.height, 0, (255, 255, 255, int(24 * self._pulse)))
         self.bar_manager.on_draw()
         for element in self.elements:
             element.draw()
+        self.rate_text.draw()
 
     def on_update(self, delta_time: float):
-        pass
+        self._pulse = max(0., self._pulse - delta_time * 4)
+        self.player.update(delta_time)
+        analysed = loudness.take_analysed()
+        if analysed:
+            self.bar_manager.show_durations(analysed)
+        if self.beats:
+            self.beats.update(self.player.time)
 
     def on_key_press(self, symbol: int, modifiers: int):
         if symbol == key.ESCAPE:
             self.change_state('main menu')
+        elif symbol == key.MINUS:
+            self.change_rate(-0.05)
+        elif symbol == key.EQUAL:
+            self.change_rate(0.05)
         elif symbol in (key.ENTER, key.SPACE):
             selected_beatmap = self.get_selected()
             if selected_beatmap:
-                self.change_state('game', selected_beatmap)
+                # shift to watch autoplay
+                self.change_state('game', selected_beatmap, bool(modifiers & key.MOD_SHIFT))
 
     def on_key_release(self, symbol: int, modifiers: int):
         pass
@@ -378,9 +425,9 @@ class SongSelect(BaseForm):
 
     def change_state(self, state: str, *args):
         if state == 'main menu':
-            self._window.change_handler(state)
+            self._window.change_handler(state, self.get_selected())
         elif state == 'game':
-            self.player.next_source()
+            self.player.stop()
             self._window.change_handler(state, *args)
 
     def show_info(self, arg=True):
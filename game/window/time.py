@@ -70,12 +70,14 @@ class Time:
 class TimeEngine:
     """ Manages time. Unit is in seconds. """
 
-    __slots__ = 'time', '_frame_times', '_t', '_start_time', '_dt', '_start', '_absolute_time', '_audio'
+    __slots__ = 'time', '_frame_times', '_t', '_start_time', '_dt', '_start', '_absolute_time', '_audio', '_offset'
 
     def __init__(self, maxlen: int = 60):
         import time
         import collections
+        from game import config
         self.time = time.perf_counter
+        self._offset = config.get_value('audio_offset')
         self._frame_times = collections.deque(maxlen=maxlen)
         self._t = self._start_time = self._absolute_time = self.time()
         self._dt = 0
@@ -127,9 +129,10 @@ class TimeEngine:
 
     @property
     def game_time(self) -> float:
-        """ Return time for the game. Same as audio time. """
+        """ Return time for the game. Same as audio time, corrected by
+        the calibrated audio offset. """
         if self._audio:
-            return self._audio.time
+            return self._audio.time - self._offset
         if self._start:
-            return self.play_time
+            return self.play_time - self._offset
         return 0.
@@ -845,9 +845,13 @@ class Main(arcade.Window):
                 self._handler = MainMenu(self)
             else:
                 self._handler = self._handler_cache[handler]
+            if args:
+                self._handler.selected, = args
+        elif handler == 'calibration':
+            from .calibration import Calibration
+            self._handler = Calibration(self)
         elif handler == 'game':
             from game.legacy.game import Game
-            beatmap = args[0]
-            self._handler = Game(self, beatmap)
+            self._handler = Game(self, *args)
 
 
@@ -1,13 +1,43 @@
-from typing import Union, List, Optional, TextIO, Dict, Iterable
+from typing import Union, List, Optional, TextIO, Dict, Iterable, NamedTuple, Tuple
 from pathlib import Path
 from io import StringIO
 import warnings
 
 import pyglet
 
+from game.constants import SAMPLE_SET, HIT_SOUND_MAP
+
 _beatmaps = {}
 
 
+class TimingPoint(NamedTuple):
+    """ Represents a line in [TimingPoints] """
+    time: float  # seconds
+    beat_length: float  # milliseconds, negative for inherited points
+    meter: int = 4
+    sample_set: int = 0  # 0 -> beatmap default, 1 -> normal, 2 -> soft, 3 -> drum
+    sample_index: int = 0
+    volume: int = 100
+    uninherited: bool = True
+    effects: int = 0
+
+    @classmethod
+    def from_line(cls, line: str) -> 'TimingPoint':
+        """ Parse a line of [TimingPoints]. Missing fields (old versions) use defaults. """
+        values = line.split(',')
+        time, beat_length = float(values[0]) / 1000, float(values[1])
+        rest = [int(value) for value in values[2:8]]
+        if len(rest) >= 5:
+            rest[4] = bool(rest[4])
+        return cls(time, beat_length, *rest)
+
+    @property
+    def BPM(self) -> Optional[float]:
+        """ Return BPM if uninherited, None otherwise """
+        if self.uninherited:
+            return 60000 / self.beat_length
+
+
 def get_relative_path(path: Path, relative_root: Path = Path().resolve()):
     """ Return a relative path. If already relative, return unchanged """
     from operator import truediv
@@ -39,7 +69,7 @@ class Beatmap:
 
         # custom sample override
         from game.constants import SAMPLE_NAMES
-        wav_files = filepath.glob('*.wav')
+        wav_files = filepath.parent.glob('*.wav')
         self._sample_filenames = [file.name for file in wav_files
                                   if file.name in (name + '.wav' for name in SAMPLE_NAMES)]
 
@@ -64,6 +94,17 @@ class Beatmap:
             preview_time = read_until(f, 'PreviewTime: ')
             self._preview_timestamp = int(preview_time) / 1000
 
+            # sample set used when neither hit object nor timing point specify one
+            self._sample_set = 'normal'
+            current_line = f.readline()
+            while not current_line.startswith('[') and current_line != '':
+                if current_line.startswith('SampleSet:'):
+                    sample_set = current_line.split(':')[1].strip().lower()
+                    if sample_set in SAMPLE_SET:
+                        self._sample_set = sample_set
+                    break
+                current_line = f.readline()
+
             def get_data(container: Dict,
                          str_heads: Iterable[str],
                          keys: Optional[Iterable[str]] = None,
@@ -140,20 +181,56 @@ class Beatmap:
 
             # TODO get average BPM instead
             read_until(f, '[TimingPoints]')
-            x = float(f.readline().split(',')[1])
-            self._BPM = 60000 / x
+            self._timing_points = []
+            current_line = f.readline()
+            while current_line.strip() not in ('', '[HitObjects]') and not current_line.startswith('['):
+                self._timing_points.append(TimingPoint.from_line(current_line))
+                current_line = f.readline()
+            # inherited points have no BPM of their own
+            self._BPM = next((point.BPM for point in self._timing_points if point.uninherited), None)
+            if self._BPM is None:
+                warnings.warn("reading .osu file... no uninherited timing point, assuming 120 BPM", ResourceWarning)
+                self._BPM = 120.
 
             self._hit_times = []
+            self._hit_samples = []
             read_until(f, '[HitObjects]')
             current_line = f.readline()
             i = 0
             n = 3000
+            point_index = 0
+            # without timing points, samples fall back to the beatmap default set
+            points = self._timing_points or [TimingPoint(0., 60000 / self._BPM)]
             while i < n and current_line not in ['\n', '']:
-                temp = current_line.split(',')[2]  # milliseconds str
-                self._hit_times.append(round(float(temp)/1000, 3))  # seconds
+                values = current_line.strip().split(',')
+                time = round(float(values[2])/1000, 3)  # seconds
+                self._hit_times.append(time)
+                # hit objects are sorted so the active timing point only moves forward
+                while point_index + 1 < len(points) and points[point_index + 1].time <= time:
+                    point_index += 1
+                self._hit_samples.append(self._resolve_hit_samples(values, points[point_index]))
                 i += 1
                 current_line = f.readline()
 
+    def _resolve_hit_samples(self, values: List[str], timing_point: TimingPoint) -> Tuple[str, ...]:
+        """ Return names of samples-- e.g. 'soft-hitnormal' --a hit object
+        line split into `values` plays, following osu! fallback rules:
+        hit object sample set, then timing point sample set, then beatmap default. """
+        hit_sound = int(values[4]) & 14 if len(values) > 4 else 0
+        normal_set = addition_set = 0
+        hit_sample = values[-1].split(':')
+        if len(values) > 5 and len(hit_sample) >= 5:
+            # hold notes prefix hitSample with endTime
+            normal_set, addition_set = int(hit_sample[-5]), int(hit_sample[-4])
+
+        def name(sample_set: int) -> str:
+            return SAMPLE_SET[sample_set - 1] if 1 <= sample_set <= len(SAMPLE_SET) else ''
+
+        normal = name(normal_set) or name(timing_point.sample_set) or self._sample_set
+        addition = name(addition_set) or normal
+        samples = HIT_SOUND_MAP[hit_sound]
+        return (normal + '-' + samples[0],) + tuple(addition + '-' + sample for sample in samples[1:])
+
     def __str__(self):
         return self._filepath.name[:-4]
 
@@ -225,6 +302,26 @@ class Beatmap:
     def preview_timestamp(self) -> float:
         return self._preview_timestamp
 
+    @property
+    def filepath(self) -> Path:
+        """ Return path of the .osu file (relative) """
+        return self._filepath
+
+    @property
+    def hit_times(self) -> List[float]:
+        """ Return times (seconds) of every hit object """
+        return self._hit_times
+
+    @property
+    def hit_samples(self) -> List[Tuple[str, ...]]:
+        """ Return names of the samples each hit object plays, resolved at load """
+        return self._hit_samples
+
+    @property
+    def timing_points(self) -> List[TimingPoint]:
+        """ Return timing points in the order they appear """
+        return self._timing_points
+
     @property
     def version(self) -> str:
         """ Return the version-- difficulty --of the instance """
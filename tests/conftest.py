@@ -0,0 +1,21 @@
+from pathlib import Path
+
+import pyglet
+import pytest
+
+pyglet.options['shadow_window'] = False  # tests open no window, and may have no display
+
+CHART = Path(__file__).parent.parent / 'resources' / 'Songs' / '406372 Takigawa Alisa - Sayonara no Yukue -TV size-' \
+    / 'Takigawa Alisa - Sayonara no Yukue ~TV size~ (Anxient) [Normal].osu'
+
+
+@pytest.fixture
+def chart_path():
+    """ Path of a bundled chart of 133 taps """
+    return CHART
+
+
+@pytest.fixture
+def beatmap(chart_path):
+    from osu.beatmap import Beatmap
+    return Beatmap(chart_path)
@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+import pytest
+
+from game.audio.backend import NullBackend
+
+
+def test_null_player_follows_the_virtual_clock():
+    backend = NullBackend(realtime=False)
+    player = backend.create_player()
+    first, second = SimpleNamespace(duration=1.), SimpleNamespace(duration=None)
+    player.queue(first)
+    player.queue(second)
+    player.play()
+    backend.advance(0.25)
+    assert player.source is first and player.time == 0.25 and player.playing
+    player.next_source()
+    backend.advance(0.5)
+    assert player.source is second and player.time == 0.5 and player.playing
+    player.pause()
+    backend.advance(1.)
+    assert player.time == 0.5 and not player.playing
+    assert [event.action for event in backend.events] == ['queue', 'queue', 'play', 'next_source', 'play', 'pause']
+    assert [event.time for event in backend.events][-1] == 0.75
+
+
+def test_null_player_moves_on_to_the_queued_source():
+    backend = NullBackend(realtime=False)
+    player = backend.create_player()
+    sources = [SimpleNamespace(duration=1.), SimpleNamespace(duration=0.5), SimpleNamespace(duration=2.)]
+    for source in sources:
+        player.queue(source)
+    player.play()
+    backend.advance(1.75)
+    assert player.source is sources[2] and player.time == 0.25 and player.playing
+    assert [(event.time, event.action) for event in backend.events[-2:]] == [(1., 'eos'), (1.5, 'eos')]
+    backend.advance(2.)
+    assert player.source is sources[2] and player.time == 2. and not player.playing
+    assert backend.events[-1] == (3.5, 0, 'eos', sources[2])
+
+
+def test_realtime_clock_cannot_be_advanced():
+    with pytest.raises(AssertionError):
+        NullBackend().advance(1.)
@@ -0,0 +1,40 @@
+import numpy as np
+
+from game.animation.beat import BeatScheduler
+from osu.beatmap import TimingPoint
+
+
+def make_scheduler():
+    """ 120 BPM in 4/4 from 1 s, 3/4 at 60 BPM from 5 s, with an inherited point in between """
+    points = [TimingPoint(1., 500.), TimingPoint(3., -50., uninherited=False), TimingPoint(5., 1000., meter=3)]
+    scheduler = BeatScheduler(points, 8.)
+    events = []
+    scheduler.add_action('on_beat', lambda s: events.append(('beat', s.beat)))
+    scheduler.add_action('on_measure', lambda s: events.append(('measure', s.beat)))
+    return scheduler, events
+
+
+def test_beats_follow_uninherited_points():
+    np.testing.assert_allclose(make_scheduler()[0].beat_times,
+                               [0., 0.5, 1., 1.5, 2., 2.5, 3., 3.5, 4., 4.5, 5., 6., 7.])
+
+
+def test_emits_once_per_passed_beat():
+    scheduler, events = make_scheduler()
+    for time in 0.9, 1., 1.2, 1.5:
+        scheduler.update(time)
+    assert events == [('beat', 1), ('beat', 2), ('measure', 2), ('beat', 3)]
+    events.clear()
+    scheduler.update(5.5)  # a jump emits only the latest beat, a downbeat in 3/4
+    assert events == [('beat', 10), ('measure', 10)]
+    assert scheduler.beat_in_measure == 0 and scheduler.progress(5.5) == 0.5
+
+
+def test_going_back_moves_without_emitting():
+    scheduler, events = make_scheduler()
+    scheduler.update(4.)
+    events.clear()
+    scheduler.update(1.2)
+    assert events == [] and scheduler.beat == 2
+    scheduler.update(1.5)
+    assert events == [('beat', 3)]
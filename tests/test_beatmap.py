@@ -0,0 +1,23 @@
+import re
+
+import pytest
+
+from osu.beatmap import Beatmap
+
+
+def without_timing_points(chart_path, tmp_path):
+    """ Return a copy of the chart at `chart_path` with an empty [TimingPoints] section """
+    text = re.sub(r'\[TimingPoints\]\n.*?\n\n', '[TimingPoints]\n\n', chart_path.read_text(encoding='utf8'), flags=re.S)
+    filepath = tmp_path / chart_path.name
+    filepath.write_text(text, encoding='utf8')
+    return filepath
+
+
+def test_chart_without_timing_points_loads_at_120_bpm(chart_path, tmp_path, monkeypatch):
+    filepath = without_timing_points(chart_path, tmp_path)
+    monkeypatch.chdir(tmp_path)
+    with pytest.warns(ResourceWarning, match='120 BPM'):
+        beatmap = Beatmap(filepath.relative_to(tmp_path))
+    assert beatmap.BPM == 120. and beatmap.timing_points == []
+    assert len(beatmap.hit_samples) == len(beatmap.hit_times) > 0
+    assert all(name.startswith('soft-') for samples in beatmap.hit_samples for name in samples)
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+from game import config
+
+
+@pytest.fixture
+def config_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'CONFIG_PATH', tmp_path / 'config.json')
+    monkeypatch.setattr(config, '_config', {})
+    return tmp_path / 'config.json'
+
+
+def test_offset_persists(config_path):
+    assert config.get_value('audio_offset') == 0.
+    config.set_value('audio_offset', 0.042)
+    assert json.loads(config_path.read_text())['audio_offset'] == 0.042
+    config.load()
+    assert config.get_value('audio_offset') == 0.042
+    assert config.get_value('audio_jitter') == config.DEFAULTS['audio_jitter']
+
+
+def test_corrupted_file_falls_back_to_defaults(config_path):
+    config_path.write_text('{')
+    with pytest.warns(ResourceWarning):
+        config.load()
+    assert config.get_value('audio_offset') == 0.
+
+
+def test_unknown_setting_is_refused(config_path):
+    with pytest.raises(AssertionError):
+        config.set_value('audio_ofset', 0.1)
+
+
+def test_robust_offset_ignores_stray_taps():
+    pytest.importorskip('arcade')
+    from game.window.calibration import robust_offset
+    offset, jitter = robust_offset([0.030, 0.032, 0.028, 0.031, 0.029, 0.5, -0.4])
+    assert offset == pytest.approx(0.030) and 0 < jitter < 0.01
+    assert robust_offset([0.02] * 3) == (0.02, 0.)
@@ -0,0 +1,48 @@
+import sys
+from types import SimpleNamespace
+
+from game.legacy import headless
+import game.legacy.gameplay as gameplay
+from game.audio.backend import get_backend, set_backend
+
+
+def test_runs_without_arcade():
+    assert 'arcade' not in sys.modules
+
+
+def test_autoplay_is_perfect(beatmap):
+    report = headless.run(beatmap, fps=60.)
+    assert report.grade_counts['perfect'] == sum(report.grade_counts.values()) > 0
+    assert report.accuracy == 1.
+
+
+def test_engines_are_restored(beatmap, monkeypatch):
+    sentinel = object()
+    for name in '_time_engine', '_audio_engine', '_graphics_engine', '_score_manager', '_hit_object_manager':
+        monkeypatch.setattr(gameplay, name, sentinel)
+    headless.run(beatmap, noise=0.05, fps=60.)
+    assert gameplay._time_engine is gameplay._score_manager is gameplay._hit_object_manager is sentinel
+    assert gameplay._audio_engine is gameplay._graphics_engine is sentinel
+
+
+def test_hit_sounds_play_through_a_null_backend(beatmap):
+    previous = object()
+    set_backend(previous)
+    try:
+        report = headless.run(beatmap, fps=60.)
+        assert get_backend() is previous
+    finally:
+        set_backend(None)
+    plays = [event for event in report.audio_events if event.action == 'play']
+    assert len(plays) >= sum(report.grade_counts.values())
+    assert plays[0].time > 0 and all(a.time <= b.time for a, b in zip(plays, plays[1:]))
+
+
+def test_render_time_stays_within_a_tick_of_the_simulation():
+    updates = []
+    simulation = gameplay.Simulation(SimpleNamespace(update=updates.append), 0.25)
+    simulation.run(0.6)
+    assert simulation.time == 0.5 and updates == [0.25, 0.5]
+    assert simulation.render_time(0.6) == 0.6
+    assert simulation.render_time(0.9) == 0.75  # the tick at 0.75 has not judged yet
+    assert simulation.render_time(0.4) == 0.5
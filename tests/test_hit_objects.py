@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from game.legacy.audio import HitObjectStore, HitObjectView
+
+BEATMAP = SimpleNamespace(BPM=120., AR=5.)
+TAP, HOLD = HitObjectStore.TYPE.TAP, HitObjectStore.TYPE.HOLD
+INACTIVE, ACTIVE, PASSED = HitObjectStore.STATE.INACTIVE, HitObjectStore.STATE.ACTIVE, HitObjectStore.STATE.PASSED
+
+
+@pytest.fixture
+def store():
+    return HitObjectStore(BEATMAP, [[1., np.nan], [2., 3.], [4., np.nan]], [122, 120, 122], types=[TAP, HOLD, TAP])
+
+
+def test_views_read_and_write_their_row(store):
+    tap, hold = store[0], store[1]
+    assert tap == store[0] and hash(tap) == hash(store[0]) and tap != hold
+    assert isinstance(tap, HitObjectView) and len(store) == 3
+    assert (tap.reach_times, hold.reach_times) == ([1.], [2., 3.])
+    np.testing.assert_array_equal(store.first_reach_times, [1., 2., 4.])
+    np.testing.assert_array_equal(store.last_reach_times, [1., 3., 4.])
+    assert (store.animation_times[:, 0] < store.first_reach_times).all()
+    tap.symbol = 99
+    assert store.symbols[0] == 99
+
+
+def test_press_until_passed(store):
+    store.set_states(np.arange(3), ACTIVE)
+    tap, hold = store[0], store[1]
+    tap.press(1.01)
+    assert tap.state == PASSED and store.press_times[0, 0] == 1.01
+    with pytest.raises(TimeoutError):
+        tap.press(1.02)
+    hold.press(2.)
+    assert hold.state == ACTIVE
+    hold.press(3.)
+    assert hold.state == PASSED and store.count(PASSED) == 2 and store.count(ACTIVE) == 1
+
+
+def test_grades_fill_one_column_per_judgement(store):
+    hold = store[1]
+    assert hold.get_reach_time() == 2.
+    hold.add_grade('good')
+    assert hold.get_reach_time() == 3.
+    hold.add_grade('perfect')
+    assert hold.get_reach_time() is None and hold.grades == ['good', 'perfect']
+    assert store.grades[1].tolist() == [HitObjectStore.GRADES.index('good'), HitObjectStore.GRADES.index('perfect')]
+    with pytest.raises(AssertionError):
+        hold.add_grade('ok')
+    assert store.grades[0].tolist() == [-1, -1]
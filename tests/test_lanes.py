@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from game import lanes
+
+DIGEST = bytes(range(16))
+
+
+@pytest.fixture
+def times():
+    rng = np.random.default_rng(0)
+    return np.cumsum(rng.choice([0.05, 0.1, 0.25, 0.5], 2000))
+
+
+@pytest.mark.parametrize('strategy', sorted(lanes.STRATEGIES))
+def test_same_chart_same_keys(times, strategy):
+    first = lanes.assign(DIGEST, times, lanes.KEYS, strategy)
+    lanes.clear_cache()
+    np.testing.assert_array_equal(lanes.assign(DIGEST, times, lanes.KEYS, strategy), first)
+    assert set(first.tolist()) <= set(lanes.KEYS)
+
+
+@pytest.mark.parametrize('keys', [8, 12])
+def test_jackless_never_reuses_a_key_within_the_gap(times, keys):
+    symbols = lanes.assign(DIGEST, times, lanes.KEYS[:keys], 'jackless')
+    for symbol in np.unique(symbols):
+        assert np.diff(times[symbols == symbol]).min() >= lanes.JACK_GAP
+
+
+def test_jackless_chord_wider_than_the_keys():
+    symbols = lanes.assign(DIGEST, [1.] * 6, lanes.KEYS[:4], 'jackless')
+    assert len(set(symbols[:4].tolist())) == 4
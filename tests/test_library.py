@@ -0,0 +1,58 @@
+import json
+import threading
+
+import pytest
+
+from game import library
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(library, 'INDEX_PATH', tmp_path / 'library.json')
+    monkeypatch.setattr(library, 'SAVE_DELAY', 60.)
+    library.load()
+    yield tmp_path
+    library.flush()
+
+
+def test_entries_persist(index):
+    song = index / 'song.mp3'
+    song.write_bytes(b'abc')
+    library.update(song, duration=1.)
+    library.flush()
+    library.load()
+    assert library.get_entry(song)['duration'] == 1.
+
+
+def test_concurrent_updates_are_batched_into_one_write(index, monkeypatch):
+    songs = []
+    for i in range(40):
+        songs.append(index / f'{i}.mp3')
+        songs[-1].write_bytes(b'x' * i)
+    writes = []
+    save = library.save
+    monkeypatch.setattr(library, 'save', lambda: (writes.append(1), save()))
+
+    threads = [threading.Thread(target=lambda part=part: [library.update(song, duration=len(song.name))
+                                                          for song in songs[part::4]])
+               for part in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not library.INDEX_PATH.exists()
+    library.flush()
+
+    assert len(writes) == 1
+    with open(library.INDEX_PATH, encoding='utf8') as f:
+        assert len(json.load(f)) == len(songs)
+    library.load()
+    assert library.get_entry(songs[7])['duration'] == len('7.mp3')
+
+
+def test_changed_file_is_not_trusted(index):
+    song = index / 'song.mp3'
+    song.write_bytes(b'abc')
+    library.update(song, duration=1.)
+    song.write_bytes(b'abcd')
+    assert library.get_entry(song) == {}
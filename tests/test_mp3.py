@@ -0,0 +1,66 @@
+import shutil
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from game import library
+from game.audio import loudness, mp3
+
+CHART = Path('resources/Songs/406372 Takigawa Alisa - Sayonara no Yukue -TV size-/'
+             'Takigawa Alisa - Sayonara no Yukue ~TV size~ (Anxient) [Normal].osu')
+SONG = CHART.parent / 'Sayonara no Yukue.mp3'
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(library, 'INDEX_PATH', tmp_path / 'library.json')
+    monkeypatch.setattr(library, 'SAVE_DELAY', 60.)
+    library.load()
+    yield tmp_path
+    library.flush()
+
+
+def test_scan_round_trips_through_library_entry():
+    index = mp3.scan(SONG)
+    restored = mp3.FrameIndex.from_entry(index.to_entry())
+    assert (restored.offsets == index.offsets).all()
+    assert restored.duration == index.duration
+    assert 60 < index.duration < 120
+
+
+def test_duration_is_not_scanned_unless_asked(index):
+    song = shutil.copy(SONG, index / 'song.mp3')
+    beatmap = SimpleNamespace(get_folder_path=lambda: index, audio_filename='song.mp3')
+    assert mp3.get_duration(beatmap, scan_missing=False) is None
+    assert mp3.get_duration(beatmap) == mp3.scan(Path(song)).duration
+    assert mp3.get_duration(beatmap, scan_missing=False) is not None
+
+
+def test_recorded_analysis_is_handed_out_once(index):
+    class Done:
+        @staticmethod
+        def result():
+            return {'loudness': -12.}
+
+    song = shutil.copy(SONG, index / 'song.mp3')
+    loudness._record(Path(song), Done)
+    assert loudness.take_analysed() == [Path(song)]
+    assert loudness.take_analysed() == []
+    assert library.get_entry(Path(song))['loudness'] == -12.
+
+
+def test_failures_warn_and_record_nothing(index):
+    class Failed:
+        @staticmethod
+        def result():
+            raise ValueError('no audio')
+
+    song = index / 'song.mp3'
+    song.write_bytes(b'not an mp3' * 100)
+    with pytest.warns(ResourceWarning, match='indexing mp3'):
+        assert mp3.get_index(song) is None
+    with pytest.warns(RuntimeWarning, match='analysing loudness'):
+        loudness._record(song, Failed)
+    assert loudness.take_analysed() == []
+    assert library.get_entry(song) == {}
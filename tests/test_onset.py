@@ -0,0 +1,66 @@
+from pathlib import Path
+from types import SimpleNamespace
+import warnings
+
+import numpy as np
+import pytest
+
+from game.audio import onset
+from osu.beatmap import Beatmap, TimingPoint
+
+
+def clicks(times, sample_rate=22050, duration=8.):
+    samples = np.zeros(int(duration * sample_rate), dtype=np.float32)
+    for time in times:
+        start = int(time * sample_rate)
+        samples[start:start+200] = np.hanning(200)
+    return samples, sample_rate
+
+
+def test_beat_grid_without_uninherited_points_is_empty():
+    assert len(onset.beat_grid([TimingPoint(0., -100., uninherited=False)], 10.)) == 0
+
+
+def test_beat_grid_extends_before_first_point():
+    grid = onset.beat_grid([TimingPoint(1.25, 500.)], 3.)
+    assert np.allclose(grid, np.arange(0., 3., 0.25))
+
+
+def test_detect_snaps_onsets_to_the_beat_grid(monkeypatch):
+    beats = np.arange(0.5, 7.5, 0.5)
+    monkeypatch.setattr(onset, 'load_mono', lambda filepath: clicks(beats + 0.02))
+    timing_points = [TimingPoint(0.5, 500.)]
+    onsets, detected = onset.detect('clicks.wav', timing_points)
+    assert np.allclose(onsets, beats) and detected == timing_points
+
+
+def test_detect_estimates_tempo_without_uninherited_points(monkeypatch):
+    beats = np.arange(0.5, 7.5, 0.5)
+    monkeypatch.setattr(onset, 'load_mono', lambda filepath: clicks(beats))
+    inherited = TimingPoint(0., -100., uninherited=False)
+    onsets, timing_points = onset.detect('clicks.wav', [inherited])
+    assert len(onsets) == len(beats)
+    assert np.abs(onsets - beats).max() < 0.05
+    estimated, = [point for point in timing_points if point.uninherited]
+    # the clicks' tempo or a whole fraction of it
+    assert estimated.beat_length / 500 == pytest.approx(round(estimated.beat_length / 500), abs=0.02)
+    assert inherited in timing_points
+
+
+def test_written_chart_keeps_the_estimated_tempo(beatmap, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    copy = SimpleNamespace(**{name: getattr(beatmap, name) for name in (
+        'audio_filename', 'preview_timestamp', 'title', 'unicode_title', 'artist', 'unicode_artist',
+        'HP', 'OD', 'AR', 'background_filename')}, get_folder_path=lambda: Path('.'))
+    timing_points = [TimingPoint(0.25, 60000 / 95), TimingPoint(1., -50., uninherited=False)]
+    path = onset.write_chart(copy, np.array([0.25, 0.5, 1.]), timing_points)
+    with warnings.catch_warnings():
+        warnings.filterwarnings('error', 'reading .osu file... no uninherited timing point')
+        written = Beatmap(path)
+    assert written.BPM == pytest.approx(95)
+    assert written.hit_times == [0.25, 0.5, 1.]
+
+
+def test_safe_filename():
+    assert onset.safe_filename('AC/DC - Back: In? <Black> [Auto].') == 'ACDC - Back In Black [Auto]'
+    assert onset.safe_filename('../..') == 'untitled'
@@ -0,0 +1,109 @@
+import math
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pyglet
+import pytest
+
+from game import library
+from game.audio.backend import NullBackend, get_backend, set_backend
+from game.audio.preview import PreviewCache, PreviewClip, PreviewPlayer
+
+FORMAT = pyglet.media.codecs.AudioFormat(channels=1, sample_size=16, sample_rate=1000)
+
+
+class SizedCache(PreviewCache):
+    """ Decodes a clip of `size` bytes named by each song """
+
+    __slots__ = ()
+
+    def _decode(self, beatmap):
+        return PreviewClip(b'\0' * beatmap.size, FORMAT)
+
+
+def song(name, size=100):
+    return SimpleNamespace(get_folder_path=lambda: Path(name), audio_filename='song.mp3', preview_timestamp=0.,
+                           size=size)
+
+
+def decoded(cache, beatmap, timeout=5.):
+    cache.prefetch(beatmap)
+    deadline = time.monotonic() + timeout
+    while cache.get(beatmap) is None:
+        assert time.monotonic() < deadline, 'clip was never decoded'
+        time.sleep(0.001)
+    return cache.get(beatmap)
+
+
+def test_least_recently_used_clips_are_dropped_over_budget():
+    cache = SizedCache(budget=250)
+    a, b, c = song('a'), song('b'), song('c')
+    decoded(cache, a)
+    decoded(cache, b)
+    cache.get(a)  # b is now the least recently used
+    decoded(cache, c)
+    assert cache.get(b) is None
+    assert cache.get(a) is not None and cache.get(c) is not None
+    assert cache.size == 200
+
+
+def test_a_clip_larger_than_the_budget_is_still_kept():
+    cache = SizedCache(budget=50)
+    clip = decoded(cache, song('a'))
+    assert clip.nbytes == 100 and clip.duration == 0.05
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(library, 'INDEX_PATH', tmp_path / 'library.json')
+    library.load()  # nothing analysed, every song plays at gain 1
+    previous = get_backend()
+    backend = NullBackend(realtime=False)
+    set_backend(backend)
+    yield backend
+    set_backend(previous)
+
+
+def started(player, timeout=5.):
+    deadline = time.monotonic() + timeout
+    while not player.playing:
+        assert time.monotonic() < deadline, 'preview never started'
+        time.sleep(0.001)
+        player.update(0.)
+
+
+def test_previews_crossfade_at_equal_power(backend):
+    cache = SizedCache()
+    a, b = song('a', 8000), song('b', 8000)
+    decoded(cache, a)
+    decoded(cache, b)
+    player = PreviewPlayer(cache, crossfade=0.4)
+    starts = []
+    player.add_action('on_start', lambda player, beatmap: starts.append(beatmap))
+
+    player.play(a)
+    started(player)
+    player.update(0.4)
+    deck_a = player._decks[0]
+    assert deck_a.volume == 1.
+
+    player.play(b)
+    while starts[-1] is a:
+        time.sleep(0.001)
+        player.update(0.)
+    deck_b = player._decks[0]
+    assert deck_b is not deck_a and starts == [a, b]
+    player.update(0.1)
+    assert deck_b.volume ** 2 + deck_a.volume ** 2 == pytest.approx(1.)
+    assert deck_b.volume == pytest.approx(math.sin(math.pi / 8))
+    player.update(0.3)
+    assert deck_b.volume == 1. and deck_a.source is None
+
+
+def test_clips_are_read_from_the_start_on_every_queue():
+    clip = PreviewClip(bytes(range(200)), FORMAT)
+    assert clip.duration == 0.1 and clip.nbytes == 200
+    first, second = clip.get_queue_source(), clip.get_queue_source()
+    assert first.get_audio_data(50).get_string_data() == bytes(range(50))
+    assert second.get_audio_data(200).get_string_data() == bytes(range(200))
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from game.legacy.gameplay import generate_hit_objects, scale_timing_points
+from osu.beatmap import TimingPoint
+
+
+def test_timing_points_scale_with_rate():
+    points = [TimingPoint(1., 500.), TimingPoint(3., -50., uninherited=False)]
+    assert scale_timing_points(points, 1.) == points
+    fast = scale_timing_points(points, 1.5)
+    assert fast[0].time == pytest.approx(1 / 1.5) and fast[0].beat_length == pytest.approx(500 / 1.5)
+    assert fast[1].time == pytest.approx(2.) and fast[1].beat_length == -50.
+    assert fast[1].uninherited is False
+
+
+def test_hit_objects_scale_with_rate_keeping_keys(beatmap):
+    normal = generate_hit_objects(beatmap, 1., 'random')
+    fast = generate_hit_objects(beatmap, 1.5, 'random')
+    np.testing.assert_array_equal(fast.symbols, normal.symbols)
+    np.testing.assert_allclose(fast.first_reach_times, normal.first_reach_times / 1.5)
+    np.testing.assert_allclose(fast.animation_times[:, 0], normal.animation_times[:, 0] / 1.5)
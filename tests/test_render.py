@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pyglet
+
+from game.audio import render, wav
+from game.audio.render import mix_at, write_wav
+from game.replay import Replay
+
+
+def test_mix_at_adds_every_hit_clipped_to_the_output():
+    rng = np.random.default_rng(0)
+    out = rng.random((1000, 2)).astype(np.float32)
+    sample = rng.random((50, 2)).astype(np.float32)
+    offsets = np.array([-10, 0, 3, 3, 500, 980, 1000, 2000])
+    gains = rng.random(len(offsets)).astype(np.float32)
+
+    expected = out.astype(np.float64)
+    for offset, gain in zip(offsets, gains):
+        if 0 <= offset < len(out):
+            end = min(offset + len(sample), len(out))
+            expected[offset:end] += gain * sample[:end - offset]
+    mix_at(out, sample, offsets, gains, batch=3)
+    np.testing.assert_allclose(out, expected, rtol=1e-5)
+
+
+def test_write_wav_clips_to_16_bit(tmp_path):
+    samples = np.array([[0., 0.5], [-2., 2.]])
+    write_wav(tmp_path / 'out.wav', samples, 44100)
+    data, audio_format = wav.read(tmp_path / 'out.wav')
+    assert (audio_format.channels, audio_format.sample_rate) == (2, 44100)
+    assert np.frombuffer(data, '<i2').tolist() == [0, 16383, -32767, 32767]
+
+
+def test_replay_hits_sound_where_the_replay_hits(beatmap):
+    from game.legacy import headless
+    from game.legacy.gameplay import generate_hit_objects
+    hit_objects = generate_hit_objects(beatmap, 1.5, 'random')
+    replay = headless.autoplay_replay(beatmap, hit_objects, 1.5, 1000, 'random', noise=0.02, seed=1)
+    pressed = Replay(replay.chart_hash, replay.rate, 0., 1000, replay.strategy)
+    for event in replay.events[2:]:  # all but the press and release of the first object
+        pressed.record(*event)
+
+    hits = render.replay_hits(beatmap, pressed)
+    expected = [name for samples in beatmap.hit_samples[1:] for name in samples]
+    assert [name for _, name in hits] == expected
+    times = np.array([time for time, _ in hits])
+    reach = np.repeat(np.asarray(beatmap.hit_times[1:]) / 1.5, [len(samples) for samples in beatmap.hit_samples[1:]])
+    assert np.abs(times - reach).max() < 0.1
+
+
+def test_render_stretches_the_song_and_delays_hits(tmp_path):
+    song = tmp_path / 'song.wav'
+    write_wav(song, np.zeros((44100 * 2, 1)), 44100)
+    click = np.zeros((100, 1))
+    click[0] = 0.5
+    write_wav(tmp_path / 'click.wav', click, 44100)
+    beatmap = SimpleNamespace(resource_loader=SimpleNamespace(media=lambda name, streaming: pyglet.media.load(
+        str(tmp_path / name), streaming=streaming)), audio_filename='song.wav', get_folder_path=lambda: tmp_path)
+
+    out = render.render(beatmap, tmp_path / 'out.wav', [(0.25, 'click')], rate=2., offset=0.1)
+    assert abs(len(out) - 44100) < 441
+    assert abs(int(np.argmax(np.abs(out[:, 0]))) - round(0.35 * 44100)) <= 1
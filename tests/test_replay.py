@@ -0,0 +1,22 @@
+import pytest
+
+from game.replay import Replay, MAGIC
+
+
+def test_round_trip():
+    replay = Replay(bytes(range(16)), 1.5, -0.012, 997, 'jackless')
+    for event in (0, 122, True), (30000, 122, False), (29999, 120, True), (2 ** 40, 65307, False):
+        replay.record(*event)
+    loaded = Replay.from_bytes(replay.to_bytes())
+    assert (loaded.chart_hash, loaded.rate, loaded.offset, loaded.simulation_rate, loaded.strategy) == \
+           (replay.chart_hash, 1.5, -0.012, 997, 'jackless')
+    assert loaded.events == replay.events
+
+
+def test_older_version_is_refused():
+    data = bytearray(Replay(bytes(16), 1., 0., 1000, 'random').to_bytes())
+    data[len(MAGIC)] = 1
+    with pytest.raises(ValueError):
+        Replay.from_bytes(bytes(data))
+    with pytest.raises(ValueError):
+        Replay.from_bytes(b'MREP')
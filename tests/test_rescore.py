@@ -0,0 +1,49 @@
+import random
+
+import numpy as np
+import pytest
+
+from game.legacy import headless, rescore
+import game.legacy.gameplay as gameplay
+from game.replay import Replay
+
+
+def sloppy_replay(beatmap, hit_objects, rate, simulation_rate, strategy, noise, seed):
+    """ Return an autoplay replay off by `noise` seconds, with a stray press
+    on a random lane every 2 seconds or so """
+    replay = headless.autoplay_replay(beatmap, hit_objects, rate, simulation_rate, strategy, noise, seed)
+    rng = random.Random(seed)
+    symbols = sorted(set(hit_objects.symbols.tolist()))
+    end = float(hit_objects.last_reach_times.max())
+    events = replay.events + [(rng.randrange(round(end * 1e6)), rng.choice(symbols), True)
+                              for _ in range(int(end / 2))]
+    events.sort(key=lambda event: (event[0], not event[2]))
+    sloppy = Replay(replay.chart_hash, rate, 0., simulation_rate, strategy)
+    for event in events:
+        sloppy.record(*event)
+    return sloppy
+
+
+@pytest.mark.parametrize('rate, simulation_rate, strategy, noise, fps, seed', [
+    (1., 1000, 'random', 0., 60., 0),
+    (1., 1000, 'pattern', 0.05, 144., 1),
+    (1.5, 240, 'jackless', 0.15, 30., 2),
+    (0.75, 997, 'random', 0.3, 60., 3),
+])
+def test_rescore_matches_live_play(beatmap, monkeypatch, rate, simulation_rate, strategy, noise, fps, seed):
+    hit_objects = gameplay.generate_hit_objects(beatmap, rate, strategy)
+    replay = sloppy_replay(beatmap, hit_objects, rate, simulation_rate, strategy, noise, seed)
+    result = rescore.rescore_replay(rescore.load_chart(beatmap, replay.rate, replay.strategy), replay)
+
+    stores = []  # the objects played live, judged in place
+    generate = gameplay.generate_hit_objects
+    monkeypatch.setattr(gameplay, 'generate_hit_objects',
+                        lambda *args, **kwargs: stores.append(generate(*args, **kwargs)) or stores[-1])
+    live = headless.run(beatmap, fps=fps, replay=replay)
+    store, = stores
+
+    assert (live.score, live.grade, live.grade_counts, live.max_combo) == \
+           (result.score, result.grade, result.grade_counts, result.max_combo)
+    assert live.accuracy == pytest.approx(result.accuracy)
+    np.testing.assert_array_equal(store.grades[:, 0], result.grades)
+    np.testing.assert_array_equal(store.press_times[:, 0], result.press_times)
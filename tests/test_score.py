@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from game.legacy.audio import HitObjectStore
+from game.legacy.gameplay import ScoreManager
+
+BEATMAP = SimpleNamespace(BPM=120., AR=5.)
+
+
+def test_running_statistics_match_the_whole_play():
+    rng = np.random.default_rng(0)
+    reach = np.arange(1., 201.)
+    errors = rng.normal(0., 0.08, len(reach))
+    missed = rng.random(len(reach)) < 0.1
+    store = HitObjectStore(BEATMAP, reach, np.zeros(len(reach), dtype=int))
+    score_manager = ScoreManager(BEATMAP)
+    for row, (time, error, miss) in enumerate(zip(reach.tolist(), errors.tolist(), missed.tolist())):
+        score_manager.register_hit(store[row], -1 if miss else time + error, store[row].type)
+
+    hit = errors[~missed]
+    accuracy = np.clip(hit / 0.5, -1, 1)
+    assert score_manager.hit_error_mean == pytest.approx(hit.mean())
+    assert score_manager.unstable_rate == pytest.approx(hit.std(ddof=1) * 10000)
+    assert score_manager.overall_accuracy == pytest.approx((1 - np.abs(accuracy)).sum() / len(reach))
+    assert score_manager.grade_counts['miss'] == missed.sum()
+    assert sum(score_manager.grade_counts.values()) == len(reach)
+    assert score_manager.histogram.sum() == len(hit)
+    runs = np.diff(np.flatnonzero(np.concatenate([[True], missed, [True]]))) - 1
+    assert score_manager.max_combo == runs.max()
+    assert score_manager.combo == runs[-1]
+    assert score_manager.overall_grade not in ('SS', 'S')
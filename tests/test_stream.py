@@ -0,0 +1,59 @@
+
+import numpy as np
+import pyglet
+from pyglet.media.codecs import AudioData, AudioFormat
+
+from game.audio.stream import StreamSource, RingBuffer
+
+
+class ToneSource(pyglet.media.StreamingSource):
+    """ `duration` seconds of a constant mono 16 bit signal """
+
+    def __init__(self, duration: float = 2., value: int = 0, sample_rate: int = 8000):
+        self.audio_format = AudioFormat(1, 16, sample_rate)
+        self.video_format = None
+        self._duration = duration
+        self._data = np.full(int(duration * sample_rate), value, dtype='<i2').tobytes()
+        self._position = 0
+        self.deleted = 0
+
+    def get_audio_data(self, bytes, compensation_time=0.0):
+        data = self._data[self._position:self._position+bytes]
+        if not data:
+            return None
+        timestamp = self._position / self.audio_format.bytes_per_second
+        self._position += len(data)
+        return AudioData(data, len(data), timestamp, len(data) / self.audio_format.bytes_per_second, [])
+
+    def seek(self, timestamp):
+        self._position = int(timestamp * self.audio_format.sample_rate) * 2
+
+    def delete(self):
+        self.deleted += 1
+
+
+def test_ring_buffer_wraps():
+    ring = RingBuffer(8)
+    assert ring.write(memoryview(b'abcdef')) == 6
+    assert ring.read(4) == b'abcd'
+    assert ring.write(memoryview(b'ghijklmn')) == 6
+    assert ring.read(8) == b'efghijkl'
+
+
+def test_close_stops_decoder_and_deletes_source():
+    source = ToneSource()
+    stream = StreamSource(source, lookahead=0.1, chunk=256)
+    assert stream.get_audio_data(256) is not None
+    stream.close()
+    stream._thread.join(1)
+    assert not stream._thread.is_alive()
+    stream.delete()
+    assert source.deleted == 1
+
+
+def test_sound_scheduled_before_first_read_is_mixed_from_the_start():
+    stream = StreamSource(ToneSource(), lookahead=0.1, chunk=256)
+    stream.schedule(0., ToneSource(duration=0.01, value=1000))
+    data = np.frombuffer(stream.get_audio_data(160).get_string_data(), dtype='<i2')
+    stream.close()
+    assert (abs(data[:80] - 1000) <= 1).all() and (data[80:] == 0).all()
@@ -0,0 +1,68 @@
+import wave
+
+from game.audio import wav
+from game.audio.backend import NullBackend, set_backend, get_backend
+from game.audio import ui
+from game.audio.ui import VoicePool
+
+
+def write_wav(path, frames=4410):
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(44100)
+        f.writeframes(b'\0\0' * frames)
+    return path
+
+
+def test_voice_pool_never_creates_players_while_playing(tmp_path):
+    previous = get_backend()
+    backend = NullBackend(realtime=False)
+    set_backend(backend)
+    try:
+        pool = VoicePool(4)
+        sources = [wav.load(write_wav(tmp_path / f'{i}.wav')) for i in range(3)]
+        for i in range(100):
+            pool.play(sources[i % 3])
+            backend.advance(0.2)
+    finally:
+        set_backend(previous)
+    actions = [event.action for event in backend.events]
+    assert 'play_once' not in actions
+    assert {event.player for event in backend.events} <= set(range(4))
+    # each source is queued once and then replayed by seeking back
+    assert actions.count('queue') == 3
+    assert actions.count('seek') == 97
+
+
+def test_voice_pool_steals_when_every_voice_is_busy(tmp_path):
+    previous = get_backend()
+    backend = NullBackend(realtime=False)
+    set_backend(backend)
+    try:
+        pool = VoicePool(2)
+        source = wav.load(write_wav(tmp_path / 'long.wav', 44100))
+        for _ in range(5):
+            pool.play(source)
+    finally:
+        set_backend(previous)
+    assert {event.player for event in backend.events} == {0, 1}
+    assert [event.action for event in backend.events].count('play') == 2
+
+
+def test_ui_sounds_are_loaded_once_and_share_a_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(ui, '_sounds', {})
+    monkeypatch.setattr(ui, '_pool', None)
+    previous = get_backend()
+    backend = NullBackend(realtime=False)
+    set_backend(backend)
+    try:
+        paths = [write_wav(tmp_path / f'{name}.wav') for name in ('click', 'hover')]
+        sounds = [ui.get_sound(path) for path in paths * 10]
+        assert len({id(sound) for sound in sounds}) == 2
+        for sound in sounds:
+            sound.play()
+            backend.advance(0.05)
+    finally:
+        set_backend(previous)
+    assert {event.player for event in backend.events} <= set(range(4))
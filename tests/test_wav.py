@@ -0,0 +1,61 @@
+import struct
+import wave
+
+import pytest
+
+from game.audio import wav
+
+FRAMES = bytes(range(256)) * 8  # 512 frames of 16 bit stereo
+
+
+def write_wav(path, channels=2, width=2, rate=8000, data=FRAMES):
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(channels)
+        f.setsampwidth(width)
+        f.setframerate(rate)
+        f.writeframes(data)
+    return path
+
+
+def with_chunk_before_data(path, chunk_id, payload):
+    """ Insert a chunk after the format chunk, word aligned as RIFF wants """
+    data = path.read_bytes()
+    at = data.index(b'data')
+    chunk = struct.pack('<4sI', chunk_id, len(payload)) + payload + b'\0' * (len(payload) & 1)
+    data = data[:at] + chunk + data[at:]
+    path.write_bytes(data[:4] + struct.pack('<I', len(data) - 8) + data[8:])
+    return path
+
+
+def test_reads_pcm_without_copying(tmp_path):
+    data, audio_format = wav.read(write_wav(tmp_path / 'a.wav'))
+    assert isinstance(data, memoryview) and data.tobytes() == FRAMES
+    assert (audio_format.channels, audio_format.sample_size, audio_format.sample_rate) == (2, 16, 8000)
+
+
+def test_skips_odd_sized_chunks(tmp_path):
+    path = with_chunk_before_data(write_wav(tmp_path / 'a.wav'), b'LIST', b'odd')
+    assert wav.read(path)[0].tobytes() == FRAMES
+
+
+def test_refuses_what_it_cannot_map(tmp_path, monkeypatch):
+    maps = []
+    open_map = wav.mmap.mmap
+    monkeypatch.setattr(wav.mmap, 'mmap', lambda *args, **kwargs: maps.append(open_map(*args, **kwargs)) or maps[-1])
+    (tmp_path / 'text.wav').write_bytes(b'not a wave file')
+    with pytest.raises(ValueError):
+        wav.read(tmp_path / 'text.wav')
+    with pytest.raises(ValueError):
+        wav.read(write_wav(tmp_path / '24bit.wav', width=3, data=FRAMES[:768]))
+    assert len(maps) == 2 and all(buffer.closed for buffer in maps)
+
+
+def test_queue_source_reads_from_where_it_is_seeked(tmp_path):
+    source = wav.load(write_wav(tmp_path / 'a.wav'))
+    assert isinstance(source, wav.WavSource) and source.duration == 512 / 8000
+    player_source = source.get_queue_source()
+    player_source.seek(100 / 8000)
+    audio_data = player_source.get_audio_data(10)
+    assert audio_data.get_string_data() == FRAMES[400:408]
+    assert player_source.get_audio_data(len(FRAMES)).get_string_data() == FRAMES[408:]
+    assert player_source.get_audio_data(4) is None